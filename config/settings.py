@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+from importlib.util import find_spec
 from pathlib import Path
 
 import environ
@@ -46,10 +47,20 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'vivaldi20',
-    'drf_yasg',   
 ]
 
+# drf_yasg is deliberately not an installed app: importing the package is slow and it is
+# only needed for the docs pages, which import it on first use. Its templates and static
+# files are found through its location instead (find_spec does not import it).
+DRF_YASG_DIR = Path(find_spec('drf_yasg').origin).parent
+
 MIDDLEWARE = [
+    # Outermost, so it measures the whole request
+    'vivaldi20.middleware.RequestMetricsMiddleware',
+    # Before anything else runs, so refused requests cost next to nothing
+    'vivaldi20.middleware.AdmissionControlMiddleware',
+    'vivaldi20.middleware.CompressionMiddleware',
+    'vivaldi20.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -64,7 +75,7 @@ ROOT_URLCONF = 'config.urls'
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'DIRS': [],
+        'DIRS': [DRF_YASG_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
@@ -83,11 +94,49 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# DATABASE_URL overrides the local SQLite file. Each of DATABASE_REPLICA_URLS adds a
+# read replica (replica_0, replica_1, ...), used through vivaldi20.routers.ReplicaRouter.
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': env.db('DATABASE_URL', default=f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
+}
+for index, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[])):
+    # Tests read the replicas through the primary's test database
+    DATABASES[f'replica_{index}'] = {**env.db_url_config(url), 'TEST': {'MIRROR': 'default'}}
+
+# Set by config.asgi. Under ASGI each request may run its queries in a different thread,
+# so persistent connections would pile up: connections are closed after every request.
+ASGI = env.bool('DJANGO_ASGI', default=False)
+
+for database in DATABASES.values():
+    # Persistent connections under WSGI, checked before reuse in each request
+    database['CONN_MAX_AGE'] = 0 if ASGI else env.int('CONN_MAX_AGE', default=60)
+    database['CONN_HEALTH_CHECKS'] = True
+
+# Reads of the VIEWS url names (GET/HEAD only) go to a random replica, unless the
+# authenticated member wrote in the last STICKY_SECONDS (tracked per member in
+# CACHE_ALIAS, which must be shared once WEB_CONCURRENCY is above 1) so they always
+# read their own writes. member-changes stays on
+# the primary: replication lag beyond MEMBERS_CHANGES_SETTLE_SECONDS would skip rows.
+DATABASE_REPLICATION = {
+    'REPLICAS': [alias for alias in DATABASES if alias != 'default'],
+    'VIEWS': env.list('DATABASE_REPLICA_VIEWS', default=['list-members', 'member-detail', 'search-members']),
+    'STICKY_SECONDS': env.int('DATABASE_REPLICA_STICKY_SECONDS', default=5),
+    'CACHE_ALIAS': env.str('DATABASE_REPLICA_CACHE_ALIAS', default='default'),
+}
+
+DATABASE_ROUTERS = ['vivaldi20.routers.ReplicaRouter'] if DATABASE_REPLICATION['REPLICAS'] else []
+
+
+# Cache
+# Use a shared backend (e.g. CACHE_URL=redis://...) when running several worker processes
+
+# Number of worker processes serving requests (as read by gunicorn). Caches that must
+# agree across workers refuse a process-local backend when it is above 1.
+WEB_CONCURRENCY = env.int('WEB_CONCURRENCY', default=1)
+
+CACHES = {
+    'default': env.cache_url('CACHE_URL', default='locmemcache://'),
 }
 
 
@@ -109,6 +158,19 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# New passwords are hashed with the first hasher; a password stored with any other one
+# is rehashed with it on the member's next successful login. Putting
+# django.contrib.auth.hashers.ScryptPasswordHasher first makes every login check several
+# times cheaper in CPU than the PBKDF2 default.
+# https://docs.djangoproject.com/en/5.0/topics/auth/passwords/#password-upgrading
+PASSWORD_HASHERS = env.list('PASSWORD_HASHERS', default=[
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+])
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -128,6 +190,7 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = '/static/'
+STATICFILES_DIRS = [DRF_YASG_DIR / 'static']
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -136,25 +199,170 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'vivaldi20.User'
 
+# ModelBackend with a one-query failure path for the login endpoint
+AUTHENTICATION_BACKENDS = ['vivaldi20.authentication.LoginBackend']
+
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'vivaldi20.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'vivaldi20.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.MultiPartParser',  # Add this for file uploads
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.JSONParser',
     ],
     'EXCEPTION_HANDLER': 'vivaldi20.utils.custom_exception_handler',
+    # Proxies in front of the app; 0 identifies clients by REMOTE_ADDR and ignores a
+    # client-supplied X-Forwarded-For, so the login throttle cannot be dodged with it
+    'NUM_PROXIES': env.int('NUM_PROXIES', default=0),
+}
+
+# Admission control (vivaldi20.middleware.AdmissionControlMiddleware): at most CONCURRENCY
+# requests per route class (url names in VIEWS) run at once in each worker process, up to
+# QUEUE_SIZE more wait QUEUE_TIMEOUT seconds for a slot, and the rest get 503 with
+# Retry-After. Routes outside the classes are not limited. Limits only bite with
+# threaded or async workers; leave CLASSES empty to turn admission control off.
+# A queued request of a threaded (WSGI) worker blocks its thread while it waits, so
+# those queue only up to SYNC_QUEUE_SIZE; keep it well below the thread count.
+ADMISSION_CONTROL = {
+    'RETRY_AFTER': env.int('ADMISSION_RETRY_AFTER', default=2),
+    'SYNC_QUEUE_SIZE': env.int('ADMISSION_SYNC_QUEUE_SIZE', default=0),
+    'CLASSES': {} if not env.bool('ADMISSION_CONTROL', default=True) else {
+        # Password hashing
+        'auth': {
+            'VIEWS': ['login', 'register', 'bulk-members'],
+            'CONCURRENCY': env.int('ADMISSION_AUTH_CONCURRENCY', default=4),
+            'QUEUE_SIZE': env.int('ADMISSION_AUTH_QUEUE_SIZE', default=16),
+            'QUEUE_TIMEOUT': 2.0,
+        },
+        # Uploads received and processed by the app
+        'photos': {
+            'VIEWS': ['update-profile-photo', 'profile-photo-confirm'],
+            'CONCURRENCY': env.int('ADMISSION_PHOTOS_CONCURRENCY', default=2),
+            'QUEUE_SIZE': env.int('ADMISSION_PHOTOS_QUEUE_SIZE', default=8),
+            'QUEUE_TIMEOUT': 5.0,
+        },
+        # Long streaming responses
+        'exports': {
+            'VIEWS': ['export-members'],
+            'CONCURRENCY': env.int('ADMISSION_EXPORTS_CONCURRENCY', default=2),
+            'QUEUE_SIZE': 0,
+            'QUEUE_TIMEOUT': 0,
+        },
+    },
+}
+
+# Response compression (vivaldi20.middleware.CompressionMiddleware): brotli when the
+# `brotli` package is installed and the client accepts it, gzip otherwise. Responses
+# under MIN_SIZE bytes are sent as is; streaming responses are always compressed.
+RESPONSE_COMPRESSION = {
+    'MIN_SIZE': env.int('COMPRESSION_MIN_SIZE', default=1024),
+    'GZIP_LEVEL': env.int('COMPRESSION_GZIP_LEVEL', default=6),
+    'BROTLI_QUALITY': env.int('COMPRESSION_BROTLI_QUALITY', default=4),
+    'CONTENT_TYPES': ['application/json', 'application/x-ndjson', 'text/', 'application/javascript'],
 }
 
+# Sliding-window limits on login attempts per client address and on failed attempts per
+# username, checked before the password is hashed. Point LOGIN_THROTTLE_CACHE_ALIAS at a
+# shared cache so the limits hold across worker processes.
+LOGIN_THROTTLE = {
+    'IP_RATE': env.str('LOGIN_IP_RATE', default='30/min'),
+    'USERNAME_RATE': env.str('LOGIN_USERNAME_RATE', default='10/min'),
+    'CACHE_ALIAS': env.str('LOGIN_THROTTLE_CACHE_ALIAS', default='default'),
+}
+
+# Serve the auth, member read and profile photo endpoints with native async views.
+# Turn on when running under ASGI (config.asgi); under WSGI the DRF views are faster.
+# Read once, when vivaldi20.urls builds its routes.
+ASYNC_VIEWS = env.bool('ASYNC_VIEWS', default=False)
+
+# Per-request instrumentation (vivaldi20.middleware.RequestMetricsMiddleware).
+# Metrics are kept per process. /metrics/ requires METRICS_TOKEN as a bearer token and is
+# only open without one in DEBUG. The Server-Timing header (query counts and timings) is
+# off by default outside DEBUG.
+REQUEST_METRICS = {
+    'SERVER_TIMING': env.bool('SERVER_TIMING', default=DEBUG),
+    'SLOW_REQUEST_MS': env.int('SLOW_REQUEST_MS', default=500),
+    # Queries kept per request for the slow request log
+    'SLOW_REQUEST_MAX_QUERIES': env.int('SLOW_REQUEST_MAX_QUERIES', default=50),
+    'METRICS_TOKEN': env.str('METRICS_TOKEN', default=None),
+}
+
+# Token authentication cache. Leave TOKEN_AUTH_CACHE_ALIAS unset for an in-process LRU,
+# or point it at a shared cache so logouts invalidate tokens across all workers; a shared
+# cache is required once WEB_CONCURRENCY is above 1.
+TOKEN_AUTH_CACHE = {
+    'MAX_ENTRIES': env.int('TOKEN_AUTH_CACHE_MAX_ENTRIES', default=10000),
+    'TTL': env.int('TOKEN_AUTH_CACHE_TTL', default=60),
+    'CACHE_ALIAS': env.str('TOKEN_AUTH_CACHE_ALIAS', default=None),
+}
+
+# Auth token lifetime (seconds). A token expires once unused for TTL; using it moves the
+# expiry on, at most once per REFRESH_INTERVAL so most requests do not write.
+# Expired tokens are deleted by `sweep_tokens`, SWEEP_BATCH_SIZE rows per transaction.
+TOKEN_EXPIRY = {
+    'TTL': env.int('TOKEN_TTL', default=14 * 24 * 3600),
+    'REFRESH_INTERVAL': env.int('TOKEN_REFRESH_INTERVAL', default=3600),
+    'SWEEP_BATCH_SIZE': env.int('TOKEN_SWEEP_BATCH_SIZE', default=1000),
+}
+
+# Versioned response cache for member reads (ETag / 304 support).
+# Versions must live in a cache shared by all workers for cross-process invalidation;
+# in a process-local cache (locmem) they expire after LOCAL_VERSION_TTL seconds, so
+# writes made by other processes show up at most that late.
+MEMBER_RESPONSE_CACHE = {
+    'CACHE_ALIAS': env.str('MEMBER_RESPONSE_CACHE_ALIAS', default='default'),
+    'TIMEOUT': env.int('MEMBER_RESPONSE_CACHE_TIMEOUT', default=300),
+    'LOCAL_VERSION_TTL': env.int('MEMBER_RESPONSE_CACHE_LOCAL_VERSION_TTL', default=5),
+}
+
+# Members list pagination (cursor based, ordered by id)
+MEMBERS_PAGE_SIZE = env.int('MEMBERS_PAGE_SIZE', default=50)
+MEMBERS_MAX_PAGE_SIZE = env.int('MEMBERS_MAX_PAGE_SIZE', default=200)
+
+# Streaming member export: rows fetched per query chunk and bytes per write
+MEMBERS_EXPORT = {
+    'CHUNK_SIZE': env.int('MEMBERS_EXPORT_CHUNK_SIZE', default=2000),
+    'WRITE_SIZE': env.int('MEMBERS_EXPORT_WRITE_SIZE', default=64 * 1024),
+}
+
+# Largest batch accepted by the bulk member endpoints. Creating members hashes every
+# password (a few hundred ms each), so bulk creation takes smaller batches, hashed on
+# MEMBERS_BULK_HASH_THREADS threads; use `import_members` for large cohorts.
+MEMBERS_BULK_MAX_ITEMS = env.int('MEMBERS_BULK_MAX_ITEMS', default=500)
+MEMBERS_BULK_CREATE_MAX_ITEMS = env.int('MEMBERS_BULK_CREATE_MAX_ITEMS', default=50)
+MEMBERS_BULK_HASH_THREADS = env.int('MEMBERS_BULK_HASH_THREADS', default=4)
+
+# Delta sync (/members/changes/): writes younger than the settle window are held back
+# until in-flight transactions have committed; deletions are kept for the retention
+# period (prune_member_tombstones), older cursors get 410 and must sync from scratch.
+MEMBERS_CHANGES_SETTLE_SECONDS = env.int('MEMBERS_CHANGES_SETTLE_SECONDS', default=5)
+MEMBERS_TOMBSTONE_RETENTION_DAYS = env.int('MEMBERS_TOMBSTONE_RETENTION_DAYS', default=30)
+
+
+# Cold start budgets checked by `manage.py startup_budget` (milliseconds, whole process)
+STARTUP_BUDGET_MS = {
+    'wsgi': env.int('STARTUP_BUDGET_WSGI_MS', default=900),
+    'manage': env.int('STARTUP_BUDGET_MANAGE_MS', default=700),
+}
+
+# Prebuilt OpenAPI document (`manage.py build_openapi_schema`). Used when it matches the
+# current code, otherwise the schema is generated once per process on first request.
+OPENAPI_SCHEMA_FILE = env.str('OPENAPI_SCHEMA_FILE', default=str(BASE_DIR / 'openapi.json'))
+OPENAPI_SCHEMA_MAX_AGE = env.int('OPENAPI_SCHEMA_MAX_AGE', default=3600)
 
 SWAGGER_SETTINGS = {
     'USE_SESSION_AUTH': False,
+    # The UIs load the precomputed document instead of regenerating it
+    'SPEC_URL': 'openapi-schema',
     'DEFAULT_FIELD_INSPECTORS': [
         'drf_yasg.inspectors.CamelCaseJSONFilter',
         'drf_yasg.inspectors.InlineSerializerInspector',
@@ -175,12 +383,18 @@ SWAGGER_SETTINGS = {
     }
  }
 
-# AWS S3 Settings
-AWS_ACCESS_KEY_ID = env.str('AWS_ACCESS_KEY_ID')
-AWS_SECRET_ACCESS_KEY = env.str('AWS_SECRET_ACCESS_KEY')
-AWS_STORAGE_BUCKET_NAME = env.str('AWS_STORAGE_BUCKET_NAME')
-AWS_S3_REGION_NAME = env.str('AWS_S3_REGION_NAME')  # Optional, set your region
-AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
+REDOC_SETTINGS = {
+    'SPEC_URL': 'openapi-schema',
+}
+
+# AWS S3 Settings. Without a bucket, uploads are stored on the local filesystem instead.
+AWS_ACCESS_KEY_ID = env.str('AWS_ACCESS_KEY_ID', default=None)
+AWS_SECRET_ACCESS_KEY = env.str('AWS_SECRET_ACCESS_KEY', default=None)
+AWS_STORAGE_BUCKET_NAME = env.str('AWS_STORAGE_BUCKET_NAME', default=None)
+AWS_S3_REGION_NAME = env.str('AWS_S3_REGION_NAME', default=None)  # Optional, set your region
+# Point at a local S3 stand-in (MinIO, moto server, ...) for development and tests
+AWS_S3_ENDPOINT_URL = env.str('AWS_S3_ENDPOINT_URL', default=None)
+AWS_S3_CUSTOM_DOMAIN = None if AWS_S3_ENDPOINT_URL or not AWS_STORAGE_BUCKET_NAME else f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
 AWS_DEFAULT_ACL = None
 
 # Static files (CSS, JavaScript, Images)
@@ -188,8 +402,44 @@ AWS_S3_OBJECT_PARAMETERS = {
     'CacheControl': 'max-age=86400',
 }
 
-# Storage settings
-DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+# Storage settings. Backends are instantiated (and boto3 imported) on first use.
+STORAGES = {
+    'default': {'BACKEND': 'vivaldi20.s3storage.S3Storage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
 
-# Optional: Set URL for uploaded files
-MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/'
\ No newline at end of file
+if AWS_STORAGE_BUCKET_NAME:
+    # Optional: Set URL for uploaded files
+    MEDIA_URL = f'https://{AWS_S3_CUSTOM_DOMAIN}/' if AWS_S3_CUSTOM_DOMAIN else f'{AWS_S3_ENDPOINT_URL}/{AWS_STORAGE_BUCKET_NAME}/'
+else:
+    STORAGES['default'] = {'BACKEND': 'vivaldi20.storage.LocalStorage'}
+    MEDIA_ROOT = env.str('MEDIA_ROOT', default=str(BASE_DIR / 'media'))
+    MEDIA_URL = '/media/'
+
+# Direct-to-S3 profile photo uploads (presigned POST)
+PROFILE_PHOTO_DIRECT_UPLOAD = {
+    'MAX_BYTES': env.int('PROFILE_PHOTO_MAX_BYTES', default=10 * 1024 * 1024),
+    'EXPIRES_IN': env.int('PROFILE_PHOTO_UPLOAD_EXPIRES_IN', default=600),
+}
+
+# Profile photo derivatives generated in the background after each upload
+PROFILE_PHOTO_DERIVATIVES = {
+    'SIZES': {'small': 96, 'medium': 320},
+    'FORMATS': ['webp', 'jpg'],
+    'QUALITY': env.int('PROFILE_PHOTO_DERIVATIVE_QUALITY', default=80),
+    # Originals above this many pixels are left without derivatives
+    'MAX_PIXELS': env.int('PROFILE_PHOTO_MAX_PIXELS', default=50_000_000),
+    # Only JPEGs can be decoded at a reduced scale: other formats (PNG, WebP, GIF) are
+    # decoded in full, so above this many pixels they are left without derivatives
+    'MAX_DECODE_PIXELS': env.int('PROFILE_PHOTO_MAX_DECODE_PIXELS', default=12_000_000),
+}
+
+# Background storage jobs (photo deletion and other cleanups run after commit)
+STORAGE_JOBS = {
+    'WORKERS': env.int('STORAGE_JOB_WORKERS', default=4),
+    'MAX_ATTEMPTS': env.int('STORAGE_JOB_MAX_ATTEMPTS', default=8),
+    'BACKOFF_BASE': env.float('STORAGE_JOB_BACKOFF_BASE', default=2.0),
+    'BACKOFF_MAX': env.float('STORAGE_JOB_BACKOFF_MAX', default=600.0),
+    # Run jobs inline on commit instead of in the worker pool (tests, scripts)
+    'EAGER': env.bool('STORAGE_JOBS_EAGER', default=False),
+}
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from collections import deque
+
+# Per-process concurrency limits for expensive route classes (ADMISSION_CONTROL).
+# Waiting requests are served first come, first served: a finishing request
+# hands its slot straight to the oldest waiter.
+
+
+class _AsyncWaiter:
+    # Wakes a coroutine waiting on its event loop, from any thread
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+    def set(self):
+        self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class ConcurrencyLimiter:
+    """
+    At most `concurrency` requests at a time, up to `queue_size` more waiting
+    at most `queue_timeout` seconds for a slot; anything beyond is refused at
+    once. Works for threads and coroutines alike, but a waiting thread is a
+    worker thread doing nothing: threads only queue while fewer than
+    `sync_queue_size` requests are waiting.
+    """
+
+    def __init__(self, concurrency, queue_size, queue_timeout, sync_queue_size=0):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.sync_queue_size = min(sync_queue_size, queue_size)
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+
+    def _enter(self, make_waiter, queue_size):
+        # True when admitted, False when refused, else the queued waiter
+        with self._lock:
+            if self._active < self.concurrency:
+                self._active += 1
+                return True
+            if len(self._waiters) >= queue_size:
+                return False
+            waiter = make_waiter()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter):
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                # Handed a slot just as the wait timed out
+                return True
+            return False
+
+    def acquire(self):
+        waiter = self._enter(threading.Event, self.sync_queue_size)
+        if isinstance(waiter, bool):
+            return waiter
+        return waiter.wait(self.queue_timeout) or self._abandon(waiter)
+
+    async def aacquire(self):
+        waiter = self._enter(_AsyncWaiter, self.queue_size)
+        if isinstance(waiter, bool):
+            return waiter
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._abandon(waiter)
+        except asyncio.CancelledError:
+            # Client gone while queued
+            if self._abandon(waiter):
+                self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if not self._waiters:
+                self._active -= 1
+                return
+            waiter = self._waiters.popleft()
+        waiter.set()
+
+    def releaser(self):
+        # A release() for one slot that may be called any number of times
+        once = threading.Lock()
+
+        def release():
+            if once.acquire(blocking=False):
+                self.release()
+
+        return release
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class Vivaldi20Config(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vivaldi20'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from . import signals
+
+        # The full-text index lives outside the model state, so (re)create it after every migrate
+        post_migrate.connect(signals.install_search_index_after_migrate, sender=self)
@@ -0,0 +1,271 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.authtoken.models import Token
+
+from .authentication import CachedTokenAuthentication, check_login, issue_token
+from .caching import MEMBERS_SCOPE, member_scope, acached_member_response
+from .docs import document_as
+from .models import User
+from .photos import (
+    ContentHashUploadHandler,
+    DirectUploadNotSupported,
+    attach_photo,
+    new_upload_key,
+    presigned_photo_upload,
+    store_uploaded_photo,
+    uploaded_photo_metadata,
+)
+from .throttling import LOGIN_THROTTLES, record_failed_login
+from .serializers import ProfilePhotoConfirmSerializer, ProfilePhotoUploadSerializer
+from .views import (
+    _direct_upload_not_supported_response,
+    _invalid_credentials_response,
+    _invalid_uploaded_photo_response,
+    _login_response,
+    _member_detail_response,
+    _member_list_response,
+    _missing_credentials_response,
+    _photo_updated_response,
+    _photo_upload_url_response,
+    login_view,
+    logout_view,
+    list_members_view,
+    member_detail_view,
+    update_profile_photo_view,
+    profile_photo_upload_url_view,
+    confirm_profile_photo_upload_view,
+)
+
+# Async versions of the member read, auth and profile photo endpoints, routed in
+# place of the DRF views when ASYNC_VIEWS is on (ASGI deployments). Validation
+# and response bodies are shared with views.py; queries run on Django's database
+# thread and blocking storage calls in other worker threads, so the event loop
+# keeps serving other requests meanwhile.
+
+# The storage backends talk to S3 over the network: keep them off the thread
+# that runs the ORM queries
+storage_call = sync_to_async(thread_sensitive=False)
+
+_authentication = CachedTokenAuthentication()
+
+
+def async_api_view(http_method_names, sync_view, authenticated=True, throttle_classes=()):
+    """
+    A minimal async `@api_view`: wraps the request in a DRF `Request`,
+    negotiates the renderer like `APIView`, checks the token like
+    `IsAuthenticated` would and applies `throttle_classes`. Whatever only a
+    full DRF view can answer (other methods, the browsable API, an
+    unacceptable Accept header) is passed on to `sync_view`.
+    """
+
+    def decorator(view):
+        @csrf_exempt
+        @wraps(view)
+        async def wrapped_view(request, *args, **kwargs):
+            negotiator = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS()
+            renderers = [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES]
+            drf_request = Request(
+                request,
+                parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                negotiator=negotiator,
+            )
+            try:
+                renderer, media_type = negotiator.select_renderer(drf_request, renderers)
+            except exceptions.NotAcceptable:
+                renderer = None
+            if request.method not in http_method_names or renderer is None or isinstance(renderer, BrowsableAPIRenderer):
+                return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+            drf_request.accepted_renderer = renderer
+            drf_request.accepted_media_type = media_type
+            response = await _dispatch(view, drf_request, authenticated, throttle_classes, *args, **kwargs)
+            if isinstance(response, Response):
+                response.accepted_renderer = renderer
+                response.accepted_media_type = media_type
+                response.renderer_context = {'request': drf_request, 'response': response, 'args': args, 'kwargs': kwargs}
+            return response
+
+        return wrapped_view
+
+    return decorator
+
+
+async def _dispatch(view, request, authenticated, throttle_classes, *args, **kwargs):
+    if authenticated:
+        try:
+            credentials = await _authentication.aauthenticate(request)
+        except exceptions.AuthenticationFailed:
+            credentials = None
+        if credentials is None:
+            # Same body as the DRF views get from custom_exception_handler
+            return Response({"message": "Unauthenticated."}, status=status.HTTP_401_UNAUTHORIZED, headers={
+                'WWW-Authenticate': _authentication.authenticate_header(request),
+            })
+        request.user, request.auth = credentials
+
+    try:
+        await _check_throttles(request, throttle_classes)
+        return await view(request, *args, **kwargs)
+    except exceptions.APIException as exc:
+        # Parse errors and the like, answered as the DRF views would
+        response = api_settings.EXCEPTION_HANDLER(exc, {'view': None, 'args': args, 'kwargs': kwargs, 'request': request})
+        if response is None:
+            raise
+        return response
+
+
+async def _check_throttles(request, throttle_classes):
+    # As APIView.check_throttles; the throttle history lives in a (possibly remote) cache
+    waits = []
+    for throttle_class in throttle_classes:
+        throttle = throttle_class()
+        if not await sync_to_async(throttle.allow_request)(request, None):
+            waits.append(throttle.wait())
+    if waits:
+        raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+
+async def _get_member(id):
+    try:
+        return await User.objects.aget(id=id)
+    except User.DoesNotExist:
+        return None
+
+
+# Login View (Async)
+@document_as(login_view)
+@async_api_view(['POST'], login_view, authenticated=False, throttle_classes=LOGIN_THROTTLES)
+async def async_login_view(request):
+    username = request.data.get('username')
+    password = request.data.get('password')
+
+    missing = _missing_credentials_response(username, password)
+    if missing is not None:
+        return missing
+
+    # Password hashing runs in a thread
+    user, user_exists = await sync_to_async(check_login)(request, username, password)
+    if user is None:
+        await sync_to_async(record_failed_login)(request)
+        return _invalid_credentials_response(user_exists)
+
+    token = await sync_to_async(issue_token)(user)
+    return _login_response(user, token)
+
+
+# Logout View (Async)
+@document_as(logout_view)
+@async_api_view(['POST'], logout_view)
+async def async_logout_view(request):
+    deleted, _ = await Token.objects.filter(user=request.user).adelete()
+    if not deleted:
+        return Response({"data": {"message": "Token not found."}}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"data": {"message": "Successfully logged out."}}, status=status.HTTP_200_OK)
+
+
+# List Members View (Async)
+@document_as(list_members_view)
+@async_api_view(['GET'], list_members_view)
+async def async_list_members_view(request):
+    # Cache hits and 304s never leave the event loop; a miss builds the page like the DRF view
+    return await acached_member_response(request, MEMBERS_SCOPE, lambda: sync_to_async(_member_list_response)(request))
+
+
+# Member Detail View (Async)
+# GET is served here; writes go to the DRF view
+@document_as(member_detail_view)
+@async_api_view(['GET'], member_detail_view)
+async def async_member_detail_view(request, pk):
+    return await acached_member_response(request, member_scope(pk), lambda: sync_to_async(_member_detail_response)(request, pk))
+
+
+# Update Profile Photo View (Async)
+@document_as(update_profile_photo_view)
+@async_api_view(['PATCH'], update_profile_photo_view)
+async def async_update_profile_photo_view(request, id):
+    hasher = ContentHashUploadHandler(request._request)
+    request.upload_handlers.insert(0, hasher)
+
+    user = await _get_member(id)
+    if user is None:
+        return Response({"data": {"message": "User not found."}}, status=status.HTTP_404_NOT_FOUND)
+
+    # Parsing the body spools and hashes the upload: do it in a worker thread, not on the event loop
+    files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+    if 'profile_photo' not in files:
+        return Response({"data": {"message": "No photo provided."}}, status=status.HTTP_400_BAD_REQUEST)
+
+    uploaded_file = files['profile_photo']
+    # The PUT, when needed, runs on the database thread: it has to happen while
+    # the transaction holds the blob row
+    await sync_to_async(transaction.atomic(store_uploaded_photo))(user, uploaded_file, hasher.digests['profile_photo'])
+
+    return await sync_to_async(_photo_updated_response)(user)
+
+
+# Profile Photo Upload URL View (Async)
+@document_as(profile_photo_upload_url_view)
+@async_api_view(['POST'], profile_photo_upload_url_view)
+async def async_profile_photo_upload_url_view(request, id):
+    user = await _get_member(id)
+    if user is None:
+        return Response({"data": {"message": "User not found."}}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = ProfilePhotoUploadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type = serializer.validated_data['content_type']
+    key = new_upload_key(user, content_type)
+    try:
+        upload = await storage_call(presigned_photo_upload)(key, content_type)
+    except DirectUploadNotSupported:
+        return _direct_upload_not_supported_response()
+
+    return _photo_upload_url_response(key, upload)
+
+
+# Confirm Profile Photo Upload View (Async)
+@document_as(confirm_profile_photo_upload_view)
+@async_api_view(['POST'], confirm_profile_photo_upload_view)
+async def async_confirm_profile_photo_upload_view(request, id):
+    user = await _get_member(id)
+    if user is None:
+        return Response({"data": {"message": "User not found."}}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = ProfilePhotoConfirmSerializer(data=request.data, context={'user': user})
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    key = serializer.validated_data['key']
+    try:
+        metadata = await storage_call(uploaded_photo_metadata)(key)
+    except DirectUploadNotSupported:
+        return _direct_upload_not_supported_response()
+
+    invalid = _invalid_uploaded_photo_response(metadata)
+    if invalid is not None:
+        return invalid
+
+    await sync_to_async(transaction.atomic(attach_photo))(user, key)
+    return await sync_to_async(_photo_updated_response)(user)
+
+
+# Routes served by the async views above when ASYNC_VIEWS is on, by url name
+ASYNC_ROUTES = {
+    'login': async_login_view,
+    'logout': async_logout_view,
+    'list-members': async_list_members_view,
+    'member-detail': async_member_detail_view,
+    'update-profile-photo': async_update_profile_photo_view,
+    'profile-photo-upload-url': async_profile_photo_upload_url_view,
+    'profile-photo-confirm': async_confirm_profile_photo_upload_view,
+}
@@ -0,0 +1,304 @@
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.authtoken.models import Token
+
+from .models import User
+from .routers import reading_from_replica, use_primary
+from .shared_cache import is_shared_cache
+
+
+class TokenCache:
+    """
+    Bounded LRU of resolved tokens with a TTL.
+
+    When `cache_alias` is set the entries live in that Django cache instead, so
+    every worker process sees the same entries and the same invalidations.
+    With several workers a process-local cache would keep serving tokens that
+    another worker logged out, so `from_settings` refuses that configuration.
+    """
+
+    key_prefix = 'auth-token'
+
+    def __init__(self, max_entries, ttl, cache_alias=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        options = settings.TOKEN_AUTH_CACHE
+        cache_alias = options.get('CACHE_ALIAS')
+        if settings.WEB_CONCURRENCY > 1 and not (cache_alias and is_shared_cache(cache_alias)):
+            raise ImproperlyConfigured(
+                "TOKEN_AUTH_CACHE['CACHE_ALIAS'] must name a cache shared by all workers when WEB_CONCURRENCY is above 1."
+            )
+        return cls(options['MAX_ENTRIES'], options['TTL'], cache_alias)
+
+    @property
+    def shared(self):
+        return caches[self.cache_alias] if self.cache_alias else None
+
+    def _cache_key(self, key):
+        # Never keep raw token keys in a shared cache
+        return '%s:%s' % (self.key_prefix, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        if self.shared is not None:
+            return self.shared.get(self._cache_key(key))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, token = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        # Hand out a copy so concurrent requests never share one model instance
+        return copy.deepcopy(token)
+
+    def set(self, key, token):
+        if self.shared is not None:
+            self.shared.set(self._cache_key(key), token, self.ttl)
+            return
+
+        token = copy.deepcopy(token)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, token)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def aget(self, key):
+        if self.shared is not None:
+            return await self.shared.aget(self._cache_key(key))
+        return self.get(key)
+
+    async def aset(self, key, token):
+        if self.shared is not None:
+            await self.shared.aset(self._cache_key(key), token, self.ttl)
+            return
+        self.set(key, token)
+
+    def invalidate(self, key):
+        if self.shared is not None:
+            self.shared.delete(self._cache_key(key))
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    async def ainvalidate(self, key):
+        if self.shared is not None:
+            await self.shared.adelete(self._cache_key(key))
+            return
+        self.invalidate(key)
+
+    def invalidate_user(self, user_id):
+        if self.shared is not None:
+            keys = Token.objects.filter(user_id=user_id).values_list('key', flat=True)
+            self.shared.delete_many([self._cache_key(key) for key in keys])
+            return
+
+        with self._lock:
+            stale = [key for key, (_, token) in self._entries.items() if token.user_id == user_id]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache.from_settings()
+
+
+# Token states, see token_state
+VALID, STALE, EXPIRED = 'valid', 'stale', 'expired'
+
+
+def token_state(token, now=None):
+    # `created` holds the time the token was issued or last refreshed
+    options = settings.TOKEN_EXPIRY
+    age = ((now or timezone.now()) - token.created).total_seconds()
+    if age >= options['TTL']:
+        return EXPIRED
+    if age >= options['REFRESH_INTERVAL']:
+        return STALE
+    return VALID
+
+
+def refresh_token(token):
+    # Sliding expiry: a single UPDATE, no signals, so the user's cached tokens stay put
+    token.created = timezone.now()
+    Token.objects.filter(key=token.key).update(created=token.created)
+
+
+def issue_token(user):
+    """
+    The member's token for a successful login: the current one, refreshed, or
+    a new key when it has expired.
+    """
+    token, created = Token.objects.get_or_create(user=user)
+    if created:
+        return token
+
+    state = token_state(token)
+    if state is EXPIRED:
+        token.delete()
+        token = Token.objects.create(user=user)
+    elif state is STALE:
+        refresh_token(token)
+    return token
+
+
+def sweep_expired_tokens(batch_size, now=None):
+    """
+    Delete one batch of expired tokens, returning how many were deleted.
+
+    Each batch is its own short transaction on the `created` index, so a large
+    backlog never holds long locks on the table.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.TOKEN_EXPIRY['TTL'])
+    keys = list(Token.objects.filter(created__lte=cutoff).order_by('created').values_list('key', flat=True)[:batch_size])
+    if not keys:
+        return 0
+    # Rechecked in the delete, in case a token was refreshed meanwhile
+    deleted, _ = Token.objects.filter(key__in=keys, created__lte=cutoff).delete()
+    return deleted
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # Resolves tokens from `token_cache` and only falls back to the
+    # token + user query on a miss.
+
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            try:
+                user, token = super().authenticate_credentials(key)
+            except exceptions.AuthenticationFailed:
+                if not reading_from_replica():
+                    raise
+                # A token issued moments ago may not have reached the replica yet
+                with use_primary():
+                    user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+
+        state = token_state(token)
+        if state is EXPIRED:
+            token_cache.invalidate(key)
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        if state is STALE:
+            refresh_token(token)
+            token_cache.set(key, token)
+        return (token.user, token)
+
+    # Async counterparts for the ASGI views, which run outside DRF's request cycle
+
+    async def aauthenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header. Token string should not contain invalid characters.'))
+        return await self.aauthenticate_credentials(key)
+
+    async def aauthenticate_credentials(self, key):
+        token = await token_cache.aget(key)
+        if token is not None:
+            return await self._acheck_expiry(key, token)
+
+        token = await self._aget_token(key)
+        if token is None and reading_from_replica():
+            with use_primary():
+                token = await self._aget_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+
+        await token_cache.aset(key, token)
+        return await self._acheck_expiry(key, token)
+
+    async def _aget_token(self, key):
+        try:
+            return await self.get_model().objects.select_related('user').aget(key=key)
+        except self.get_model().DoesNotExist:
+            return None
+
+    async def _acheck_expiry(self, key, token):
+        state = token_state(token)
+        if state is EXPIRED:
+            await token_cache.ainvalidate(key)
+            raise exceptions.AuthenticationFailed(_('Token has expired.'))
+        if state is STALE:
+            await sync_to_async(refresh_token)(token)
+            await token_cache.aset(key, token)
+        return (token.user, token)
+
+
+class LoginBackend(ModelBackend):
+    """
+    ModelBackend whose failures cost a single lookup: an unknown username is
+    rejected without hashing a dummy password, since the login response tells
+    the two apart anyway. Whether the username exists is left on the request
+    for `check_login`.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            user = None
+        if request is not None:
+            request.login_user_exists = user is not None
+        if user is not None and user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+
+def check_login(request, username, password):
+    """
+    Check login credentials through AUTHENTICATION_BACKENDS, returning
+    (user, user_exists); `user` is None unless a backend accepts them.
+
+    Failures send `user_login_failed` like any `authenticate()` call. With
+    LoginBackend configured they cost one query; other backends pay for an
+    extra lookup that tells an unknown username from a wrong password. The
+    password is rehashed once verified if it was stored with an outdated
+    hasher (see PASSWORD_HASHERS).
+    """
+    user = authenticate(request, username=username, password=password)
+    if user is not None:
+        return user, True
+    user_exists = getattr(request, 'login_user_exists', None)
+    if user_exists is None:
+        user_exists = User._default_manager.filter(**{User.USERNAME_FIELD: username}).exists()
+    return None, user_exists
@@ -0,0 +1,258 @@
+import io
+import itertools
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import token_cache
+from .caching import bump_member_versions
+from .models import User
+from .photos import new_upload_key
+
+# Shared by the query budget tests (tests.py) and `manage.py benchmark_api`
+
+SEED_PASSWORD = 'benchmark-password'
+SEED_PROFESSIONS = ['AWS Cloud Practitioner', 'Developer', 'Designer', 'Data Engineer', 'Product Manager']
+
+# Members touched per request by the bulk scenarios
+BULK_SIZE = 10
+
+# Private in-process cache of benchmark runs and tests, emptied by clear_caches()
+BENCHMARK_CACHE_ALIAS = 'benchmark'
+
+_unique = itertools.count()
+
+
+def seed_members(count, batch_size=5000, progress=None):
+    """
+    Add `count` members with varied professions and bios. The password is
+    hashed once and shared, so seeding a million rows stays I/O bound.
+    """
+    password = make_password(SEED_PASSWORD)
+    start = User.objects.count()
+    for offset in range(start, start + count, batch_size):
+        size = min(batch_size, start + count - offset)
+        User.objects.bulk_create([
+            User(
+                username='member%07d' % index,
+                first_name='First%d' % index,
+                last_name='Last%d' % (index % 997),
+                profession=SEED_PROFESSIONS[index % len(SEED_PROFESSIONS)],
+                bio='Seeded member %d working on cloud and web projects.' % index,
+                password=password,
+            )
+            for index in range(offset, offset + size)
+        ], batch_size=batch_size)
+        if progress:
+            progress(offset + size - start)
+    # bulk_create sends no signals
+    bump_member_versions()
+
+
+def benchmark_settings():
+    """
+    Settings overrides pointing the response cache, login throttle and
+    replica pins at BENCHMARK_CACHE_ALIAS, so clearing it between requests
+    never touches a cache that live workers share.
+    """
+    return dict(
+        CACHES=dict(settings.CACHES, **{BENCHMARK_CACHE_ALIAS: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'vivaldi20-benchmark',
+        }}),
+        MEMBER_RESPONSE_CACHE=dict(settings.MEMBER_RESPONSE_CACHE, CACHE_ALIAS=BENCHMARK_CACHE_ALIAS),
+        LOGIN_THROTTLE=dict(settings.LOGIN_THROTTLE, CACHE_ALIAS=BENCHMARK_CACHE_ALIAS),
+        DATABASE_REPLICATION=dict(settings.DATABASE_REPLICATION, CACHE_ALIAS=BENCHMARK_CACHE_ALIAS),
+    )
+
+
+def clear_caches():
+    # Cold start for every measured request: nothing cached from the previous one
+    caches[BENCHMARK_CACHE_ALIAS].clear()
+    token_cache.clear()
+
+
+def photo_bytes():
+    # A small JPEG with different bytes every call, so uploads are never deduplicated
+    from PIL import Image
+
+    value = next(_unique)
+    buffer = io.BytesIO()
+    # Neighbouring colours can encode to the same JPEG: the comment keeps the bytes apart
+    Image.new('RGB', (64, 64), (value % 256, value // 256 % 256, 128)).save(buffer, 'JPEG', comment=b'%d' % value)
+    buffer.name = 'photo.jpg'
+    buffer.seek(0)
+    return buffer
+
+
+class ApiBench:
+    """
+    Fixtures and an authenticated client for driving the API endpoints.
+    """
+
+    def __init__(self):
+        self.client = APIClient()
+        self.member = self.new_member()
+        self.member_token = Token.objects.create(user=self.member).key
+        self.admin = self.new_member(is_staff=True)
+        self.admin_token = Token.objects.create(user=self.admin).key
+        self.member_ids = list(User.objects.order_by('id').values_list('id', flat=True)[:50])
+
+    def new_member(self, **fields):
+        username = 'bench%d' % next(_unique)
+        user = User(username=username, first_name='Bench', **fields)
+        user.set_password(SEED_PASSWORD)
+        user.save()
+        return user
+
+    def call(self, method, path, token=None, data=None, format='json'):
+        if token:
+            self.client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+        else:
+            self.client.credentials()
+        response = getattr(self.client, method)(path, data=data, format=format)
+        if response.streaming:
+            # Streamed bodies are produced (and queried) while being read
+            b''.join(response.streaming_content)
+        return response
+
+
+class Scenario:
+    """
+    One endpoint call. `prepare(bench)` runs untimed before each request and
+    returns the arguments for `ApiBench.call`.
+    """
+
+    def __init__(self, name, prepare, status, query_budget):
+        self.name = name
+        self.prepare = prepare
+        self.status = status
+        self.query_budget = query_budget
+
+
+def _registration(bench):
+    username = 'new%d' % next(_unique)
+    return ('post', reverse('register'), None, {
+        'username': username, 'first_name': 'New', 'last_name': 'Member', 'password': SEED_PASSWORD,
+    })
+
+
+def _logout(bench):
+    return ('post', reverse('logout'), Token.objects.create(user=bench.new_member()).key, None)
+
+
+def _member_update(bench):
+    return ('put', reverse('member-detail', args=[bench.member.pk]), bench.member_token, {
+        'username': bench.member.username, 'first_name': 'Updated', 'last_name': 'Member',
+        'profession': 'Developer', 'bio': 'Updated bio',
+    })
+
+
+def _member_delete(bench):
+    return ('delete', reverse('member-detail', args=[bench.new_member().pk]), bench.member_token, None)
+
+
+def _bulk_create(bench):
+    return ('post', reverse('bulk-members'), bench.admin_token, [
+        {'username': 'bulk%d' % next(_unique), 'first_name': 'Bulk', 'last_name': 'Member', 'password': SEED_PASSWORD}
+        for _ in range(BULK_SIZE)
+    ])
+
+
+def _bulk_update(bench):
+    return ('patch', reverse('bulk-members'), bench.admin_token, [
+        {'id': pk, 'bio': 'Bulk updated %d' % next(_unique)} for pk in bench.member_ids[:BULK_SIZE]
+    ])
+
+
+def _bulk_delete(bench):
+    ids = [bench.new_member().pk for _ in range(BULK_SIZE)]
+    return ('post', reverse('bulk-delete-members'), bench.admin_token, {'ids': ids})
+
+
+def _photo_update(bench):
+    path = reverse('update-profile-photo', args=[bench.member.pk])
+    return ('patch', path, bench.member_token, {'profile_photo': photo_bytes()}, 'multipart')
+
+
+def _photo_confirm(bench):
+    path = reverse('profile-photo-confirm', args=[bench.member.pk])
+    return ('post', path, bench.member_token, {'key': new_upload_key(bench.member, 'image/jpeg')})
+
+
+# Query budgets are for a cold cache (clear_caches) and must not depend on the
+# number of members: an N+1 or unbounded query shows up as a budget overrun.
+# Transaction statements are not counted, see count_queries.
+SCENARIOS = [
+    Scenario('schema', lambda bench: ('get', reverse('openapi-schema'), None, None), 200, 0),
+    Scenario('swagger-ui', lambda bench: ('get', reverse('schema-swagger-ui'), None, None), 200, 0),
+    Scenario('redoc', lambda bench: ('get', reverse('schema-redoc'), None, None), 200, 0),
+    # Unpublished without METRICS_TOKEN
+    Scenario('metrics', lambda bench: ('get', reverse('metrics'), None, None), 404, 0),
+    Scenario('register', _registration, 201, 2),
+    Scenario('login', lambda bench: ('post', reverse('login'), None, {'username': bench.member.username, 'password': SEED_PASSWORD}), 200, 2),
+    Scenario('login-invalid', lambda bench: ('post', reverse('login'), None, {'username': bench.member.username, 'password': 'wrong'}), 422, 1),
+    Scenario('logout', _logout, 200, 2),
+    Scenario('members-list', lambda bench: ('get', reverse('list-members'), bench.member_token, None), 200, 2),
+    Scenario('members-list-filtered', lambda bench: ('get', reverse('list-members') + '?profession=Developer&ordering=-date_joined&fields=id,username', bench.member_token, None), 200, 2),
+    Scenario('members-search', lambda bench: ('get', reverse('search-members') + '?q=member', bench.member_token, None), 200, 3),
+    Scenario('members-changes', lambda bench: ('get', reverse('member-changes') + '?page_size=100', bench.member_token, None), 200, 3),
+    Scenario('members-export', lambda bench: ('get', reverse('export-members') + '?output=csv', bench.member_token, None), 200, 2),
+    Scenario('member-detail', lambda bench: ('get', reverse('member-detail', args=[bench.member.pk]), bench.member_token, None), 200, 2),
+    Scenario('member-update', _member_update, 200, 4),
+    Scenario('member-delete', _member_delete, 200, 8),
+    Scenario('bulk-create', _bulk_create, 201, 3),
+    Scenario('bulk-update', _bulk_update, 200, 3),
+    # post_delete writes one tombstone per member
+    Scenario('bulk-delete', _bulk_delete, 200, 8 + BULK_SIZE),
+    Scenario('photo-update', _photo_update, 200, 11),
+    # Direct uploads need S3; on local storage both steps answer 501
+    Scenario('photo-upload-url', lambda bench: ('post', reverse('profile-photo-upload-url', args=[bench.member.pk]), bench.member_token, {'content_type': 'image/jpeg'}), 501, 2),
+    Scenario('photo-confirm', _photo_confirm, 501, 2),
+]
+
+
+# Transaction statements depend on whether the request runs inside a test case
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+
+
+def count_queries(captured):
+    return sum(1 for query in captured if not query['sql'].startswith(TRANSACTION_STATEMENTS))
+
+
+def run_scenario(bench, scenario, cold=True):
+    """
+    Make one request, returning (response, seconds, queries).
+    """
+    args = scenario.prepare(bench)
+    if cold:
+        clear_caches()
+    with CaptureQueriesContext(connection) as captured:
+        started = time.perf_counter()
+        response = bench.call(*args)
+        elapsed = time.perf_counter() - started
+    return response, elapsed, count_queries(captured)
+
+
+def summarize(latencies):
+    # Throughput over the time spent in requests, and p50/p99 latency in ms
+    total = sum(latencies)
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p99 = cuts[49], cuts[98]
+    else:
+        p50 = p99 = latencies[0]
+    return {
+        'requests': len(latencies),
+        'throughput': len(latencies) / total if total else 0.0,
+        'p50_ms': p50 * 1000,
+        'p99_ms': p99 * 1000,
+    }
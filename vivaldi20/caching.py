@@ -0,0 +1,157 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import primary_if_written_since
+from .shared_cache import is_shared_cache
+
+# Version scopes: the whole members table, and a single member
+MEMBERS_SCOPE = 'members'
+
+
+def member_scope(pk):
+    return 'member:%s' % pk
+
+
+def _cache():
+    return caches[settings.MEMBER_RESPONSE_CACHE['CACHE_ALIAS']]
+
+
+def _version_key(scope):
+    return 'member-version:%s' % scope
+
+
+def _version_timeout():
+    # A process-local cache never hears of bumps made by other workers or by
+    # `import_members`, so its versions only live LOCAL_VERSION_TTL seconds:
+    # that bounds how long another process' write can go unnoticed.
+    options = settings.MEMBER_RESPONSE_CACHE
+    return None if is_shared_cache(options['CACHE_ALIAS']) else options['LOCAL_VERSION_TTL']
+
+
+def _new_version():
+    # (opaque version token, last modified timestamp)
+    return (uuid.uuid4().hex, int(time.time()))
+
+
+def get_version(scope):
+    cache = _cache()
+    version = cache.get(_version_key(scope))
+    if version is None:
+        # Unknown or evicted: start a fresh version rather than trusting stale entries
+        cache.add(_version_key(scope), _new_version(), _version_timeout())
+        version = cache.get(_version_key(scope)) or _new_version()
+    return version
+
+
+async def aget_version(scope):
+    cache = _cache()
+    version = await cache.aget(_version_key(scope))
+    if version is None:
+        await cache.aadd(_version_key(scope), _new_version(), _version_timeout())
+        version = await cache.aget(_version_key(scope)) or _new_version()
+    return version
+
+
+def bump_versions(*scopes):
+    version = _new_version()
+    _cache().set_many({_version_key(scope): version for scope in scopes}, _version_timeout())
+
+
+def bump_member_versions(*pks):
+    # Bumped at once and again when the writing transaction commits: a read
+    # racing the transaction can still see the old rows and cache them under
+    # the first version, the second one retires that entry
+    scopes = (MEMBERS_SCOPE, *(member_scope(pk) for pk in pks))
+    bump_versions(*scopes)
+    transaction.on_commit(lambda: bump_versions(*scopes))
+
+
+def _not_modified(request, etag):
+    # Only the ETag is compared. Last-Modified has one second resolution, so a
+    # write in the same second as the client's copy would look unmodified to
+    # If-Modified-Since; such requests get a full response instead.
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    # Weak comparison: compressed responses carry the ETag as W/"..."
+    etags = [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+    return '*' in etags or etag in etags
+
+
+def _validators(request, scope, version, last_modified):
+    fingerprint = '%s:%s:%s:%s' % (scope, version, request.accepted_renderer.format, request.build_absolute_uri())
+    etag = quote_etag(hashlib.sha256(fingerprint.encode()).hexdigest()[:40])
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': 'private, no-cache',
+    }
+    return etag, headers
+
+
+def _with_headers(response, headers):
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def cached_member_response(request, scope, build):
+    """
+    Serve a member read through the versioned response cache.
+
+    The ETag is derived from the scope's current version, so a matching
+    If-None-Match is answered with 304 from a single cache lookup (the
+    version is changed by every write, see signals.py), and a known
+    version reuses the cached payload instead of querying and serializing.
+    """
+    version, last_modified = get_version(scope)
+    etag, headers = _validators(request, scope, version, last_modified)
+
+    if _not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cache = _cache()
+    cache_key = 'member-response:%s' % etag
+    data = cache.get(cache_key)
+    if data is not None:
+        return Response(data, headers=headers)
+
+    # A lagging replica would cache the previous payload under the new version
+    with primary_if_written_since(last_modified):
+        response = build()
+    if response.status_code != status.HTTP_200_OK:
+        return response
+
+    cache.set(cache_key, response.data, settings.MEMBER_RESPONSE_CACHE['TIMEOUT'])
+    return _with_headers(response, headers)
+
+
+async def acached_member_response(request, scope, build):
+    # Async counterpart of cached_member_response: `build` is a coroutine function
+    version, last_modified = await aget_version(scope)
+    etag, headers = _validators(request, scope, version, last_modified)
+
+    if _not_modified(request, etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cache = _cache()
+    cache_key = 'member-response:%s' % etag
+    data = await cache.aget(cache_key)
+    if data is not None:
+        return Response(data, headers=headers)
+
+    with primary_if_written_since(last_modified):
+        response = await build()
+    if response.status_code != status.HTTP_200_OK:
+        return response
+
+    await cache.aset(cache_key, response.data, settings.MEMBER_RESPONSE_CACHE['TIMEOUT'])
+    return _with_headers(response, headers)
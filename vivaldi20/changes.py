@@ -0,0 +1,103 @@
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MemberTombstone, User
+
+# Delta sync for /members/changes/. A cursor holds two keyset positions,
+# (updated_at, id) in the members table and (deleted_at, id) in the
+# tombstones, so each page costs two index range scans whatever the table size.
+
+MEMBERS = 'm'
+DELETED = 'd'
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MAX_ID = 2 ** 63 - 1
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class ExpiredCursor(Exception):
+    # Deletions this old may have been pruned: the client has to sync from scratch
+    pass
+
+
+def encode_cursor(position):
+    payload = {key: [moment.isoformat(), pk] for key, (moment, pk) in position.items()}
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        position = {}
+        for key in (MEMBERS, DELETED):
+            moment, pk = payload[key]
+            moment = datetime.fromisoformat(moment)
+            if timezone.is_naive(moment) or not isinstance(pk, int):
+                raise ValueError(cursor)
+            position[key] = (moment, pk)
+        return position
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+
+
+def _after(queryset, field, position):
+    moment, pk = position
+    return queryset.filter(Q(**{f'{field}__gt': moment}) | Q(**{field: moment, 'id__gt': pk}))
+
+
+def member_changes(position, columns, page_size):
+    """
+    Members created or updated and ids of members deleted after `position`
+    (None for a first sync, which returns every member), as
+    (rows, deleted ids, next position, has_more).
+
+    Writes from the last MEMBERS_CHANGES_SETTLE_SECONDS are left for the next
+    sync: a transaction still in flight may commit rows timestamped before
+    ones already visible, which a cursor past them would skip.
+    """
+    now = timezone.now()
+    horizon = now - timedelta(seconds=settings.MEMBERS_CHANGES_SETTLE_SECONDS)
+    if position is None:
+        # A full listing has nothing to delete yet; deletions are followed from here on
+        position = {MEMBERS: (_EPOCH, 0), DELETED: (horizon, 0)}
+    elif position[DELETED][0] < now - timedelta(days=settings.MEMBERS_TOMBSTONE_RETENTION_DAYS):
+        raise ExpiredCursor()
+
+    columns = list(dict.fromkeys(list(columns) + ['id', 'updated_at']))
+    rows = list(
+        _after(User.objects.filter(updated_at__lte=horizon), 'updated_at', position[MEMBERS])
+        .order_by('updated_at', 'id').values(*columns)[:page_size + 1]
+    )
+    tombstones = list(
+        _after(MemberTombstone.objects.filter(deleted_at__lte=horizon), 'deleted_at', position[DELETED])
+        .order_by('deleted_at', 'id').values_list('deleted_at', 'id', 'member_id')[:page_size + 1]
+    )
+    more_deleted = len(tombstones) > page_size
+    has_more = len(rows) > page_size or more_deleted
+    rows, tombstones = rows[:page_size], tombstones[:page_size]
+
+    next_position = dict(position)
+    if rows:
+        next_position[MEMBERS] = (rows[-1]['updated_at'], rows[-1]['id'])
+    if more_deleted:
+        next_position[DELETED] = tombstones[-1][:2]
+    else:
+        # Every deletion up to the horizon has been seen: move past it, so a client
+        # syncing regularly never holds a cursor older than the retention period
+        next_position[DELETED] = (horizon, _MAX_ID)
+    return rows, [member_id for _, _, member_id in tombstones], next_position, has_more
+
+
+def prune_tombstones():
+    cutoff = timezone.now() - timedelta(days=settings.MEMBERS_TOMBSTONE_RETENTION_DAYS)
+    deleted, _ = MemberTombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
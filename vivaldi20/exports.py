@@ -0,0 +1,79 @@
+import csv
+import io
+import itertools
+import json
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import StreamingHttpResponse
+
+from .models import User
+
+EXPORT_FIELDS = ['id', 'first_name', 'last_name', 'username', 'profession', 'bio', 'profile_photo']
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+
+def member_rows(fields):
+    """
+    Yield member tuples for `fields` in id order.
+
+    `values_list().iterator()` fetches the table in chunks without building
+    model instances or caching the queryset, so memory stays flat.
+    """
+    options = settings.MEMBERS_EXPORT
+    rows = User.objects.order_by('id').values_list(*fields).iterator(chunk_size=options['CHUNK_SIZE'])
+    photo = fields.index('profile_photo') if 'profile_photo' in fields else None
+    for row in rows:
+        if photo is not None:
+            row = list(row)
+            row[photo] = default_storage.url(row[photo]) if row[photo] else None
+        yield row
+
+
+def _ndjson_lines(fields, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(fields, row)), ensure_ascii=False) + '\n'
+
+
+def _csv_lines(fields, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in itertools.chain([fields], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _batched(lines, size):
+    # Group small lines into larger chunks to keep per-write overhead down
+    batch = []
+    length = 0
+    for line in lines:
+        batch.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(batch).encode()
+            batch = []
+            length = 0
+    if batch:
+        yield ''.join(batch).encode()
+
+
+def export_members_response(output, fields):
+    rows = member_rows(fields)
+    if output == 'csv':
+        lines = _csv_lines(fields, rows)
+    else:
+        lines = _ndjson_lines(fields, rows)
+
+    response = StreamingHttpResponse(
+        _batched(lines, settings.MEMBERS_EXPORT['WRITE_SIZE']),
+        content_type=EXPORT_CONTENT_TYPES[output],
+    )
+    response['Content-Disposition'] = f'attachment; filename="members.{output}"'
+    return response
@@ -0,0 +1,118 @@
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import StorageJob
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def storage_delete(path):
+    default_storage.delete(path)
+
+
+# Dotted paths, resolved when a job runs, so handler modules can enqueue jobs themselves
+HANDLERS = {
+    StorageJob.DELETE: 'vivaldi20.jobs.storage_delete',
+    StorageJob.PHOTO_DERIVATIVES: 'vivaldi20.photos.generate_photo_derivatives',
+    StorageJob.PHOTO_DELETE: 'vivaldi20.photos.delete_unreferenced_photo',
+}
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.STORAGE_JOBS['WORKERS'],
+                thread_name_prefix='storage-job',
+            )
+        return _executor
+
+
+def shutdown_executor(wait=True):
+    # Let queued jobs finish, e.g. before a benchmark drops its database
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def backoff_delay(attempts):
+    # Exponential backoff with jitter, capped
+    options = settings.STORAGE_JOBS
+    delay = min(options['BACKOFF_BASE'] * 2 ** (attempts - 1), options['BACKOFF_MAX'])
+    return delay + random.uniform(0, options['BACKOFF_BASE'])
+
+
+def enqueue_storage_job(action, path):
+    """
+    Record a storage side effect and run it in the background once the
+    surrounding transaction commits. The row stays behind until the job
+    succeeds, so work lost to a crash is picked up by `run_storage_jobs`.
+    """
+    job = StorageJob.objects.create(action=action, path=path)
+    transaction.on_commit(lambda: submit_job(job.pk))
+    return job
+
+
+def submit_job(job_id, delay=0):
+    if settings.STORAGE_JOBS['EAGER']:
+        run_job(job_id)
+    elif delay:
+        timer = threading.Timer(delay, submit_job, args=(job_id,))
+        timer.daemon = True
+        timer.start()
+    else:
+        _get_executor().submit(_run_in_worker, job_id)
+
+
+def _run_in_worker(job_id):
+    close_old_connections()
+    try:
+        if run_job(job_id) is False:
+            job = StorageJob.objects.filter(pk=job_id).first()
+            if job is not None and job.attempts < settings.STORAGE_JOBS['MAX_ATTEMPTS']:
+                submit_job(job_id, delay=(job.run_after - timezone.now()).total_seconds())
+    finally:
+        close_old_connections()
+
+
+def run_job(job_id):
+    # Returns True when the job ran (or was already done), False when it failed
+    job = StorageJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return True
+
+    try:
+        import_string(HANDLERS[job.action])(job.path)
+    except Exception as exc:
+        job.attempts += 1
+        job.last_error = repr(exc)
+        job.run_after = timezone.now() + timedelta(seconds=backoff_delay(job.attempts))
+        job.save(update_fields=['attempts', 'last_error', 'run_after'])
+        logger.warning("Storage job %s (%s) failed on attempt %s: %r", job.pk, job, job.attempts, exc)
+        return False
+
+    job.delete()
+    return True
+
+
+def run_due_jobs(limit=100):
+    due = StorageJob.objects.filter(
+        run_after__lte=timezone.now(),
+        attempts__lt=settings.STORAGE_JOBS['MAX_ATTEMPTS'],
+    ).order_by('run_after').values_list('pk', flat=True)[:limit]
+    return [run_job(job_id) for job_id in list(due)]
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vivaldi20.models import PhotoBlob, StorageJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue derivative generation for stored profile photos that have none recorded "
+        "(photos stored before derivatives were tracked, or whose job gave up). "
+        "The jobs are run by `run_storage_jobs`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # Jobs still being retried
+        queued = StorageJob.objects.filter(action=StorageJob.PHOTO_DERIVATIVES, attempts__lt=settings.STORAGE_JOBS['MAX_ATTEMPTS'])
+        names = (
+            PhotoBlob.objects.filter(ref_count__gt=0, derivatives_ready=False)
+            .exclude(name__in=queued.values('path'))
+            .values_list('name', flat=True)
+        )
+        jobs = StorageJob.objects.bulk_create(
+            [StorageJob(action=StorageJob.PHOTO_DERIVATIVES, path=name) for name in names.iterator()],
+            batch_size=options['batch_size'],
+        )
+        self.stdout.write(f"Queued derivatives for {len(jobs)} photo(s).")
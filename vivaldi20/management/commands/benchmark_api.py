@@ -0,0 +1,102 @@
+import logging
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed members into a throwaway test database, drive every API endpoint and report "
+        "throughput and p50/p99 latency. Fails when an endpoint exceeds its query budget."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=10000, help="Members to seed (1k to 1M).")
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=10, help="Untimed requests per endpoint first.")
+        parser.add_argument('--endpoints', nargs='+', metavar='NAME', help="Only run these scenarios.")
+        parser.add_argument('--warm-cache', action='store_true', help="Keep response and token caches between requests.")
+        parser.add_argument('--keepdb', action='store_true', help="Reuse the test database and its seeded members.")
+
+    def handle(self, *args, **options):
+        from vivaldi20.benchmarks import SCENARIOS, benchmark_settings
+
+        scenarios = SCENARIOS
+        if options['endpoints']:
+            unknown = set(options['endpoints']) - {scenario.name for scenario in SCENARIOS}
+            if unknown:
+                raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}. Choose from: {', '.join(s.name for s in SCENARIOS)}.")
+            scenarios = [scenario for scenario in SCENARIOS if scenario.name in options['endpoints']]
+
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        # Photos go to a temporary directory, whatever storage is configured, caches to a
+        # private in-process one, and repeated logins are measured rather than throttled
+        overrides = benchmark_settings()
+        overrides['LOGIN_THROTTLE'].update(IP_RATE=None, USERNAME_RATE=None)
+        storage = override_settings(
+            STORAGES=dict(settings.STORAGES, default={'BACKEND': 'vivaldi20.storage.LocalStorage'}),
+            MEDIA_ROOT=media_root,
+            MEDIA_URL='/media/',
+            **overrides,
+        )
+        # The table below reports latency; skip the slow request log for every request
+        logging.getLogger('vivaldi20.requests').setLevel(logging.ERROR)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        storage.enable()
+        try:
+            over_budget = self.run_benchmark(scenarios, options)
+        finally:
+            from vivaldi20.jobs import shutdown_executor
+
+            shutdown_executor()
+            storage.disable()
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if over_budget:
+            raise CommandError(f"Query budget exceeded: {', '.join(over_budget)}.")
+
+    def run_benchmark(self, scenarios, options):
+        from vivaldi20.benchmarks import ApiBench, run_scenario, seed_members, summarize
+        from vivaldi20.models import User
+
+        missing = options['members'] - User.objects.count()
+        if missing > 0:
+            self.stdout.write(f"Seeding {missing} members...")
+            seed_members(missing)
+
+        bench = ApiBench()
+        cold = not options['warm_cache']
+        over_budget = []
+
+        self.stdout.write(f"{'endpoint':<24}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>10}{'budget':>8}")
+        for scenario in scenarios:
+            for _ in range(options['warmup']):
+                run_scenario(bench, scenario, cold=cold)
+
+            latencies = []
+            max_queries = 0
+            for _ in range(options['requests']):
+                response, elapsed, queries = run_scenario(bench, scenario, cold=cold)
+                if response.status_code != scenario.status:
+                    raise CommandError(f"{scenario.name}: expected status {scenario.status}, got {response.status_code}.")
+                latencies.append(elapsed)
+                max_queries = max(max_queries, queries)
+
+            summary = summarize(latencies)
+            line = (
+                f"{scenario.name:<24}{summary['throughput']:>10.1f}{summary['p50_ms']:>10.2f}"
+                f"{summary['p99_ms']:>10.2f}{max_queries:>10}{scenario.query_budget:>8}"
+            )
+            if max_queries > scenario.query_budget:
+                over_budget.append(scenario.name)
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+
+        return over_budget
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from vivaldi20.schema import write_schema_artifact
+
+
+class Command(BaseCommand):
+    help = "Generate the OpenAPI schema into a static JSON artifact served by the docs endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Path to write to (defaults to OPENAPI_SCHEMA_FILE).")
+
+    def handle(self, *args, **options):
+        path, fingerprint = write_schema_artifact(options['output'])
+        self.stdout.write(f"Wrote OpenAPI schema {fingerprint} to {path}.")
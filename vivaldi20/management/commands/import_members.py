@@ -0,0 +1,126 @@
+import csv
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+
+from vivaldi20.caching import bump_member_versions
+from vivaldi20.models import User
+from vivaldi20.serializers import UserRegistrationSerializer
+
+FORMATS = ('csv', 'jsonl')
+
+
+def read_rows(path, format):
+    # Yields (line number, row dict) without loading the whole file
+    with open(path, newline='', encoding='utf-8') as source:
+        if format == 'csv':
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as err:
+                    row = f"Invalid JSON: {err}"
+                yield line_number, row
+
+
+class Command(BaseCommand):
+    help = (
+        "Import members from a CSV (with a header row) or JSONL file of username, first_name, "
+        "last_name and password. Members whose username already exists are skipped, so an "
+        "interrupted import is resumed by running it again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows validated, hashed and inserted together.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Processes hashing passwords.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if format not in FORMATS:
+            raise CommandError(f"Unknown format {format!r}, pass --format {' or '.join(FORMATS)}.")
+        if not os.path.exists(path):
+            raise CommandError(f"No such file: {path}")
+
+        # Validation only: taken usernames are checked per batch in import_batch
+        self.validator = UserRegistrationSerializer(many=True).child
+        self.totals = dict.fromkeys(('created', 'existing', 'invalid'), 0)
+        started = time.perf_counter()
+
+        # Spawned rather than forked, so workers never share the database connection
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(options['workers'], mp_context=context, initializer=django.setup) as pool:
+            rows = read_rows(path, format)
+            processed = 0
+            while batch := list(islice(rows, options['batch_size'])):
+                self.import_batch(batch, pool, options['workers'])
+                processed += len(batch)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f"{processed} rows: {self.totals['created']} created, {self.totals['existing']} already present, "
+                    f"{self.totals['invalid']} invalid ({processed / elapsed:.0f} rows/s)"
+                )
+
+        if self.totals['created']:
+            # bulk_create sends no signals
+            bump_member_versions()
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {self.totals['created']} members in {time.perf_counter() - started:.1f}s."
+        ))
+
+    def import_batch(self, batch, pool, workers):
+        valid = {}
+        for line_number, row in batch:
+            try:
+                if isinstance(row, str):
+                    raise serializers.ValidationError(row)
+                if not isinstance(row, dict):
+                    raise serializers.ValidationError("Expected a JSON object.")
+                attrs = self.validator.run_validation(row)
+            except serializers.ValidationError as err:
+                self.totals['invalid'] += 1
+                self.stderr.write(f"Line {line_number}: {json.dumps(err.detail)}")
+                continue
+            if attrs['username'] in valid:
+                self.totals['invalid'] += 1
+                self.stderr.write(f"Line {line_number}: duplicate username {attrs['username']!r}.")
+                continue
+            valid[attrs['username']] = attrs
+
+        # Checked before hashing, so resuming skips the expensive part for finished rows
+        existing = set(User.objects.filter(username__in=valid).values_list('username', flat=True))
+        self.totals['existing'] += len(existing)
+        pending = [attrs for username, attrs in valid.items() if username not in existing]
+        if not pending:
+            return
+
+        passwords = [attrs['password'] for attrs in pending]
+        hashes = pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4)))
+        users = [
+            User(
+                username=attrs['username'],
+                first_name=attrs.get('first_name', ''),
+                last_name=attrs.get('last_name', ''),
+                password=password,
+            )
+            for attrs, password in zip(pending, hashes)
+        ]
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=500)
+        self.totals['created'] += len(users)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from vivaldi20.changes import prune_tombstones
+
+
+class Command(BaseCommand):
+    help = "Delete member tombstones older than MEMBERS_TOMBSTONE_RETENTION_DAYS."
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Pruned {prune_tombstones()} member tombstone(s).")
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from vivaldi20.jobs import run_due_jobs
+
+
+class Command(BaseCommand):
+    help = "Run pending storage jobs from the outbox (retries and jobs left behind by a restart)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep polling for due jobs instead of exiting.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between polls with --loop.")
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        while True:
+            results = run_due_jobs(limit=options['batch_size'])
+            if results:
+                self.stdout.write(f"Ran {len(results)} storage job(s), {results.count(False)} failed.")
+            if not options['loop']:
+                break
+            if len(results) < options['batch_size']:
+                time.sleep(options['interval'])
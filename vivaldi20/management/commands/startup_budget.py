@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Each target runs in a fresh interpreter, from process start until it is ready
+TARGETS = {
+    # A web worker: application loaded and the URLconf (every view module) imported
+    'wsgi': [
+        sys.executable, '-c',
+        'import config.wsgi; from django.urls import get_resolver; get_resolver().url_patterns',
+    ],
+    # manage.py up to running a command (django.setup() included)
+    'manage': [sys.executable, 'manage.py', 'version'],
+}
+
+
+class Command(BaseCommand):
+    help = "Measure the cold start of the WSGI application and manage.py against STARTUP_BUDGET_MS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per target; the fastest one is reported.")
+        parser.add_argument('--top', type=int, default=0, help="Also list the N top-level packages slowest to import for the wsgi target.")
+
+    def _run(self, command, extra_args=()):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings')}
+        start = time.perf_counter()
+        result = subprocess.run(
+            [command[0], *extra_args, *command[1:]],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        elapsed = (time.perf_counter() - start) * 1000
+        if result.returncode:
+            raise CommandError(f"{' '.join(command)} failed:\n{result.stderr}")
+        return elapsed, result.stderr
+
+    def _slowest_packages(self, count):
+        _, report = self._run(TARGETS['wsgi'], ['-X', 'importtime'])
+        totals = {}
+        for line in report.splitlines():
+            # "import time: self [us] | cumulative | imported package"
+            parts = line.split('|')
+            if len(parts) != 3 or not parts[0].split(':')[-1].strip().isdigit():
+                continue
+            package = parts[2].strip().split('.')[0]
+            totals[package] = totals.get(package, 0) + int(parts[0].split(':')[-1])
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def handle(self, *args, **options):
+        over_budget = []
+        for name, command in TARGETS.items():
+            elapsed = min(self._run(command)[0] for _ in range(options['repeat']))
+            budget = settings.STARTUP_BUDGET_MS[name]
+            self.stdout.write(f"{name}: {elapsed:.0f} ms (budget {budget} ms)")
+            if elapsed > budget:
+                over_budget.append(name)
+
+        if options['top']:
+            self.stdout.write("Import time by package:")
+            for package, micros in self._slowest_packages(options['top']):
+                self.stdout.write(f"  {micros / 1000:8.1f} ms  {package}")
+
+        if over_budget:
+            raise CommandError(f"Startup over budget: {', '.join(over_budget)}")
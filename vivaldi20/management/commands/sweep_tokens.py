@@ -0,0 +1,30 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vivaldi20.authentication import sweep_expired_tokens
+
+
+class Command(BaseCommand):
+    help = "Delete expired auth tokens in bounded batches (see TOKEN_EXPIRY)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.TOKEN_EXPIRY['SWEEP_BATCH_SIZE'])
+        parser.add_argument('--pause', type=float, default=0.1, help="Seconds between batches, leaving room for other writers.")
+        parser.add_argument('--loop', action='store_true', help="Keep sweeping instead of exiting once no expired tokens are left.")
+        parser.add_argument('--interval', type=float, default=300.0, help="Seconds between sweeps with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            total = 0
+            while deleted := sweep_expired_tokens(options['batch_size']):
+                total += deleted
+                if deleted < options['batch_size']:
+                    break
+                time.sleep(options['pause'])
+            if total or not options['loop']:
+                self.stdout.write(f"Deleted {total} expired token(s).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
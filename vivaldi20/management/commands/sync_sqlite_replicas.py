@@ -0,0 +1,38 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the SQLite primary database over each SQLite replica in DATABASE_REPLICA_URLS, "
+        "to try replica routing locally. With --loop the copies lag the primary by up to --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help="Keep copying instead of exiting after one pass.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between copies with --loop.")
+
+    def handle(self, *args, **options):
+        replicas = settings.DATABASE_REPLICATION['REPLICAS']
+        if not replicas:
+            raise CommandError("No replicas configured: set DATABASE_REPLICA_URLS.")
+        for alias in ['default'] + replicas:
+            if connections[alias].vendor != 'sqlite':
+                raise CommandError(f"Database '{alias}' is not SQLite; use the database's own replication.")
+
+        while True:
+            with closing(sqlite3.connect(settings.DATABASES['default']['NAME'])) as source:
+                for alias in replicas:
+                    with closing(sqlite3.connect(settings.DATABASES[alias]['NAME'])) as target:
+                        # Online backup: a consistent snapshot, even with writers on the primary
+                        source.backup(target)
+                    if not options['loop'] or options['verbosity'] > 1:
+                        self.stdout.write(f"Copied primary to {alias}.")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
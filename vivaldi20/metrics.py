@@ -0,0 +1,162 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# In-process metrics in the Prometheus text format. Every worker process keeps its
+# own registry, so scrape each worker (or run one process per scrape target).
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, tuple(zip(self.labels, labels)), value) for labels, value in self._values.items()]
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(counts) for labels, counts in self._values.items()}
+
+        samples = []
+        for labels, counts in values.items():
+            labels = tuple(zip(self.labels, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', labels + (('le', bound),), cumulative))
+            samples.append((self.name + '_count', labels, cumulative))
+            samples.append((self.name + '_sum', labels, counts[-1]))
+        return samples
+
+
+REQUEST_LABELS = ('view', 'method')
+
+requests_total = Counter('http_requests_total', "Requests served.", REQUEST_LABELS + ('status',))
+request_duration = Histogram('http_request_duration_seconds', "Request latency.", REQUEST_LABELS, LATENCY_BUCKETS)
+request_queries = Histogram('http_request_db_queries', "Database queries per request.", REQUEST_LABELS, QUERY_COUNT_BUCKETS)
+db_seconds = Counter('http_request_db_seconds_total', "Time spent in database queries.", REQUEST_LABELS)
+storage_calls = Counter('http_request_storage_calls_total', "File storage calls.", REQUEST_LABELS)
+storage_seconds = Counter('http_request_storage_seconds_total', "Time spent in file storage calls.", REQUEST_LABELS)
+render_seconds = Counter('http_request_render_seconds_total', "Time spent rendering responses.", REQUEST_LABELS)
+admission_rejected = Counter('http_admission_rejected_total', "Requests refused by admission control.", ('route_class',))
+
+REGISTRY = [
+    requests_total, request_duration, request_queries, db_seconds, storage_calls, storage_seconds, render_seconds,
+    admission_rejected,
+]
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for name, labels, value in metric.samples():
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels)
+            lines.append(f'{name}{{{label_text}}} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """
+    Timings collected while one request is being served.
+    """
+
+    def __init__(self, max_queries):
+        self.started = time.perf_counter()
+        self.max_queries = max_queries
+        self.query_count = 0
+        self.query_time = 0.0
+        self.queries = []
+        self.storage_count = 0
+        self.storage_time = 0.0
+        self.render_time = 0.0
+
+    def record_query(self, sql, duration):
+        self.query_count += 1
+        self.query_time += duration
+        if len(self.queries) < self.max_queries:
+            self.queries.append((sql, duration))
+
+
+# Stats of the request being served; copied into the threads used by sync_to_async
+current_stats = ContextVar('request_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every database connection, see apps.py
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.record_query(sql, time.perf_counter() - started)
+
+
+@contextmanager
+def record_storage_call():
+    stats = current_stats.get()
+    if stats is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.storage_count += 1
+        stats.storage_time += time.perf_counter() - started
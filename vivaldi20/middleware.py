@@ -0,0 +1,394 @@
+import logging
+import time
+import zlib
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.exceptions import AuthenticationFailed
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+from . import metrics, routers
+from .admission import ConcurrencyLimiter
+from .authentication import CachedTokenAuthentication
+from .shared_cache import is_shared_cache
+
+logger = logging.getLogger('vivaldi20.requests')
+
+
+class RequestMetricsMiddleware:
+    """
+    Measure every request: latency, database queries, storage calls and
+    response rendering, labelled by URL name.
+
+    The numbers go to the metrics registry (see `metrics_view`), into a
+    `Server-Timing` header, and to the `vivaldi20.requests` log with the
+    query list when a request is slower than SLOW_REQUEST_MS.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = settings.REQUEST_METRICS
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        stats = metrics.RequestStats(self.options['SLOW_REQUEST_MAX_QUERIES'])
+        token = metrics.current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.current_stats.reset(token)
+        return self._finish(request, response, stats)
+
+    async def __acall__(self, request):
+        stats = metrics.RequestStats(self.options['SLOW_REQUEST_MAX_QUERIES'])
+        token = metrics.current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.current_stats.reset(token)
+        return self._finish(request, response, stats)
+
+    def process_template_response(self, request, response):
+        # Called right before a DRF Response is rendered. Its post-render callbacks run
+        # as soon as rendering is done, before the inner middleware (compression) sees it
+        stats = metrics.current_stats.get()
+        if stats is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                stats.render_time = time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def _finish(self, request, response, stats):
+        duration = time.perf_counter() - stats.started
+
+        match = request.resolver_match
+        labels = (match.view_name if match else '<unmatched>', request.method)
+        metrics.requests_total.inc(labels + (str(response.status_code),))
+        metrics.request_duration.observe(labels, duration)
+        metrics.request_queries.observe(labels, stats.query_count)
+        metrics.db_seconds.inc(labels, stats.query_time)
+        metrics.storage_calls.inc(labels, stats.storage_count)
+        metrics.storage_seconds.inc(labels, stats.storage_time)
+        metrics.render_seconds.inc(labels, stats.render_time)
+
+        if self.options['SERVER_TIMING']:
+            response['Server-Timing'] = ', '.join([
+                'db;dur=%.1f;desc="%d queries"' % (stats.query_time * 1000, stats.query_count),
+                'storage;dur=%.1f;desc="%d calls"' % (stats.storage_time * 1000, stats.storage_count),
+                'render;dur=%.1f' % (stats.render_time * 1000),
+                'total;dur=%.1f' % (duration * 1000),
+            ])
+
+        if duration * 1000 >= self.options['SLOW_REQUEST_MS']:
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %d queries in %.0f ms, %d storage calls in %.0f ms%s",
+                request.method, request.get_full_path(), labels[0], duration * 1000,
+                stats.query_count, stats.query_time * 1000, stats.storage_count, stats.storage_time * 1000,
+                ''.join('\n  %.1f ms  %s' % (query_time * 1000, sql) for sql, query_time in stats.queries),
+            )
+        return response
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serve GET/HEAD requests to the DATABASE_REPLICATION views from a read
+    replica, and pin a member to the primary for STICKY_SECONDS after each
+    successful write so they read their own writes. Members are told apart
+    by their token, resolved here (on the primary) before the view runs.
+
+    Not used at all when no replica is configured.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.options = settings.DATABASE_REPLICATION
+        if not self.options['REPLICAS']:
+            raise MiddlewareNotUsed()
+        if settings.WEB_CONCURRENCY > 1 and not is_shared_cache(self.options['CACHE_ALIAS']):
+            # A pin only this worker sees would send the member's next read to a lagging replica
+            raise ImproperlyConfigured(
+                "DATABASE_REPLICATION['CACHE_ALIAS'] must name a cache shared by all workers when WEB_CONCURRENCY is above 1."
+            )
+        self.views = frozenset(self.options['VIEWS'])
+        self.authentication = CachedTokenAuthentication()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        replica_view = self._replica_view(request)
+        user_id = self._user_id(request) if replica_view or self._writes(request) else None
+        if replica_view and (user_id is None or not routers.is_pinned_to_primary(user_id)):
+            with routers.replica_reads():
+                return self.get_response(request)
+        response = self.get_response(request)
+        if user_id is not None and self._wrote(request, response):
+            routers.pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        replica_view = self._replica_view(request)
+        user_id = await self._auser_id(request) if replica_view or self._writes(request) else None
+        if replica_view and (user_id is None or not await routers.ais_pinned_to_primary(user_id)):
+            with routers.replica_reads():
+                return await self.get_response(request)
+        response = await self.get_response(request)
+        if user_id is not None and self._wrote(request, response):
+            await routers.apin_to_primary(user_id)
+        return response
+
+    def _user_id(self, request):
+        try:
+            credentials = self.authentication.authenticate(request)
+        except AuthenticationFailed:
+            return None
+        return credentials[0].pk if credentials else None
+
+    async def _auser_id(self, request):
+        try:
+            credentials = await self.authentication.aauthenticate(request)
+        except AuthenticationFailed:
+            return None
+        return credentials[0].pk if credentials else None
+
+    def _replica_view(self, request):
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        try:
+            return resolve(request.path_info).url_name in self.views
+        except Resolver404:
+            return False
+
+    def _writes(self, request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS')
+
+    def _wrote(self, request, response):
+        return self._writes(request) and response.status_code < 400
+
+
+class _GzipCompressor:
+    def __init__(self, options):
+        # wbits 31: gzip container
+        self._compressor = zlib.compressobj(options['GZIP_LEVEL'], zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, options):
+        self._compressor = brotli.Compressor(quality=options['BROTLI_QUALITY'])
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+COMPRESSORS = {'gzip': _GzipCompressor}
+if brotli is not None:
+    COMPRESSORS = {'br': _BrotliCompressor, **COMPRESSORS}
+
+
+def accepted_encoding(accept_encoding):
+    """
+    The preferred encoding in COMPRESSORS the client accepts (brotli over
+    gzip at equal weight), or None.
+    """
+    weights = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+
+    best = None
+    for encoding in COMPRESSORS:
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > 0 and (best is None or weight > best[1]):
+            best = (encoding, weight)
+    return best and best[0]
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli (when the `brotli` package is installed)
+    or gzip, as negotiated through Accept-Encoding.
+
+    Regular responses are compressed when at least MIN_SIZE bytes and only
+    kept when smaller; streaming responses are compressed incrementally as
+    they are sent. Only CONTENT_TYPES are compressed, so images are left
+    alone.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.options = settings.RESPONSE_COMPRESSION
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if not response.streaming and len(response.content) < self.options['MIN_SIZE']:
+            return response
+        content_type = response.get('Content-Type', '').split(';')[0].strip().lower()
+        if not content_type.startswith(tuple(self.options['CONTENT_TYPES'])):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = accepted_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return response
+        compressor = COMPRESSORS[encoding](self.options)
+
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self._acompress_stream(compressor, response.streaming_content)
+            else:
+                response.streaming_content = self._compress_stream(compressor, response.streaming_content)
+            # Unknown until the whole body has been sent
+            del response.headers['Content-Length']
+        else:
+            compressed = compressor.compress(response.content) + compressor.finish()
+            if len(compressed) >= len(response.content):
+                return response
+            response.content = compressed
+            response.headers['Content-Length'] = str(len(compressed))
+
+        # The compressed body is a different representation: only a weak ETag still holds
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    @staticmethod
+    def _compress_stream(compressor, chunks):
+        for chunk in chunks:
+            if data := compressor.compress(chunk):
+                yield data
+        yield compressor.finish()
+
+    @staticmethod
+    async def _acompress_stream(compressor, chunks):
+        async for chunk in chunks:
+            if data := compressor.compress(chunk):
+                yield data
+        yield compressor.finish()
+
+
+class AdmissionControlMiddleware:
+    """
+    Cap concurrent requests per route class (ADMISSION_CONTROL), so password
+    hashing, photo uploads and exports cannot take every worker and starve
+    the reads. Requests over a class's limit wait in its bounded queue, and
+    are answered 503 with Retry-After right away when the queue is full or
+    after QUEUE_TIMEOUT. Routes outside the classes are never held back.
+
+    A streaming response keeps its slot until the server closes it, once it
+    has been sent or the client went away.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        options = settings.ADMISSION_CONTROL
+        if not options['CLASSES']:
+            raise MiddlewareNotUsed()
+        self.retry_after = options['RETRY_AFTER']
+        self.limiters = {
+            name: ConcurrencyLimiter(
+                route_class['CONCURRENCY'], route_class['QUEUE_SIZE'], route_class['QUEUE_TIMEOUT'], options['SYNC_QUEUE_SIZE'],
+            )
+            for name, route_class in options['CLASSES'].items()
+        }
+        self.route_classes = {
+            view: name for name, route_class in options['CLASSES'].items() for view in route_class['VIEWS']
+        }
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        route_class = self._route_class(request)
+        if route_class is None:
+            return self.get_response(request)
+        limiter = self.limiters[route_class]
+        if not limiter.acquire():
+            return self._reject(route_class)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            limiter.release()
+            raise
+        return self._release_when_sent(response, limiter)
+
+    async def __acall__(self, request):
+        route_class = self._route_class(request)
+        if route_class is None:
+            return await self.get_response(request)
+        limiter = self.limiters[route_class]
+        if not await limiter.aacquire():
+            return self._reject(route_class)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            limiter.release()
+            raise
+        return self._release_when_sent(response, limiter)
+
+    def _route_class(self, request):
+        try:
+            return self.route_classes.get(resolve(request.path_info).url_name)
+        except Resolver404:
+            return None
+
+    def _reject(self, route_class):
+        metrics.admission_rejected.inc((route_class,))
+        response = JsonResponse({"message": "Server busy, please retry later."}, status=503)
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+    def _release_when_sent(self, response, limiter):
+        if not response.streaming:
+            limiter.release()
+        else:
+            # Servers close every response, including one whose content was never iterated
+            response._resource_closers.append(limiter.releaser())
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.9 on 2026-10-16 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vivaldi20', '0002_storagejob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='storagejob',
+            name='action',
+            field=models.CharField(choices=[('delete', 'Delete'), ('photo_derivatives', 'Generate photo derivatives'), ('photo_delete', 'Delete photo and derivatives')], max_length=32),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+# The token table belongs to rest_framework.authtoken, so its index on
+# `created` (used by sweep_tokens) is added here through the schema editor.
+
+TOKEN_CREATED_INDEX = models.Index(fields=['created'], name='authtoken_created_idx')
+
+
+def add_token_created_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model('authtoken', 'Token'), TOKEN_CREATED_INDEX)
+
+
+def remove_token_created_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model('authtoken', 'Token'), TOKEN_CREATED_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0004_alter_tokenproxy_options'),
+        ('vivaldi20', '0006_member_changes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_token_created_index, remove_token_created_index),
+    ]
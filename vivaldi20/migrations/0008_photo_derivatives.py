@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vivaldi20', '0007_token_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photoblob',
+            name='derivatives_ready',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['profile_photo'], name='user_profile_photo_idx'),
+        ),
+    ]
@@ -1,10 +1,78 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 class User(AbstractUser):
     profession = models.CharField(max_length=100, default="AWS Cloud Practitioner")
     bio = models.TextField(blank=True, default="No bio provided")
     profile_photo = models.ImageField(upload_to='profile_photos/', blank=True, null=True)
+    # Drives /members/changes/; writes with update_fields or bulk_update must include it
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta(AbstractUser.Meta):
+        # Back the filters and orderings of the members list; "id" is the
+        # cursor pagination tie-breaker
+        indexes = [
+            models.Index(fields=['profession', 'id'], name='user_profession_id_idx'),
+            models.Index(fields=['is_active', 'id'], name='user_active_id_idx'),
+            models.Index(fields=['date_joined', 'id'], name='user_joined_id_idx'),
+            models.Index(fields=['profession', 'date_joined'], name='user_profession_joined_idx'),
+            models.Index(fields=['updated_at', 'id'], name='user_updated_id_idx'),
+            # Members sharing a stored photo, found when its derivatives are ready
+            models.Index(fields=['profile_photo'], name='user_profile_photo_idx'),
+        ]
 
     def __str__(self):
         return self.username
+
+
+class StorageJob(models.Model):
+    # Outbox row for a storage side effect, written in the same transaction as
+    # the change that needs it and removed once the job has run.
+    DELETE = 'delete'
+    PHOTO_DERIVATIVES = 'photo_derivatives'
+    PHOTO_DELETE = 'photo_delete'
+    ACTION_CHOICES = [
+        (DELETE, 'Delete'),
+        (PHOTO_DERIVATIVES, 'Generate photo derivatives'),
+        (PHOTO_DELETE, 'Delete photo and derivatives'),
+    ]
+
+    action = models.CharField(max_length=32, choices=ACTION_CHOICES)
+    path = models.CharField(max_length=255)
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.action} {self.path}"
+
+
+class PhotoBlob(models.Model):
+    # A stored profile photo shared by every member whose photo has the same
+    # content; the object is only removed from storage once no one uses it.
+    name = models.CharField(max_length=100, primary_key=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    # Set by the derivatives job once every thumbnail has been written
+    derivatives_ready = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class MemberTombstone(models.Model):
+    # Records a deleted member so clients syncing through /members/changes/
+    # learn about the deletion; pruned after MEMBERS_TOMBSTONE_RETENTION_DAYS.
+    member_id = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='tombstone_deleted_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"member {self.member_id} deleted at {self.deleted_at}"
+
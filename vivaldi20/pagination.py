@@ -0,0 +1,34 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+
+# ?ordering= values accepted by the members list. The first field carries the
+# cursor position; "id" breaks ties so pages stay stable.
+MEMBER_ORDERINGS = {
+    'id': ('id',),
+    '-id': ('-id',),
+    'date_joined': ('date_joined', 'id'),
+    '-date_joined': ('-date_joined', '-id'),
+    'username': ('username',),
+    '-username': ('-username',),
+}
+
+
+class MemberCursorPagination(CursorPagination):
+    # Keyset pagination on the primary key: every page is a single
+    # `WHERE id > <cursor> ORDER BY id LIMIT n` query, whatever the table size.
+    ordering = 'id'
+    page_size = settings.MEMBERS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MEMBERS_MAX_PAGE_SIZE
+
+    def get_paginated_response(self, data):
+        # Keep the existing {"data": {"members": [...]}} envelope
+        return Response({
+            "data": {
+                "members": data,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+            }
+        })
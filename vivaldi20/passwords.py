@@ -0,0 +1,30 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+
+# Password hashing for bulk registrations. The hashers spend their time in C
+# code that releases the GIL (PBKDF2 through hashlib, Argon2, bcrypt), so a
+# few threads hash a batch on several cores without leaving the worker process.
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.MEMBERS_BULK_HASH_THREADS,
+                thread_name_prefix='password-hash',
+            )
+        return _executor
+
+
+def hash_passwords(passwords):
+    # make_password for each password, in order
+    if len(passwords) < 2:
+        return [make_password(password) for password in passwords]
+    return list(_get_executor().map(make_password, passwords))
@@ -0,0 +1,310 @@
+import hashlib
+import io
+import logging
+import mimetypes
+import posixpath
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+
+from .caching import bump_member_versions
+from .jobs import enqueue_storage_job
+from .metrics import record_storage_call
+from .models import PhotoBlob, StorageJob, User
+
+logger = logging.getLogger(__name__)
+
+PROFILE_PHOTO_PREFIX = 'profile_photos/'
+PROFILE_PHOTO_UPLOAD_PREFIX = 'profile_photos/uploads/'
+
+ALLOWED_PHOTO_CONTENT_TYPES = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/webp': '.webp',
+    'image/gif': '.gif',
+}
+
+
+# Pillow format names for the derivative extensions
+DERIVATIVE_FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+
+
+class DirectUploadNotSupported(Exception):
+    pass
+
+
+class ContentHashUploadHandler(FileUploadHandler):
+    """
+    Hash each uploaded file as its chunks arrive.
+
+    The chunks are passed on untouched to the next handler, which still builds
+    the UploadedFile; the hex digests end up in `digests` keyed by field name.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.digests = {}
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self._hash = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hash.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.digests[self.field_name] = self._hash.hexdigest()
+        return None
+
+
+def _s3_client():
+    # Presigning needs the boto3 client behind S3Boto3Storage
+    if not hasattr(default_storage, 'bucket_name'):
+        raise DirectUploadNotSupported()
+    return default_storage.connection.meta.client, default_storage.bucket_name
+
+
+def upload_prefix_for(user):
+    return '%s%s/' % (PROFILE_PHOTO_UPLOAD_PREFIX, user.pk)
+
+
+def new_upload_key(user, content_type):
+    return '%s%s%s' % (upload_prefix_for(user), uuid.uuid4().hex, ALLOWED_PHOTO_CONTENT_TYPES[content_type])
+
+
+def presigned_photo_upload(key, content_type):
+    """
+    Presigned POST letting the client send the photo straight to the bucket.
+
+    The policy pins the key, the content type and the size range so the
+    confirm step only has to check that the object landed.
+    """
+    client, bucket_name = _s3_client()
+    options = settings.PROFILE_PHOTO_DIRECT_UPLOAD
+    with record_storage_call():
+        return client.generate_presigned_post(
+            Bucket=bucket_name,
+            Key=default_storage._normalize_name(key),
+            Fields={'Content-Type': content_type},
+            Conditions=[
+                {'Content-Type': content_type},
+                ['content-length-range', 1, options['MAX_BYTES']],
+            ],
+            ExpiresIn=options['EXPIRES_IN'],
+        )
+
+
+def uploaded_photo_metadata(key):
+    from botocore.exceptions import ClientError
+
+    # A single HEAD request: None when the client never completed the upload
+    client, bucket_name = _s3_client()
+    try:
+        with record_storage_call():
+            head = client.head_object(Bucket=bucket_name, Key=default_storage._normalize_name(key))
+    except ClientError as err:
+        if err.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+            return None
+        raise
+    content_type = head.get('ContentType') or mimetypes.guess_type(key)[0]
+    return head['ContentLength'], content_type
+
+
+def derivative_name(name, label, extension):
+    # Derivatives sit next to the original: photo.png -> photo_small.webp
+    return '%s_%s.%s' % (posixpath.splitext(name)[0], label, extension)
+
+
+def derivative_names(name):
+    options = settings.PROFILE_PHOTO_DERIVATIVES
+    return [
+        derivative_name(name, label, extension)
+        for label in options['SIZES']
+        for extension in options['FORMATS']
+    ]
+
+
+def photo_url_builder():
+    """
+    Return a function mapping stored names to URLs for rendering many rows.
+
+    When the storage URL is a fixed prefix plus the quoted name (a custom S3
+    domain, or the filesystem) the prefix is computed once; otherwise every
+    name goes through `default_storage.url()` (e.g. presigned S3 URLs).
+    """
+    fixed_prefix = isinstance(default_storage, FileSystemStorage) or (
+        getattr(default_storage, 'custom_domain', None) and not getattr(default_storage, 'cloudfront_signer', None)
+    )
+    if not fixed_prefix:
+        return default_storage.url
+
+    probe = 'url-probe'
+    prefix = default_storage.url(probe)[:-len(probe)]
+    return lambda name: prefix + filepath_to_uri(name)
+
+
+def photos_with_derivatives(names):
+    # The stored photos among `names` whose derivatives have been written, in one query
+    names = {name for name in names if name}
+    if not names:
+        return set()
+    return set(PhotoBlob.objects.filter(name__in=names, derivatives_ready=True).values_list('name', flat=True))
+
+
+def derivative_urls(name, url=None):
+    url = url or default_storage.url
+    options = settings.PROFILE_PHOTO_DERIVATIVES
+    return {
+        label: {extension: url(derivative_name(name, label, extension)) for extension in options['FORMATS']}
+        for label in options['SIZES']
+    }
+
+
+def generate_photo_derivatives(name):
+    """
+    Write the fixed-size WebP/JPEG derivatives for a stored profile photo.
+
+    Only the header is parsed before the size check, and JPEGs are decoded
+    at a reduced DCT scale close to the largest derivative, so memory stays
+    bounded by the output size rather than by the uploaded resolution. Other
+    formats can only be decoded in full, so they get the lower
+    MAX_DECODE_PIXELS limit. Members are only offered the derivatives once
+    they are all written (see `photos_with_derivatives`).
+    """
+    # Imported here: only the job workers decode images
+    from PIL import Image, ImageOps
+
+    options = settings.PROFILE_PHOTO_DERIVATIVES
+    sizes = sorted(options['SIZES'].items(), key=lambda item: item[1], reverse=True)
+
+    with default_storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        width, height = image.size
+        if width * height > options['MAX_PIXELS']:
+            logger.warning("Skipping derivatives for %s: %sx%s exceeds the pixel limit", name, width, height)
+            return
+
+        largest = sizes[0][1]
+        if image.draft('RGB', (largest, largest)) is None and width * height > options['MAX_DECODE_PIXELS']:
+            logger.warning("Skipping derivatives for %s: %sx%s %s is too large to decode in full", name, width, height, image.format)
+            return
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    # Shrink step by step from the largest size so each resize works on a small image
+    for label, size in sizes:
+        image.thumbnail((size, size), Image.LANCZOS)
+        for extension in options['FORMATS']:
+            buffer = io.BytesIO()
+            image.save(buffer, DERIVATIVE_FORMATS[extension], quality=options['QUALITY'])
+            target = derivative_name(name, label, extension)
+            # Keep names deterministic on backends that would otherwise pick a new one
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+
+    PhotoBlob.objects.filter(name=name).update(derivatives_ready=True)
+    # Cached member responses and delta sync clients got the members without the thumbnails
+    members = User.objects.filter(profile_photo=name)
+    members.update(updated_at=timezone.now())
+    bump_member_versions(*members.values_list('pk', flat=True))
+
+
+def delete_photo_with_derivatives(name):
+    for target in [name] + derivative_names(name):
+        default_storage.delete(target)
+
+
+def content_addressed_name(digest, filename):
+    extension = posixpath.splitext(filename)[1].lower()
+    return '%s%s/%s%s' % (PROFILE_PHOTO_PREFIX, digest[:2], digest, extension)
+
+
+def acquire_photo(name):
+    """
+    Take one reference to a stored photo, creating its blob row with a count
+    of one. The row stays locked until the transaction ends, so the delete
+    job cannot remove the photo meanwhile. Returns True when the bytes have
+    to be stored: the row is new, or was unreferenced and may already have
+    been deleted from storage.
+    """
+    blob = PhotoBlob.objects.select_for_update().filter(name=name).first()
+    if blob is None:
+        blob, created = PhotoBlob.objects.get_or_create(name=name, defaults={'ref_count': 1})
+        if created:
+            return True
+        # Another upload created it first: lock it like any existing row
+        blob = PhotoBlob.objects.select_for_update().get(name=name)
+    PhotoBlob.objects.filter(name=name).update(ref_count=F('ref_count') + 1)
+    return blob.ref_count == 0
+
+
+def release_photo(name):
+    """
+    Drop one reference to a stored photo and queue its deletion when it was
+    the last one. Photos stored before blobs were tracked have no row and are
+    deleted straight away.
+    """
+    updated = PhotoBlob.objects.filter(name=name, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+    if not updated or not PhotoBlob.objects.filter(name=name, ref_count__gt=0).exists():
+        enqueue_storage_job(StorageJob.PHOTO_DELETE, name)
+
+
+def attach_photo(user, name):
+    """
+    Point `user` at a stored photo with a single row update and release the
+    previous one. Must run inside a transaction. Returns True when the
+    photo's bytes still have to be stored (see `acquire_photo`), which the
+    caller does before the transaction commits.
+    """
+    old_name = user.profile_photo.name
+    if name == old_name:
+        return False
+
+    must_store = acquire_photo(name)
+    if must_store:
+        enqueue_storage_job(StorageJob.PHOTO_DERIVATIVES, name)
+
+    user.profile_photo.name = name
+    user.save(update_fields=['profile_photo', 'updated_at'])
+
+    if old_name:
+        release_photo(old_name)
+    return must_store
+
+
+def save_photo_blob(name, uploaded_file):
+    # Content addressed: anything left under this name has the same bytes
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    default_storage.save(name, uploaded_file)
+
+
+def store_uploaded_photo(user, uploaded_file, digest):
+    # Must run inside a transaction. The blob row is locked before deciding on
+    # the storage PUT, which is skipped when the same content is already stored
+    name = content_addressed_name(digest, uploaded_file.name)
+    if attach_photo(user, name):
+        save_photo_blob(name, uploaded_file)
+
+
+def delete_unreferenced_photo(name):
+    # Hold the blob row while deleting so a concurrent upload of the same
+    # content either re-references it first or waits and uploads it again
+    with transaction.atomic():
+        blob = PhotoBlob.objects.select_for_update().filter(name=name).first()
+        if blob is not None and blob.ref_count > 0:
+            return
+        delete_photo_with_derivatives(name)
+        if blob is not None:
+            blob.delete()
@@ -0,0 +1,32 @@
+import orjson
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class ORJSONRenderer(JSONRenderer):
+    """
+    `JSONRenderer` backed by orjson, several times faster on large member
+    pages. Types orjson does not know (lazy strings, Decimal, querysets) and
+    datetimes go through DRF's encoder, so the output is the stock
+    renderer's for the API's data. The exception is non-finite floats: orjson
+    writes NaN and Infinity as null where the stock renderer raises (see
+    STRICT_JSON); no member field holds a float. Indented output
+    (`; indent=` in Accept) is left to the stock renderer.
+    """
+
+    options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def __init__(self):
+        self.fallback = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.fallback, option=self.options)
+        # Escaped like the stock renderer, so the output is also valid JavaScript
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
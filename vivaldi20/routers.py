@@ -0,0 +1,91 @@
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+
+# Read replicas (DATABASE_REPLICATION). Reads go to a replica only while a
+# request to one of the read-only views is being served (see
+# ReplicaRoutingMiddleware); everything else, and every write, uses "default".
+
+# Replica alias serving the current request's reads, or None for the primary
+_read_alias = ContextVar('replica_read_alias', default=None)
+
+
+def _options():
+    return settings.DATABASE_REPLICATION
+
+
+@contextmanager
+def replica_reads():
+    # One replica per request, so its reads see a single consistent snapshot
+    token = _read_alias.set(random.choice(_options()['REPLICAS']))
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def use_primary():
+    token = _read_alias.set(None)
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+def reading_from_replica():
+    return _read_alias.get() is not None
+
+
+def primary_if_written_since(timestamp):
+    """
+    Read from the primary when data was written less than STICKY_SECONDS
+    before `timestamp`'s second ended: a replica may not have caught up.
+    """
+    if reading_from_replica() and time.time() - timestamp < _options()['STICKY_SECONDS'] + 1:
+        return use_primary()
+    return nullcontext()
+
+
+def _pin_key(user_id):
+    # Per member, whichever token or address they use
+    return 'db-primary-pin:%s' % user_id
+
+
+def is_pinned_to_primary(user_id):
+    return caches[_options()['CACHE_ALIAS']].get(_pin_key(user_id)) is not None
+
+
+async def ais_pinned_to_primary(user_id):
+    return await caches[_options()['CACHE_ALIAS']].aget(_pin_key(user_id)) is not None
+
+
+def pin_to_primary(user_id):
+    # Read-your-writes: this member's reads skip the replicas for a while after a write
+    caches[_options()['CACHE_ALIAS']].set(_pin_key(user_id), 1, _options()['STICKY_SECONDS'])
+
+
+async def apin_to_primary(user_id):
+    await caches[_options()['CACHE_ALIAS']].aset(_pin_key(user_id), 1, _options()['STICKY_SECONDS'])
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Later reads in this request must see the write
+        _read_alias.set(None)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema from the primary
+        return db == 'default'
@@ -0,0 +1,9 @@
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from .storage import TimedStorageMixin
+
+# Kept apart from storage.py so only S3 deployments import boto3
+
+
+class S3Storage(TimedStorageMixin, S3Boto3Storage):
+    pass
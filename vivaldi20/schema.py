@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import threading
+from importlib.metadata import version
+from pathlib import Path
+
+import rest_framework
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+
+from .docs import apply_schema_overrides
+
+# drf_yasg is only imported in here, when the docs are first built or viewed
+
+logger = logging.getLogger(__name__)
+
+# Vendor extension carrying the fingerprint of the code the document was built from
+FINGERPRINT_KEY = 'x-source-fingerprint'
+
+# Modules that cannot change the schema
+_IGNORED_SOURCE_DIRS = {'migrations', 'management', '__pycache__'}
+
+_document = None
+_document_lock = threading.Lock()
+
+
+def api_info():
+    from drf_yasg import openapi
+
+    return openapi.Info(
+        title="Vivaldi Channel API",
+        default_version='v1',
+        description="API documentation for Vivaldi Channel App",
+    )
+
+
+def source_fingerprint():
+    """
+    Hash of everything the schema is generated from: the project and app
+    sources plus the DRF and drf-yasg versions. Any code change yields a new
+    fingerprint, which invalidates a previously written artifact.
+    """
+    digest = hashlib.sha256()
+    digest.update(('%s:%s' % (version('drf-yasg'), rest_framework.VERSION)).encode())
+    for root in (Path(__file__).resolve().parent, settings.BASE_DIR / 'config'):
+        for path in sorted(root.rglob('*.py')):
+            if _IGNORED_SOURCE_DIRS.intersection(path.relative_to(root).parts):
+                continue
+            digest.update(str(path.relative_to(root)).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()[:32]
+
+
+def build_schema_document(fingerprint):
+    from drf_yasg.codecs import OpenAPICodecJson
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    apply_schema_overrides()
+    # Generated without a request: all endpoints, no host so the docs work behind any domain
+    generator = OpenAPISchemaGenerator(api_info())
+    schema = generator.get_schema(request=None, public=True)
+    schema[FINGERPRINT_KEY] = fingerprint
+    return OpenAPICodecJson(validators=[]).encode(schema)
+
+
+def _read_artifact(path, fingerprint):
+    try:
+        document = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    if json.loads(document).get(FINGERPRINT_KEY) != fingerprint:
+        logger.info("OpenAPI schema artifact %s is out of date, regenerating", path)
+        return None
+    return document
+
+
+def write_schema_artifact(path=None):
+    path = Path(path or settings.OPENAPI_SCHEMA_FILE)
+    fingerprint = source_fingerprint()
+    document = build_schema_document(fingerprint)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(document)
+    return path, fingerprint
+
+
+def get_schema_document():
+    """
+    The encoded OpenAPI document and its fingerprint, built once per process.
+
+    A prebuilt artifact (see `build_openapi_schema`) is used when it matches
+    the current code; otherwise the schema is generated on first use.
+    """
+    global _document
+    if _document is None:
+        with _document_lock:
+            if _document is None:
+                fingerprint = source_fingerprint()
+                document = None
+                if settings.OPENAPI_SCHEMA_FILE:
+                    document = _read_artifact(Path(settings.OPENAPI_SCHEMA_FILE), fingerprint)
+                if document is None:
+                    document = build_schema_document(fingerprint)
+                _document = (document, fingerprint)
+    return _document
+
+
+def schema_ui_view(renderer):
+    """
+    The Swagger/ReDoc page for `renderer`: static HTML pointing the UI at the
+    prebuilt document served by `openapi_schema_view` (SPEC_URL). The page is
+    rendered once per process and never generates the schema itself.
+    """
+    page = None
+    lock = threading.Lock()
+
+    def ui_view(request, *args, **kwargs):
+        nonlocal page
+        if page is None:
+            with lock:
+                if page is None:
+                    from drf_yasg.renderers import ReDocRenderer, SwaggerUIRenderer
+
+                    ui_renderer = {'swagger': SwaggerUIRenderer, 'redoc': ReDocRenderer}[renderer]()
+                    context = {}
+                    # Without a document: only the UI settings, which hold the SPEC_URL link
+                    ui_renderer.set_context(context)
+                    context['title'] = api_info().title
+                    page = render_to_string(ui_renderer.template, context)
+        response = HttpResponse(page, content_type='text/html; charset=utf-8')
+        patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+        return response
+
+    return ui_view
@@ -0,0 +1,129 @@
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+
+from .models import User
+
+SEARCH_FIELDS = ['username', 'first_name', 'last_name', 'profession', 'bio']
+
+# At most this many words of a query are used
+MAX_SEARCH_TERMS = 8
+
+SQLITE_FTS_TABLE = 'vivaldi20_user_fts'
+
+# External-content FTS5 table over the user table, kept in sync by triggers so
+# that bulk_create/bulk_update and raw writes are indexed as well
+SQLITE_INDEX_SQL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_FTS_TABLE} USING fts5(
+        username, first_name, last_name, profession, bio,
+        content='vivaldi20_user', content_rowid='id',
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ai AFTER INSERT ON vivaldi20_user BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, username, first_name, last_name, profession, bio)
+        VALUES (new.id, new.username, new.first_name, new.last_name, new.profession, new.bio);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_ad AFTER DELETE ON vivaldi20_user BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, username, first_name, last_name, profession, bio)
+        VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.profession, old.bio);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {SQLITE_FTS_TABLE}_au
+    AFTER UPDATE OF username, first_name, last_name, profession, bio ON vivaldi20_user BEGIN
+        INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, username, first_name, last_name, profession, bio)
+        VALUES ('delete', old.id, old.username, old.first_name, old.last_name, old.profession, old.bio);
+        INSERT INTO {SQLITE_FTS_TABLE}(rowid, username, first_name, last_name, profession, bio)
+        VALUES (new.id, new.username, new.first_name, new.last_name, new.profession, new.bio);
+    END""",
+    # Rank usernames above names, names above profession, profession above bio
+    f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 5.0, 5.0, 2.0, 1.0)')",
+]
+
+SQLITE_TRIGGERS = [f'{SQLITE_FTS_TABLE}_ai', f'{SQLITE_FTS_TABLE}_ad', f'{SQLITE_FTS_TABLE}_au']
+
+# Weighted document used by both the Postgres expression index and the queries;
+# the two must stay identical for the index to be used
+POSTGRES_SEARCH_VECTOR = (
+    "setweight(to_tsvector('simple', coalesce(username, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(last_name, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(profession, '')), 'C') || "
+    "setweight(to_tsvector('simple', coalesce(bio, '')), 'D')"
+)
+
+POSTGRES_INDEX_SQL = [
+    f"CREATE INDEX IF NOT EXISTS vivaldi20_user_search_idx ON vivaldi20_user USING GIN (({POSTGRES_SEARCH_VECTOR}))",
+]
+
+
+def install_search_index(using='default'):
+    """
+    Create the full-text index for the database behind `using`.
+
+    Safe to run repeatedly. On SQLite the table rebuilds done by some schema
+    changes drop the triggers, so they are recreated and the index rebuilt
+    whenever one is missing.
+    """
+    connection = connections[using]
+    if User._meta.db_table not in connection.introspection.table_names():
+        return
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN (%s, %s, %s)",
+                SQLITE_TRIGGERS,
+            )
+            if len(cursor.fetchall()) == len(SQLITE_TRIGGERS):
+                return
+            for statement in SQLITE_INDEX_SQL:
+                cursor.execute(statement)
+            cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            for statement in POSTGRES_INDEX_SQL:
+                cursor.execute(statement)
+
+
+def search_terms(query):
+    # Words only: the terms are quoted into the engine's query syntax below
+    return re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+
+
+def search_member_ids(query, limit, offset=0, using=None):
+    """
+    Ranked ids of members matching every word of `query`, each word also
+    matching as a prefix. Runs on the database reads of User are routed to,
+    unless `using` is given.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+
+    using = using or router.db_for_read(User)
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        sql = (
+            f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s "
+            "ORDER BY rank LIMIT %s OFFSET %s"
+        )
+        params = [' '.join('"%s"*' % term for term in terms), limit, offset]
+    elif connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT id FROM vivaldi20_user WHERE ({POSTGRES_SEARCH_VECTOR}) @@ to_tsquery('simple', %s) "
+            f"ORDER BY ts_rank(({POSTGRES_SEARCH_VECTOR}), to_tsquery('simple', %s)) DESC, id "
+            "LIMIT %s OFFSET %s"
+        )
+        tsquery = ' & '.join('%s:*' % term for term in terms)
+        params = [tsquery, tsquery, limit, offset]
+    else:
+        # No full-text engine: unranked substring match
+        condition = Q()
+        for term in terms:
+            term_condition = Q()
+            for field in SEARCH_FIELDS:
+                term_condition |= Q(**{f'{field}__icontains': term})
+            condition &= term_condition
+        return list(User.objects.using(using).filter(condition).order_by('id').values_list('id', flat=True)[offset:offset + limit])
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
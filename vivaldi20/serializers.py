@@ -1,5 +1,112 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.validators import UniqueValidator
+from .changes import InvalidCursor, decode_cursor
+from .exports import EXPORT_CONTENT_TYPES, EXPORT_FIELDS
 from .models import User
+from .pagination import MEMBER_ORDERINGS
+from .passwords import hash_passwords
+from .photos import ALLOWED_PHOTO_CONTENT_TYPES, derivative_urls, photo_url_builder, photos_with_derivatives, upload_prefix_for
+
+
+def _parse_fields(value, allowed):
+    # "a, b,a" -> ['a', 'b'] in the order of `allowed`
+    fields = {field.strip() for field in value.split(',') if field.strip()}
+    if not fields or not fields <= set(allowed):
+        raise serializers.ValidationError(f"Choose from: {', '.join(allowed)}.")
+    return [field for field in allowed if field in fields]
+
+
+def _duplicate_errors(values, field, message):
+    # Per-item errors for values repeated within one batch
+    counts = Counter(value for value in values if value is not None)
+    if all(count == 1 for count in counts.values()):
+        return None
+    return [{field: [message]} if counts.get(value, 0) > 1 else {} for value in values]
+
+
+class InvalidItem:
+    # Stands in for a member of a bulk batch that failed validation
+    def __init__(self, errors):
+        self.errors = errors
+
+
+class BulkUserRegistrationListSerializer(serializers.ListSerializer):
+    """
+    Validates and creates each member of the batch on its own: invalid items
+    end up as `InvalidItem`s in `validated_data` and in what `save()` returns,
+    in place of the created users, so the other members are still created.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Taken usernames are looked up once for the whole batch in validate()
+        username = self.child.fields['username']
+        username.validators = [validator for validator in username.validators if not isinstance(validator, UniqueValidator)]
+
+    def run_child_validation(self, data):
+        try:
+            return super().run_child_validation(data)
+        except serializers.ValidationError as exc:
+            return InvalidItem(exc.detail)
+
+    def validate(self, attrs):
+        usernames = [item['username'] for item in attrs if not isinstance(item, InvalidItem)]
+        counts = Counter(usernames)
+        taken = set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        taken_message = User._meta.get_field('username').error_messages['unique']
+
+        checked = []
+        for item in attrs:
+            if not isinstance(item, InvalidItem):
+                if counts[item['username']] > 1:
+                    item = InvalidItem({'username': ["Duplicate username in this batch."]})
+                elif item['username'] in taken:
+                    item = InvalidItem({'username': [taken_message]})
+            checked.append(item)
+        return checked
+
+    def save(self):
+        # ListSerializer.save() would merge extra attributes into every item, InvalidItems included
+        self.instance = self.create(self.validated_data)
+        return self.instance
+
+    def create(self, validated_data):
+        valid = [attrs for attrs in validated_data if not isinstance(attrs, InvalidItem)]
+        # Hashed in parallel: this is where the time goes
+        passwords = hash_passwords([attrs['password'] for attrs in valid])
+        users = [
+            User(
+                username=attrs['username'],
+                first_name=attrs.get('first_name', ''),
+                last_name=attrs.get('last_name', ''),
+                password=password,
+            )
+            for attrs, password in zip(valid, passwords)
+        ]
+
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users, batch_size=500)
+        except IntegrityError:
+            # A username was taken since validate(): insert one by one so only that member fails
+            users = [self._create_one(user) for user in users]
+
+        created = iter(users)
+        return [attrs if isinstance(attrs, InvalidItem) else next(created) for attrs in validated_data]
+
+    def _create_one(self, user):
+        try:
+            with transaction.atomic():
+                user.save()
+        except IntegrityError:
+            return InvalidItem({'username': [User._meta.get_field('username').error_messages['unique']]})
+        return user
+
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -7,6 +114,7 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'password']
+        list_serializer_class = BulkUserRegistrationListSerializer
 
     def create(self, validated_data):
         user = User(
@@ -19,7 +127,183 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return user
 
 
+class BulkUserListSerializer(serializers.ListSerializer):
+    # Multiple update: `instance` is the {id: User} mapping from `in_bulk`, and
+    # each item in the payload names the member it updates with "id"
+
+    def run_child_validation(self, data):
+        pk = data.get('id') if isinstance(data, dict) else None
+        self.child.instance = self.instance.get(pk) if isinstance(pk, int) else None
+        if self.child.instance is None:
+            raise serializers.ValidationError({'id': ["Member not found."]})
+        self.child.initial_data = data
+        return super().run_child_validation(data)
+
+    def to_internal_value(self, data):
+        validated = super().to_internal_value(data)
+        errors = (
+            _duplicate_errors([item['id'] for item in data], 'id', "Member appears more than once in this batch.")
+            or _duplicate_errors([attrs.get('username') for attrs in validated], 'username', "Duplicate username in this batch.")
+        )
+        if errors:
+            raise serializers.ValidationError(errors)
+        # Keep the target of every item next to its validated fields
+        return [dict(attrs, id=item['id']) for item, attrs in zip(data, validated)]
+
+    def to_representation(self, data):
+        # Look up which photos have thumbnails once for the whole list
+        users = list(data.all() if hasattr(data, 'all') else data)
+        self.context['photos_with_derivatives'] = photos_with_derivatives(user.profile_photo.name for user in users)
+        return super().to_representation(users)
+
+    def update(self, instance, validated_data):
+        users = []
+        fields = set()
+        for attrs in validated_data:
+            user = instance[attrs.pop('id')]
+            for attr, value in attrs.items():
+                setattr(user, attr, value)
+            fields.update(attrs)
+            users.append(user)
+
+        if fields:
+            # bulk_update skips auto_now
+            now = timezone.now()
+            for user in users:
+                user.updated_at = now
+            with transaction.atomic():
+                User.objects.bulk_update(users, sorted(fields) + ['updated_at'], batch_size=500)
+        return users
+
+
 class UserSerializer(serializers.ModelSerializer):
+    # Small WebP/JPEG renditions for list views, keyed by size label then format;
+    # null until the background job has written them
+    profile_photo_thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = User
-        fields = ['id', 'first_name', 'last_name', 'username', 'profession', 'bio', 'profile_photo']
+        fields = ['id', 'first_name', 'last_name', 'username', 'profession', 'bio', 'profile_photo', 'profile_photo_thumbnails']
+        list_serializer_class = BulkUserListSerializer
+
+    def get_profile_photo_thumbnails(self, user):
+        name = user.profile_photo.name
+        ready = self.context.get('photos_with_derivatives')
+        if ready is None:
+            ready = photos_with_derivatives([name])
+        return derivative_urls(name) if name in ready else None
+
+
+class ProfilePhotoUploadSerializer(serializers.Serializer):
+    content_type = serializers.ChoiceField(choices=sorted(ALLOWED_PHOTO_CONTENT_TYPES))
+
+
+class ProfilePhotoConfirmSerializer(serializers.Serializer):
+    key = serializers.CharField(max_length=100)
+
+    def validate_key(self, value):
+        # Only keys issued to this member by the upload-url endpoint may be attached
+        prefix = upload_prefix_for(self.context['user'])
+        if not value.startswith(prefix) or '..' in value or '/' in value[len(prefix):]:
+            raise serializers.ValidationError("Invalid upload key.")
+        return value
+
+
+MEMBER_FIELDS = UserSerializer.Meta.fields
+
+
+def member_columns(fields):
+    # Database columns needed to render `fields`
+    columns = [field for field in fields if field != 'profile_photo_thumbnails']
+    if 'profile_photo_thumbnails' in fields and 'profile_photo' not in columns:
+        columns.append('profile_photo')
+    return columns
+
+
+def serialize_member_rows(rows, fields):
+    """
+    Read-only equivalent of `UserSerializer(many=True).data` for `values()`
+    rows, restricted to `fields`. Skips the per-row field machinery of the
+    ModelSerializer, which dominates list rendering time.
+    """
+    url = photo_url_builder()
+    plain = [field for field in fields if field not in ('profile_photo', 'profile_photo_thumbnails')]
+    with_photo = 'profile_photo' in fields
+    with_thumbnails = 'profile_photo_thumbnails' in fields
+    ready = photos_with_derivatives(row['profile_photo'] for row in rows) if with_thumbnails else set()
+
+    members = []
+    for row in rows:
+        member = {field: row[field] for field in plain}
+        if with_photo or with_thumbnails:
+            photo = row['profile_photo']
+            if with_photo:
+                member['profile_photo'] = url(photo) if photo else None
+            if with_thumbnails:
+                member['profile_photo_thumbnails'] = derivative_urls(photo, url) if photo in ready else None
+        members.append({field: member[field] for field in fields})
+    return members
+
+
+class MemberFieldsSerializer(serializers.Serializer):
+    # Sparse fieldsets: ?fields=id,username limits both the columns read and the output
+    fields = serializers.CharField(required=False)
+
+    def validate_fields(self, value):
+        return _parse_fields(value, MEMBER_FIELDS)
+
+    @property
+    def member_fields(self):
+        return self.validated_data.get('fields', MEMBER_FIELDS)
+
+
+class MemberListFilterSerializer(MemberFieldsSerializer):
+    profession = serializers.CharField(required=False, max_length=100)
+    is_active = serializers.BooleanField(required=False, allow_null=True, default=None)
+    date_joined_after = serializers.DateTimeField(required=False)
+    date_joined_before = serializers.DateTimeField(required=False)
+    ordering = serializers.ChoiceField(choices=list(MEMBER_ORDERINGS), default='id')
+    # Read by the paginator; declared here so they are validated and documented
+    cursor = serializers.CharField(required=False, help_text="Opaque cursor from a previous page's next/previous link.")
+    page_size = serializers.IntegerField(required=False, min_value=1, help_text="Number of members per page (bounded by the server maximum).")
+
+    def filter_queryset(self, queryset):
+        params = self.validated_data
+        if 'profession' in params:
+            queryset = queryset.filter(profession=params['profession'])
+        if params['is_active'] is not None:
+            queryset = queryset.filter(is_active=params['is_active'])
+        if 'date_joined_after' in params:
+            queryset = queryset.filter(date_joined__gte=params['date_joined_after'])
+        if 'date_joined_before' in params:
+            queryset = queryset.filter(date_joined__lt=params['date_joined_before'])
+        return queryset
+
+
+class MemberChangesSerializer(MemberFieldsSerializer):
+    since = serializers.CharField(required=False, help_text="Cursor returned by the previous sync; omit it for a full sync.")
+    page_size = serializers.IntegerField(min_value=1, max_value=settings.MEMBERS_MAX_PAGE_SIZE, default=settings.MEMBERS_PAGE_SIZE)
+
+    def validate_since(self, value):
+        try:
+            return decode_cursor(value)
+        except InvalidCursor:
+            raise serializers.ValidationError("Invalid cursor.")
+
+
+class BulkMemberDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+
+class MemberExportSerializer(serializers.Serializer):
+    output = serializers.ChoiceField(choices=sorted(EXPORT_CONTENT_TYPES), default='ndjson')
+    fields = serializers.CharField(required=False)
+
+    def validate_fields(self, value):
+        return _parse_fields(value, EXPORT_FIELDS)
+
+
+class MemberSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    page = serializers.IntegerField(min_value=1, default=1)
+    page_size = serializers.IntegerField(min_value=1, max_value=settings.MEMBERS_MAX_PAGE_SIZE, default=settings.MEMBERS_PAGE_SIZE)
@@ -0,0 +1,8 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared_cache(alias):
+    # Whether every worker process sees the same entries in caches[alias]
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
@@ -0,0 +1,57 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .caching import bump_member_versions
+from .metrics import record_query
+from .models import MemberTombstone, User
+from .search import install_search_index
+
+
+# Drop cached tokens as soon as they are deleted (logout, member deletion), and
+# again on commit: until then a concurrent request still finds the row and
+# caches it anew
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    key = instance.key
+    token_cache.invalidate(key)
+    transaction.on_commit(lambda: token_cache.invalidate(key))
+
+
+# Cached tokens carry a copy of the user, so refresh them when it changes
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if not created:
+        pk = instance.pk
+        token_cache.invalidate_user(pk)
+        transaction.on_commit(lambda: token_cache.invalidate_user(pk))
+
+
+# Any member write (registration, update, photo change, deletion) moves the
+# list and member versions on, which invalidates cached reads and ETags. The
+# bump is repeated when the write commits (see bump_member_versions)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_member_cache_versions(sender, instance, **kwargs):
+    bump_member_versions(instance.pk)
+
+
+# Deletions reach delta sync clients (members/changes/) through a tombstone, whatever
+# deleted the member: the API, the admin or a cascade. Written in the deleting transaction
+@receiver(post_delete, sender=User)
+def record_member_tombstone(sender, instance, **kwargs):
+    MemberTombstone.objects.create(member_id=instance.pk)
+
+
+def install_search_index_after_migrate(sender, using, **kwargs):
+    install_search_index(using)
+
+
+# Time every query issued while a request is being measured
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
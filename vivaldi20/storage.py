@@ -0,0 +1,39 @@
+from django.core.files.storage import FileSystemStorage
+
+from .metrics import record_storage_call
+
+
+class TimedStorageMixin:
+    # Counts and times storage calls for the request metrics
+
+    def _open(self, name, mode='rb'):
+        with record_storage_call():
+            return super()._open(name, mode)
+
+    def _save(self, name, content):
+        with record_storage_call():
+            return super()._save(name, content)
+
+    def delete(self, name):
+        with record_storage_call():
+            return super().delete(name)
+
+    def exists(self, name):
+        with record_storage_call():
+            return super().exists(name)
+
+    def size(self, name):
+        with record_storage_call():
+            return super().size(name)
+
+    def listdir(self, path):
+        with record_storage_call():
+            return super().listdir(path)
+
+    def url(self, name, *args, **kwargs):
+        with record_storage_call():
+            return super().url(name, *args, **kwargs)
+
+
+class LocalStorage(TimedStorageMixin, FileSystemStorage):
+    pass
@@ -1,3 +1,1606 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from pathlib import Path
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import include, path, resolve, reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from . import routers
+from .benchmarks import (
+    BENCHMARK_CACHE_ALIAS,
+    SCENARIOS,
+    SEED_PASSWORD,
+    ApiBench,
+    benchmark_settings,
+    clear_caches,
+    photo_bytes,
+    run_scenario,
+    seed_members,
+)
+from .middleware import AdmissionControlMiddleware, ReplicaRoutingMiddleware
+from .models import PhotoBlob, StorageJob, User
+from .exports import EXPORT_FIELDS
+from .pagination import MemberCursorPagination
+from .renderers import ORJSONRenderer
+from .s3storage import S3Storage
+from .urls import build_urlpatterns
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='vivaldi20-tests-')
+
+# A cache every worker process would see, for code that refuses process-local ones
+SHARED_CACHE = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': tempfile.mkdtemp(prefix='vivaldi20-tests-cache-'),
+}
+
+# The API as routed with ASYNC_VIEWS on, for tests of the async views (ROOT_URLCONF='vivaldi20.tests')
+urlpatterns = [path('api/v1/', include(build_urlpatterns(async_views=True)))]
+
+# Fast hashing, local photo storage and the private cache that clear_caches() empties
+TEST_SETTINGS = dict(
+    benchmark_settings(),
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+    STORAGES={
+        'default': {'BACKEND': 'vivaldi20.storage.LocalStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    MEDIA_ROOT=MEDIA_ROOT,
+    MEDIA_URL='/media/',
+)
+
+
+@override_settings(**TEST_SETTINGS)
+class QueryBudgetTests(TestCase):
+    """
+    Every endpoint answers with its expected status within its query budget
+    (see benchmarks.SCENARIOS), with more members than fit on one page.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_members(MemberCursorPagination.max_page_size * 2)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.bench = ApiBench()
+
+    def test_query_budgets(self):
+        for scenario in SCENARIOS:
+            with self.subTest(scenario.name):
+                response, _, queries = run_scenario(self.bench, scenario)
+                self.assertEqual(response.status_code, scenario.status, getattr(response, 'data', None))
+                self.assertLessEqual(queries, scenario.query_budget)
+
+    def test_warm_cache_reads_skip_the_database(self):
+        list_scenario = next(scenario for scenario in SCENARIOS if scenario.name == 'members-list')
+        run_scenario(self.bench, list_scenario)
+        response, _, queries = run_scenario(self.bench, list_scenario, cold=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+    def test_list_queries_do_not_grow_with_members(self):
+        list_scenario = next(scenario for scenario in SCENARIOS if scenario.name == 'members-list')
+        _, _, before = run_scenario(self.bench, list_scenario)
+        seed_members(500)
+        _, _, after = run_scenario(self.bench, list_scenario)
+        self.assertEqual(before, after)
+
+    def test_clear_caches_leaves_shared_caches_alone(self):
+        caches['default'].set('not-a-benchmark-key', 1)
+        caches[BENCHMARK_CACHE_ALIAS].set('benchmark-key', 1)
+        clear_caches()
+        self.assertEqual(caches['default'].get('not-a-benchmark-key'), 1)
+        self.assertIsNone(caches[BENCHMARK_CACHE_ALIAS].get('benchmark-key'))
+
+    def test_every_route_has_a_scenario(self):
+        from .urls import urlpatterns
+
+        driven = {resolve(scenario.prepare(self.bench)[1].split('?')[0]).url_name for scenario in SCENARIOS}
+        self.assertEqual(driven, {pattern.name for pattern in urlpatterns})
+
+
+class RejectingBackend:
+    def authenticate(self, request, **credentials):
+        return None
+
+
+@override_settings(**TEST_SETTINGS)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+
+    def login(self, username, password='wrong', address='10.0.0.1'):
+        self.bench.client.credentials()
+        return self.bench.client.post(reverse('login'), {'username': username, 'password': password}, REMOTE_ADDR=address)
+
+    @override_settings(LOGIN_THROTTLE={'IP_RATE': '3/min', 'USERNAME_RATE': None, 'CACHE_ALIAS': BENCHMARK_CACHE_ALIAS})
+    def test_address_is_throttled_before_hashing(self):
+        for _ in range(3):
+            self.assertEqual(self.login(self.bench.member.username).status_code, 422)
+        with self.assertNumQueries(0):
+            response = self.login(self.bench.member.username, password=SEED_PASSWORD)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        # A spoofed X-Forwarded-For does not reset the window
+        response = self.bench.client.post(reverse('login'), {'username': 'x', 'password': 'y'}, REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='1.2.3.4')
+        self.assertEqual(response.status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE={'IP_RATE': None, 'USERNAME_RATE': '2/min', 'CACHE_ALIAS': BENCHMARK_CACHE_ALIAS})
+    def test_failed_logins_are_throttled_per_username(self):
+        username = self.bench.member.username
+        self.login(username, address='10.0.0.1')
+        self.login(username.upper(), address='10.0.0.2')
+        self.assertEqual(self.login(username, password=SEED_PASSWORD, address='10.0.0.3').status_code, 429)
+        self.assertEqual(self.login(self.bench.admin.username, address='10.0.0.1').status_code, 422)
+
+    @override_settings(LOGIN_THROTTLE={'IP_RATE': None, 'USERNAME_RATE': '2/min', 'CACHE_ALIAS': BENCHMARK_CACHE_ALIAS})
+    def test_successful_logins_are_not_counted(self):
+        username = self.bench.member.username
+        for _ in range(3):
+            self.assertEqual(self.login(username, password=SEED_PASSWORD).status_code, 200)
+        self.login(username)
+        self.assertEqual(self.login(username, password=SEED_PASSWORD).status_code, 200)
+
+    def test_login_goes_through_authenticate(self):
+        from unittest import mock
+
+        from django.contrib.auth.signals import user_login_failed
+
+        failures = []
+
+        def receiver(sender, credentials, request, **kwargs):
+            failures.append((credentials['username'], request))
+
+        user_login_failed.connect(receiver)
+        self.addCleanup(user_login_failed.disconnect, receiver)
+        self.assertEqual(self.login(self.bench.member.username).status_code, 422)
+        self.assertEqual(len(failures), 1)
+        self.assertEqual(failures[0][0], self.bench.member.username)
+        self.assertIsNotNone(failures[0][1])
+
+        # An unknown username costs one lookup and no password hash
+        with self.assertNumQueries(1), mock.patch('vivaldi20.models.User.check_password') as check_password:
+            response = self.login('nobody')
+        self.assertEqual(response.data['data']['errors'], {'username': ["User with that username does not exist."]})
+        check_password.assert_not_called()
+        self.assertEqual(len(failures), 2)
+
+        # Only the configured backends decide
+        with override_settings(AUTHENTICATION_BACKENDS=['vivaldi20.tests.RejectingBackend']):
+            response = self.login(self.bench.member.username, password=SEED_PASSWORD)
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(response.data['data']['errors'], {'password': ["The password entered is invalid."]})
+
+    def test_inactive_members_cannot_log_in(self):
+        self.bench.member.is_active = False
+        self.bench.member.save()
+        self.assertEqual(self.login(self.bench.member.username, password=SEED_PASSWORD).status_code, 422)
+
+    @override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher', 'django.contrib.auth.hashers.SHA1PasswordHasher'])
+    def test_login_rehashes_with_the_preferred_hasher(self):
+        from django.contrib.auth.hashers import make_password
+
+        member = self.bench.member
+        member.password = make_password(SEED_PASSWORD, hasher='sha1')
+        member.save(update_fields=['password'])
+
+        self.assertEqual(self.login(member.username, password=SEED_PASSWORD).status_code, 200)
+        member.refresh_from_db()
+        self.assertTrue(member.password.startswith('md5$'))
+
+
+class ImportMembersTests(TestCase):
+    def import_members(self, content):
+        path = Path(tempfile.mkdtemp(prefix='vivaldi20-import-')) / 'members.csv'
+        self.addCleanup(shutil.rmtree, path.parent)
+        path.write_text(content)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_members', str(path), workers=1, batch_size=2, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_skips_invalid_and_existing_rows(self):
+        content = (
+            'username,first_name,last_name,password\n'
+            'ada,Ada,Lovelace,analytical-1843\n'
+            'ada,Ada,Again,analytical-1843\n'
+            ',No,Name,secret-password\n'
+            'alan,Alan,Turing,bombe-1940\n'
+        )
+        stdout, stderr = self.import_members(content)
+        self.assertIn('Imported 2 members', stdout)
+        self.assertIn('Line 4:', stderr)
+        self.assertTrue(User.objects.get(username='alan').check_password('bombe-1940'))
+
+        # Running it again resumes: finished rows are skipped before hashing
+        stdout, _ = self.import_members(content)
+        self.assertIn('0 created, 2 already present, 2 invalid', stdout)
+        self.assertEqual(User.objects.filter(username__in=['ada', 'alan']).count(), 2)
+
+
+@override_settings(MEMBERS_CHANGES_SETTLE_SECONDS=0, **TEST_SETTINGS)
+class MemberChangesTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+
+    def sync(self, since=None, **params):
+        if since:
+            params['since'] = since
+        response = self.bench.call('get', reverse('member-changes') + '?' + '&'.join(f'{k}={v}' for k, v in params.items()), self.bench.member_token)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def test_sync_returns_only_changes_since_the_cursor(self):
+        first = self.sync(fields='id')
+        self.assertEqual({member['id'] for member in first['members']}, set(User.objects.values_list('id', flat=True)))
+        self.assertFalse(first['has_more'])
+
+        changed, removed = self.bench.new_member(), self.bench.new_member()
+        self.bench.call('patch', reverse('member-detail', args=[self.bench.admin.pk]), self.bench.member_token, {'bio': 'Changed'})
+        self.bench.call('delete', reverse('member-detail', args=[removed.pk]), self.bench.member_token)
+
+        delta = self.sync(first['cursor'], fields='id,bio')
+        self.assertEqual([member['id'] for member in delta['members']], [changed.pk, self.bench.admin.pk])
+        self.assertEqual(delta['deleted'], [removed.pk])
+        empty = self.sync(delta['cursor'])
+        self.assertEqual((empty['members'], empty['deleted']), ([], []))
+
+    def test_every_deletion_leaves_a_tombstone(self):
+        cursor = self.sync()['cursor']
+        direct, bulk = self.bench.new_member(), self.bench.new_member()
+        # Outside the API views, e.g. the admin or a shell
+        User.objects.get(pk=direct.pk).delete()
+        self.assertEqual(self.bench.call('post', reverse('bulk-delete-members'), self.bench.admin_token, {'ids': [bulk.pk]}).status_code, 200)
+        self.assertEqual(sorted(self.sync(cursor)['deleted']), [direct.pk, bulk.pk])
+
+    def test_written_thumbnails_reach_synced_clients(self):
+        from .jobs import run_due_jobs
+
+        with self.captureOnCommitCallbacks():
+            response = self.bench.call('patch', reverse('update-profile-photo', args=[self.bench.member.pk]), self.bench.member_token, {'profile_photo': photo_bytes()}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        cursor = self.sync(fields='id')['cursor']
+
+        run_due_jobs()
+        delta = self.sync(cursor, fields='id,profile_photo_thumbnails')
+        self.assertEqual([member['id'] for member in delta['members']], [self.bench.member.pk])
+        self.assertIsNotNone(delta['members'][0]['profile_photo_thumbnails'])
+
+    def test_sync_pages_through_changes(self):
+        seed_members(5)
+        cursor, seen = None, []
+        while True:
+            page = self.sync(cursor, fields='id', page_size=2)
+            seen += [member['id'] for member in page['members']]
+            cursor = page['cursor']
+            if not page['has_more']:
+                break
+        self.assertEqual(sorted(seen), sorted(User.objects.values_list('id', flat=True)))
+
+    def test_invalid_and_expired_cursors(self):
+        response = self.bench.call('get', reverse('member-changes') + '?since=nope', self.bench.member_token)
+        self.assertEqual(response.status_code, 400)
+
+        cursor = self.sync()['cursor']
+        with override_settings(MEMBERS_TOMBSTONE_RETENTION_DAYS=-1):
+            response = self.bench.call('get', reverse('member-changes') + '?since=' + cursor, self.bench.member_token)
+        self.assertEqual(response.status_code, 410)
+
+
+@override_settings(**TEST_SETTINGS)
+class TokenExpiryTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.detail = reverse('member-detail', args=[self.bench.member.pk])
+
+    def age_token(self, key, seconds):
+        Token.objects.filter(key=key).update(created=timezone.now() - timedelta(seconds=seconds))
+
+    def test_expired_token_is_rejected_and_replaced_on_login(self):
+        self.age_token(self.bench.member_token, settings.TOKEN_EXPIRY['TTL'])
+        self.assertEqual(self.bench.call('get', self.detail, self.bench.member_token).status_code, 401)
+
+        response = self.bench.call('post', reverse('login'), None, {'username': self.bench.member.username, 'password': SEED_PASSWORD})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['data']['token'], self.bench.member_token)
+
+    def test_use_slides_the_expiry(self):
+        self.age_token(self.bench.member_token, settings.TOKEN_EXPIRY['REFRESH_INTERVAL'])
+        self.assertEqual(self.bench.call('get', self.detail, self.bench.member_token).status_code, 200)
+        token = Token.objects.get(key=self.bench.member_token)
+        self.assertLess(timezone.now() - token.created, timedelta(seconds=60))
+
+        # The refreshed token is cached: only the member is read on the next request
+        with self.assertNumQueries(1):
+            self.bench.call('get', self.detail + '?fields=id', self.bench.member_token)
+
+    def test_sweep_deletes_expired_tokens_in_batches(self):
+        expired = [Token.objects.create(user=self.bench.new_member()).key for _ in range(5)]
+        for key in expired:
+            self.age_token(key, settings.TOKEN_EXPIRY['TTL'] + 1)
+
+        stdout = io.StringIO()
+        call_command('sweep_tokens', batch_size=2, pause=0, stdout=stdout)
+        self.assertIn('Deleted 5 expired token(s).', stdout.getvalue())
+        self.assertFalse(Token.objects.filter(key__in=expired).exists())
+        self.assertTrue(Token.objects.filter(key=self.bench.member_token).exists())
+
+
+
+REPLICATION_TEST_SETTINGS = dict(
+    TEST_SETTINGS,
+    DATABASE_REPLICATION={
+        'REPLICAS': ['replica_0'],
+        'VIEWS': ['list-members', 'member-detail'],
+        'STICKY_SECONDS': 5,
+        'CACHE_ALIAS': BENCHMARK_CACHE_ALIAS,
+    },
+)
+
+
+@override_settings(**REPLICATION_TEST_SETTINGS)
+class ReplicaRoutingTests(TestCase):
+    # Routing decisions only: the test databases have no replicas
+
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.factory = RequestFactory()
+        self.router = routers.ReplicaRouter()
+        self.middleware = ReplicaRoutingMiddleware(self.view)
+
+    def view(self, request):
+        # Where a read by the view would go, and the view's own write if any
+        response = HttpResponse(status=getattr(request, 'respond_with', 200))
+        response.read_from = self.router.db_for_read(User)
+        if request.method != 'GET':
+            self.router.db_for_write(User)
+        return response
+
+    def request(self, method, name, token=None, address='10.0.0.1', status=200, middleware=None, **kwargs):
+        request = getattr(self.factory, method)(reverse(name, kwargs=kwargs), REMOTE_ADDR=address)
+        if token:
+            request.META['HTTP_AUTHORIZATION'] = f'Token {token}'
+        request.respond_with = status
+        return (middleware or self.middleware)(request)
+
+    def test_reads_of_listed_views_go_to_a_replica(self):
+        self.assertEqual(self.request('get', 'list-members', self.bench.member_token).read_from, 'replica_0')
+        self.assertEqual(self.request('get', 'member-detail', self.bench.member_token, pk=1).read_from, 'replica_0')
+        self.assertEqual(self.request('get', 'member-detail', pk=1).read_from, 'replica_0')
+        self.assertIsNone(self.request('get', 'search-members', self.bench.member_token).read_from)
+        self.assertIsNone(self.router.db_for_read(User))
+
+    def test_member_reads_their_own_writes(self):
+        self.assertIsNone(self.request('patch', 'member-detail', self.bench.member_token, pk=1).read_from)
+        # The pin follows the member, not the address
+        self.assertIsNone(self.request('get', 'member-detail', self.bench.member_token, address='10.0.0.2', pk=1).read_from)
+        # Other members, and anonymous requests from the same address, keep reading from the replica
+        self.assertEqual(self.request('get', 'member-detail', self.bench.admin_token, pk=1).read_from, 'replica_0')
+        self.assertEqual(self.request('get', 'member-detail', pk=1).read_from, 'replica_0')
+
+    def test_failed_and_anonymous_writes_do_not_pin(self):
+        self.request('patch', 'member-detail', self.bench.member_token, status=400, pk=1)
+        self.request('post', 'register')
+        self.request('patch', 'member-detail', 'not-a-token', pk=1)
+        self.assertEqual(self.request('get', 'member-detail', self.bench.member_token, pk=1).read_from, 'replica_0')
+        self.assertEqual(self.request('get', 'member-detail', pk=1).read_from, 'replica_0')
+
+    def test_async_requests_are_routed_alike(self):
+        async def view(request):
+            return self.view(request)
+
+        middleware = ReplicaRoutingMiddleware(view)
+
+        @async_to_sync
+        async def request(*args, **kwargs):
+            return await self.request(*args, middleware=middleware, **kwargs)
+
+        self.assertEqual(request('get', 'member-detail', self.bench.member_token, pk=1).read_from, 'replica_0')
+        self.assertIsNone(request('patch', 'member-detail', self.bench.member_token, pk=1).read_from)
+        self.assertIsNone(request('get', 'member-detail', self.bench.member_token, pk=1).read_from)
+
+    def test_several_workers_require_a_shared_pin_cache(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        with override_settings(WEB_CONCURRENCY=4):
+            with self.assertRaises(ImproperlyConfigured):
+                ReplicaRoutingMiddleware(self.view)
+            with override_settings(CACHES=dict(settings.CACHES, **{BENCHMARK_CACHE_ALIAS: SHARED_CACHE})):
+                ReplicaRoutingMiddleware(self.view)
+
+    def test_write_moves_the_rest_of_the_request_to_the_primary(self):
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(User), 'replica_0')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            self.assertIsNone(self.router.db_for_read(User))
+        self.assertFalse(self.router.allow_migrate('replica_0', 'vivaldi20'))
+
+    def test_recent_writes_are_read_from_the_primary(self):
+        import time
+
+        with routers.replica_reads():
+            with routers.primary_if_written_since(time.time()):
+                self.assertFalse(routers.reading_from_replica())
+            self.assertTrue(routers.reading_from_replica())
+            with routers.primary_if_written_since(time.time() - 60):
+                self.assertTrue(routers.reading_from_replica())
+        # Outside replica reads there is nothing to do
+        with routers.primary_if_written_since(time.time()):
+            self.assertFalse(routers.reading_from_replica())
+
+    def test_tokens_missing_on_the_replica_are_looked_up_on_the_primary(self):
+        from unittest import mock
+
+        from rest_framework.authentication import TokenAuthentication
+        from rest_framework.exceptions import AuthenticationFailed
+
+        from .authentication import CachedTokenAuthentication
+
+        lookup = TokenAuthentication.authenticate_credentials
+        primary_lookups = []
+
+        def lagging_replica(authentication, key):
+            # A token issued moments ago, not replicated yet
+            if routers.reading_from_replica():
+                raise AuthenticationFailed('Invalid token.')
+            primary_lookups.append(key)
+            return lookup(authentication, key)
+
+        with mock.patch.object(TokenAuthentication, 'authenticate_credentials', lagging_replica):
+            with routers.replica_reads():
+                user, _ = CachedTokenAuthentication().authenticate_credentials(self.bench.member_token)
+                self.assertTrue(routers.reading_from_replica())
+        self.assertEqual((user, primary_lookups), (self.bench.member, [self.bench.member_token]))
+
+        async def lagging_async_replica(authentication, key):
+            return None if routers.reading_from_replica() else await get_token(authentication, key)
+
+        get_token = CachedTokenAuthentication._aget_token
+        clear_caches()
+        with mock.patch.object(CachedTokenAuthentication, '_aget_token', lagging_async_replica):
+            with routers.replica_reads():
+                user, _ = async_to_sync(CachedTokenAuthentication().aauthenticate_credentials)(self.bench.admin_token)
+        self.assertEqual(user, self.bench.admin)
+
+        # Unknown everywhere: still rejected
+        with routers.replica_reads():
+            with self.assertRaises(AuthenticationFailed):
+                CachedTokenAuthentication().authenticate_credentials('not-a-token')
+
+    def test_persistent_connections_only_under_wsgi(self):
+        import os
+        import subprocess
+        import sys
+
+        code = 'import config.%s; from django.conf import settings; print(settings.DATABASES["default"]["CONN_MAX_AGE"])'
+        env = {key: value for key, value in os.environ.items() if key not in ('CONN_MAX_AGE', 'DJANGO_ASGI')}
+        for server, expected in (('wsgi', '60'), ('asgi', '0')):
+            with self.subTest(server):
+                result = subprocess.run([sys.executable, '-c', code % server], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+                self.assertEqual(result.stdout.strip(), expected, result.stderr)
+
+
+@override_settings(**TEST_SETTINGS)
+class ResponseEncodingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        seed_members(30)
+        self.bench.client.credentials(HTTP_AUTHORIZATION='Token ' + self.bench.member_token)
+
+    def get(self, path, **headers):
+        return self.bench.client.get(path, **headers)
+
+    def test_renderer_matches_the_stock_renderer(self):
+        data = {
+            'members': [{'id': 1, 'bio': 'Caf\u00e9 \u2028 \U0001f3bb', 'joined': timezone.now(), 'fee': Decimal('1.50')}],
+            'message': gettext_lazy('Member not found.'),
+            7: None,
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_non_finite_floats_render_as_null(self):
+        # The stock renderer refuses them; orjson has no strict mode
+        data = {'nan': float('nan'), 'inf': float('inf')}
+        self.assertEqual(ORJSONRenderer().render(data), b'{"nan":null,"inf":null}')
+        with self.assertRaises(ValueError):
+            JSONRenderer().render(data)
+
+    def test_large_responses_are_compressed(self):
+        plain = self.get(reverse('list-members'))
+        response = self.get(reverse('list-members'), HTTP_ACCEPT_ENCODING='br;q=0, gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content)), json.loads(plain.content))
+
+        # The weakened ETag still validates
+        response = self.get(reverse('list-members'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_small_and_unaccepted_responses_are_not_compressed(self):
+        detail = reverse('member-detail', args=[self.bench.member.pk]) + '?fields=id'
+        self.assertFalse(self.get(detail, HTTP_ACCEPT_ENCODING='gzip').has_header('Content-Encoding'))
+        self.assertFalse(self.get(reverse('list-members'), HTTP_ACCEPT_ENCODING='identity').has_header('Content-Encoding'))
+
+    def test_streaming_responses_are_compressed(self):
+        plain = b''.join(self.get(reverse('export-members')).streaming_content)
+        response = self.get(reverse('export-members'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+
+@override_settings(ADMISSION_CONTROL={
+    'RETRY_AFTER': 3,
+    'SYNC_QUEUE_SIZE': 0,
+    'CLASSES': {
+        'auth': {'VIEWS': ['login'], 'CONCURRENCY': 1, 'QUEUE_SIZE': 0, 'QUEUE_TIMEOUT': 0},
+        'exports': {'VIEWS': ['export-members'], 'CONCURRENCY': 1, 'QUEUE_SIZE': 0, 'QUEUE_TIMEOUT': 0},
+    },
+})
+class AdmissionControlTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = AdmissionControlMiddleware(self.view)
+
+    def view(self, request):
+        if request.path == reverse('export-members'):
+            return StreamingHttpResponse(iter([b'id\n', b'1\n']))
+        return HttpResponse()
+
+    def request(self, name):
+        return self.middleware(self.factory.get(reverse(name)))
+
+    def test_full_class_is_refused_without_holding_back_reads(self):
+        limiter = self.middleware.limiters['auth']
+        self.assertTrue(limiter.acquire())
+        response = self.request('login')
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '3'))
+        self.assertEqual(self.request('list-members').status_code, 200)
+
+        limiter.release()
+        self.assertEqual(self.request('login').status_code, 200)
+        self.assertEqual(self.request('login').status_code, 200)
+
+    def test_streaming_response_keeps_its_slot_until_closed(self):
+        response = self.request('export-members')
+        self.assertEqual(self.request('export-members').status_code, 503)
+        self.assertEqual(b''.join(response.streaming_content), b'id\n1\n')
+        response.close()
+        response.close()
+        self.assertEqual(self.middleware.limiters['exports']._active, 0)
+        self.assertEqual(self.request('export-members').status_code, 200)
+
+    def test_unsent_streaming_response_releases_its_slot(self):
+        # Closed by the server before any chunk was read, e.g. the client went away
+        self.request('export-members').close()
+        self.assertEqual(self.request('export-members').status_code, 200)
+
+    def test_threads_do_not_queue_by_default(self):
+        from .admission import ConcurrencyLimiter
+
+        limiter = ConcurrencyLimiter(1, queue_size=4, queue_timeout=5)
+        self.assertTrue(limiter.acquire())
+        # Refused at once rather than blocking a worker thread for queue_timeout
+        self.assertFalse(limiter.acquire())
+
+        limiter = ConcurrencyLimiter(1, queue_size=4, queue_timeout=0.01, sync_queue_size=1)
+        self.assertTrue(limiter.acquire())
+        self.assertFalse(limiter.acquire())
+        self.assertEqual(len(limiter._waiters), 0)
+
+    def test_coroutines_queue_for_a_slot(self):
+        import asyncio
+
+        from .admission import ConcurrencyLimiter
+
+        limiter = ConcurrencyLimiter(1, queue_size=1, queue_timeout=5)
+
+        async def scenario():
+            self.assertTrue(await limiter.aacquire())
+            waiting = asyncio.ensure_future(limiter.aacquire())
+            await asyncio.sleep(0)
+            self.assertFalse(await limiter.aacquire())
+            limiter.release()
+            self.assertTrue(await waiting)
+            limiter.release()
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter._active, 0)
+
+
+@override_settings(**TEST_SETTINGS)
+class MemberResponseCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.list = reverse('list-members')
+        self.detail = reverse('member-detail', args=[self.bench.admin.pk])
+
+    def get(self, path, **headers):
+        self.bench.client.credentials(HTTP_AUTHORIZATION='Token ' + self.bench.member_token)
+        return self.bench.client.get(path, **headers)
+
+    def test_matching_etag_is_not_modified(self):
+        for path in (self.list, self.detail):
+            with self.subTest(path):
+                first = self.get(path)
+                self.assertEqual(first.status_code, 200)
+                self.assertEqual(first['Cache-Control'], 'private, no-cache')
+                for tag in (first['ETag'], 'W/' + first['ETag'], '"other", ' + first['ETag'], '*'):
+                    response = self.get(path, HTTP_IF_NONE_MATCH=tag)
+                    self.assertEqual(response.status_code, 304)
+                    self.assertEqual(response['ETag'], first['ETag'])
+                self.assertEqual(self.get(path, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_write_changes_the_etag(self):
+        before = {path: self.get(path)['ETag'] for path in (self.list, self.detail)}
+        self.bench.call('patch', self.detail, self.bench.admin_token, {'bio': 'Changed'})
+
+        for path, etag in before.items():
+            with self.subTest(path):
+                response = self.get(path, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['data']['bio'], 'Changed')
+
+    def test_versions_move_on_again_at_commit(self):
+        # A read between the write and its commit must not keep its ETag afterwards
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.bench.admin.bio = 'Changed'
+            self.bench.admin.save()
+            during = self.get(self.detail)['ETag']
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.get(self.detail, HTTP_IF_NONE_MATCH=during).status_code, 200)
+
+    def test_if_modified_since_alone_is_not_trusted(self):
+        # A write in the same second would otherwise be answered with 304
+        first = self.get(self.detail)
+        self.bench.call('patch', self.detail, self.bench.admin_token, {'bio': 'Changed'})
+        response = self.get(self.detail, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['bio'], 'Changed')
+
+    def test_versions_in_a_process_local_cache_expire(self):
+        from .caching import _version_timeout
+
+        self.assertEqual(_version_timeout(), settings.MEMBER_RESPONSE_CACHE['LOCAL_VERSION_TTL'])
+        with override_settings(CACHES=dict(settings.CACHES, **{BENCHMARK_CACHE_ALIAS: SHARED_CACHE})):
+            self.assertIsNone(_version_timeout())
+
+
+@override_settings(**TEST_SETTINGS)
+class MemberPaginationTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        seed_members(7)
+
+    def page(self, url):
+        response = self.bench.call('get', url, self.bench.member_token)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def test_cursor_links_walk_every_member_once(self):
+        url, seen = reverse('list-members') + '?page_size=3', []
+        while url:
+            page = self.page(url)
+            self.assertLessEqual(len(page['members']), 3)
+            seen += [member['id'] for member in page['members']]
+            url = page['next']
+        self.assertEqual(seen, list(User.objects.order_by('id').values_list('id', flat=True)))
+
+        previous = self.page(self.page(self.page(reverse('list-members') + '?page_size=3')['next'])['previous'])
+        self.assertEqual([member['id'] for member in previous['members']], seen[:3])
+
+    def test_page_size_is_bounded(self):
+        seed_members(MemberCursorPagination.max_page_size)
+        page = self.page(reverse('list-members') + '?page_size=100000')
+        self.assertEqual(len(page['members']), MemberCursorPagination.max_page_size)
+        page = self.page(reverse('list-members'))
+        self.assertEqual(len(page['members']), settings.MEMBERS_PAGE_SIZE)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.bench.call('get', reverse('list-members') + '?cursor=nope', self.bench.member_token)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(**TEST_SETTINGS)
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.detail = reverse('member-detail', args=[self.bench.member.pk]) + '?fields=id'
+
+    def get(self, token):
+        return self.bench.call('get', self.detail, token)
+
+    def test_cached_token_skips_the_token_query(self):
+        self.assertEqual(self.get(self.bench.member_token).status_code, 200)
+        # Cold response cache, warm token cache: only the member is read
+        caches[BENCHMARK_CACHE_ALIAS].clear()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get(self.bench.member_token).status_code, 200)
+
+    def test_logout_invalidates_the_cached_token(self):
+        self.assertEqual(self.get(self.bench.member_token).status_code, 200)
+        self.assertEqual(self.bench.call('post', reverse('logout'), self.bench.member_token).status_code, 200)
+        self.assertEqual(self.get(self.bench.member_token).status_code, 401)
+
+    def test_deleting_or_deactivating_the_member_invalidates_the_cached_token(self):
+        self.assertEqual(self.get(self.bench.admin_token).status_code, 200)
+        self.bench.admin.is_active = False
+        self.bench.admin.save()
+        self.assertEqual(self.get(self.bench.admin_token).status_code, 401)
+
+        self.assertEqual(self.get(self.bench.member_token).status_code, 200)
+        self.bench.member.delete()
+        self.assertEqual(self.get(self.bench.member_token).status_code, 401)
+
+    def test_token_cached_before_the_delete_commits_is_dropped(self):
+        from .authentication import token_cache
+
+        key = self.bench.member_token
+        token = Token.objects.get(key=key)
+        with self.captureOnCommitCallbacks(execute=True):
+            Token.objects.filter(key=key).delete()
+            # A concurrent request still sees the row until the commit
+            token_cache.set(key, token)
+        self.assertIsNone(token_cache.get(key))
+
+    def test_shared_cache_invalidates_across_workers(self):
+        from .authentication import TokenCache
+
+        with override_settings(CACHES={'default': SHARED_CACHE}):
+            caches['default'].clear()
+            token = Token.objects.get(key=self.bench.member_token)
+            worker, other_worker = TokenCache(10, 60, 'default'), TokenCache(10, 60, 'default')
+            worker.set(token.key, token)
+            self.assertEqual(other_worker.get(token.key), token)
+            other_worker.invalidate_user(token.user_id)
+            self.assertIsNone(worker.get(token.key))
+
+    def test_several_workers_require_a_shared_cache(self):
+        from django.core.exceptions import ImproperlyConfigured
+
+        from .authentication import TokenCache
+
+        options = dict(settings.TOKEN_AUTH_CACHE, CACHE_ALIAS=None)
+        with override_settings(WEB_CONCURRENCY=4, TOKEN_AUTH_CACHE=options):
+            with self.assertRaises(ImproperlyConfigured):
+                TokenCache.from_settings()
+        with override_settings(WEB_CONCURRENCY=4, TOKEN_AUTH_CACHE=dict(options, CACHE_ALIAS='default'), CACHES={'default': SHARED_CACHE}):
+            self.assertIsNotNone(TokenCache.from_settings().shared)
+
+
+class TestS3Storage(S3Storage):
+    # Class attributes rather than STORAGES OPTIONS, which Django 5.0 drops when
+    # STORAGES is overridden
+    bucket_name = 'vivaldi20-tests'
+    region_name = 'us-east-1'
+    custom_domain = None
+    endpoint_url = None
+
+
+S3_TEST_SETTINGS = dict(
+    TEST_SETTINGS,
+    STORAGES={
+        'default': {'BACKEND': 'vivaldi20.tests.TestS3Storage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    PROFILE_PHOTO_DIRECT_UPLOAD={'MAX_BYTES': 4096, 'EXPIRES_IN': 600},
+)
+
+
+@override_settings(**S3_TEST_SETTINGS)
+class DirectPhotoUploadTests(TestCase):
+    # Presign, upload and confirm against an in-memory S3 (moto)
+
+    def setUp(self):
+        from moto import mock_aws
+
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        default_storage.connection.meta.client.create_bucket(Bucket=default_storage.bucket_name)
+        clear_caches()
+        self.bench = ApiBench()
+        self.member = self.bench.member
+
+    def presign(self, content_type='image/jpeg'):
+        response = self.bench.call('post', reverse('profile-photo-upload-url', args=[self.member.pk]), self.bench.member_token, {'content_type': content_type})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def upload(self, upload, body, content_type='image/jpeg'):
+        import requests
+
+        fields = dict(upload['fields'], **{'Content-Type': content_type})
+        return requests.post(upload['url'], data=fields, files={'file': ('photo.jpg', body)})
+
+    def confirm(self, key):
+        return self.bench.call('post', reverse('profile-photo-confirm', args=[self.member.pk]), self.bench.member_token, {'key': key})
+
+    def test_presigned_upload_is_attached_on_confirm(self):
+        upload = self.presign()
+        self.assertTrue(upload['key'].startswith(f'profile_photos/uploads/{self.member.pk}/'))
+        self.assertIn(self.upload(upload, photo_bytes().read()).status_code, (200, 204))
+
+        response = self.confirm(upload['key'])
+        self.assertEqual(response.status_code, 200, response.data)
+        self.member.refresh_from_db()
+        self.assertEqual(self.member.profile_photo.name, upload['key'])
+        self.assertTrue(StorageJob.objects.filter(action=StorageJob.PHOTO_DERIVATIVES, path=upload['key']).exists())
+
+    def test_policy_pins_the_key_content_type_and_size(self):
+        import base64
+
+        upload = self.presign('image/png')
+        policy = json.loads(base64.b64decode(upload['fields']['policy']))
+        self.assertIn({'key': upload['key']}, policy['conditions'])
+        self.assertIn({'Content-Type': 'image/png'}, policy['conditions'])
+        self.assertIn(['content-length-range', 1, 4096], policy['conditions'])
+        self.assertTrue(upload['key'].endswith('.png'))
+
+    def test_confirm_rejects_oversize_and_other_content_types(self):
+        # The stand-in S3 does not enforce the policy, so confirm must check again
+        for body, content_type in ((b'x' * 4097, 'image/jpeg'), (b'<html>', 'text/html')):
+            with self.subTest(content_type):
+                upload = self.presign()
+                self.assertEqual(self.upload(upload, body, content_type).status_code, 204)
+                response = self.confirm(upload['key'])
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['data']['message'], "Uploaded file is not a valid profile photo.")
+        self.member.refresh_from_db()
+        self.assertFalse(self.member.profile_photo)
+
+    def test_confirm_rejects_keys_of_other_members_and_missing_objects(self):
+        other = self.bench.admin
+        for key in (f'profile_photos/uploads/{other.pk}/x.jpg', f'profile_photos/uploads/{self.member.pk}/../x.jpg', 'profile_photos/x.jpg'):
+            with self.subTest(key):
+                self.assertEqual(self.confirm(key).status_code, 400)
+
+        # Never uploaded
+        self.assertEqual(self.confirm(self.presign()['key']).status_code, 400)
+        self.member.refresh_from_db()
+        self.assertFalse(self.member.profile_photo)
+
+
+@override_settings(STORAGE_JOBS=dict(settings.STORAGE_JOBS, EAGER=True), **TEST_SETTINGS)
+class StorageJobTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+
+    def upload_photo(self, member, token):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.bench.call('patch', reverse('update-profile-photo', args=[member.pk]), token, {'profile_photo': photo_bytes()}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        member.refresh_from_db()
+        return member.profile_photo.name
+
+    def test_photo_is_deleted_from_storage_after_the_member(self):
+        name = self.upload_photo(self.bench.member, self.bench.member_token)
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.bench.call('delete', reverse('member-detail', args=[self.bench.member.pk]), self.bench.admin_token)
+        # The storage job, the member version bump and the token invalidation
+        self.assertEqual(len(callbacks), 3)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StorageJob.objects.exists())
+
+    def test_rolled_back_changes_leave_no_job(self):
+        from django.db import transaction
+
+        from .jobs import enqueue_storage_job
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(ZeroDivisionError), transaction.atomic():
+                enqueue_storage_job(StorageJob.DELETE, 'profile_photos/gone.jpg')
+                1 / 0
+        self.assertEqual(callbacks, [])
+        self.assertFalse(StorageJob.objects.exists())
+
+    def test_failed_job_is_retried_later(self):
+        from unittest import mock
+
+        from .jobs import enqueue_storage_job
+
+        with mock.patch('vivaldi20.jobs.storage_delete', side_effect=OSError('unavailable')), self.assertLogs('vivaldi20.jobs', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                job = enqueue_storage_job(StorageJob.DELETE, 'profile_photos/gone.jpg')
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('unavailable', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        # Not due yet
+        call_command('run_storage_jobs', stdout=io.StringIO())
+        self.assertTrue(StorageJob.objects.filter(pk=job.pk).exists())
+
+        StorageJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        stdout = io.StringIO()
+        call_command('run_storage_jobs', stdout=stdout)
+        self.assertIn('Ran 1 storage job(s), 0 failed.', stdout.getvalue())
+        self.assertFalse(StorageJob.objects.filter(pk=job.pk).exists())
+
+
+@override_settings(STORAGE_JOBS=dict(settings.STORAGE_JOBS, EAGER=True), **TEST_SETTINGS)
+class PhotoDerivativeTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.detail = reverse('member-detail', args=[self.bench.member.pk])
+
+    def upload_photo(self, photo, run_jobs=True):
+        with self.captureOnCommitCallbacks(execute=run_jobs):
+            response = self.bench.call('patch', reverse('update-profile-photo', args=[self.bench.member.pk]), self.bench.member_token, {'profile_photo': photo}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.bench.member.refresh_from_db()
+        return self.bench.member.profile_photo.name
+
+    def thumbnails(self):
+        return self.bench.call('get', self.detail, self.bench.member_token).data['data']['profile_photo_thumbnails']
+
+    def image(self, size, format):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (10, 120, 200)).save(buffer, format)
+        buffer.name = 'photo.' + format.lower()
+        buffer.seek(0)
+        return buffer
+
+    def test_thumbnails_are_offered_once_written(self):
+        from PIL import Image
+
+        from .jobs import run_due_jobs
+        from .photos import derivative_name
+
+        name = self.upload_photo(self.image((800, 600), 'JPEG'), run_jobs=False)
+        self.assertIsNone(self.thumbnails())
+
+        run_due_jobs()
+        thumbnails = self.thumbnails()
+        self.assertEqual(set(thumbnails), set(settings.PROFILE_PHOTO_DERIVATIVES['SIZES']))
+        for label, size in settings.PROFILE_PHOTO_DERIVATIVES['SIZES'].items():
+            for extension in settings.PROFILE_PHOTO_DERIVATIVES['FORMATS']:
+                with default_storage.open(derivative_name(name, label, extension)) as derivative:
+                    self.assertEqual(max(Image.open(derivative).size), size)
+
+        # Lists serialize from values() rows and from model instances alike
+        listed = self.bench.call('get', reverse('list-members') + '?fields=id,profile_photo_thumbnails', self.bench.member_token).data['data']['members']
+        self.assertEqual(next(member for member in listed if member['id'] == self.bench.member.pk)['profile_photo_thumbnails'], thumbnails)
+
+    def test_large_images_that_cannot_be_decoded_at_a_reduced_scale_are_skipped(self):
+        options = dict(settings.PROFILE_PHOTO_DERIVATIVES, MAX_DECODE_PIXELS=100 * 100)
+        with override_settings(PROFILE_PHOTO_DERIVATIVES=options), self.assertLogs('vivaldi20.photos', 'WARNING'):
+            self.upload_photo(self.image((400, 300), 'PNG'))
+        self.assertIsNone(self.thumbnails())
+
+        # JPEGs of the same size are decoded at a reduced scale
+        with override_settings(PROFILE_PHOTO_DERIVATIVES=options):
+            self.upload_photo(self.image((400, 300), 'JPEG'))
+        self.assertIsNotNone(self.thumbnails())
+
+    def test_backfill_queues_photos_without_derivatives(self):
+        name = self.upload_photo(self.image((200, 200), 'JPEG'), run_jobs=False)
+        StorageJob.objects.all().delete()
+        stdout = io.StringIO()
+        call_command('backfill_photo_derivatives', stdout=stdout)
+        self.assertIn('Queued derivatives for 1 photo(s).', stdout.getvalue())
+        call_command('backfill_photo_derivatives', stdout=stdout)
+        self.assertIn('Queued derivatives for 0 photo(s).', stdout.getvalue())
+
+        call_command('run_storage_jobs', stdout=stdout)
+        self.assertTrue(PhotoBlob.objects.get(name=name).derivatives_ready)
+        self.assertIsNotNone(self.thumbnails())
+
+
+@override_settings(STORAGE_JOBS=dict(settings.STORAGE_JOBS, EAGER=True), **TEST_SETTINGS)
+class ContentHashedPhotoTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.photo = photo_bytes().read()
+
+    def upload(self, member, token, content):
+        upload = io.BytesIO(content)
+        upload.name = 'photo.jpg'
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.bench.call('patch', reverse('update-profile-photo', args=[member.pk]), token, {'profile_photo': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        member.refresh_from_db()
+        return member.profile_photo.name
+
+    def test_same_content_is_stored_once(self):
+        import hashlib
+
+        name = self.upload(self.bench.member, self.bench.member_token, self.photo)
+        self.assertIn(hashlib.sha256(self.photo).hexdigest(), name)
+        self.assertEqual(self.upload(self.bench.admin, self.bench.admin_token, self.photo), name)
+        self.assertEqual(PhotoBlob.objects.get(name=name).ref_count, 2)
+        with default_storage.open(name) as stored:
+            self.assertEqual(stored.read(), self.photo)
+
+    def test_unreferenced_blob_is_stored_again(self):
+        # Its deletion may have been under way: the bytes are written again
+        name = self.upload(self.bench.member, self.bench.member_token, self.photo)
+        PhotoBlob.objects.filter(name=name).update(ref_count=0)
+        default_storage.delete(name)
+
+        self.assertEqual(self.upload(self.bench.admin, self.bench.admin_token, self.photo), name)
+        self.assertEqual(PhotoBlob.objects.get(name=name).ref_count, 1)
+        with default_storage.open(name) as stored:
+            self.assertEqual(stored.read(), self.photo)
+
+    def test_photo_is_deleted_with_its_last_reference(self):
+        from .photos import derivative_names
+
+        name = self.upload(self.bench.member, self.bench.member_token, self.photo)
+        self.upload(self.bench.admin, self.bench.admin_token, self.photo)
+        self.assertTrue(all(default_storage.exists(derivative) for derivative in derivative_names(name)))
+
+        # Replacing one member's photo keeps the shared blob
+        self.upload(self.bench.member, self.bench.member_token, photo_bytes().read())
+        self.assertEqual(PhotoBlob.objects.get(name=name).ref_count, 1)
+        self.assertTrue(default_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bench.call('delete', reverse('member-detail', args=[self.bench.admin.pk]), self.bench.member_token)
+        self.assertFalse(PhotoBlob.objects.filter(name=name).exists())
+        self.assertFalse(any(default_storage.exists(stored) for stored in [name] + derivative_names(name)))
+
+
+@override_settings(**TEST_SETTINGS)
+class BulkMembersTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+
+    def create(self, items, token=None):
+        return self.bench.call('post', reverse('bulk-members'), token or self.bench.admin_token, items)
+
+    def member(self, username, **fields):
+        return dict({'username': username, 'first_name': 'Bulk', 'last_name': 'Member', 'password': 'bulk-password'}, **fields)
+
+    def test_create_reports_each_member(self):
+        response = self.create([
+            self.member('bulk-a'),
+            self.member(self.bench.member.username),
+            self.member('bulk-b'),
+            self.member('bulk-twice'),
+            {'username': 'bulk-nopassword'},
+            self.member('bulk-twice'),
+        ])
+        self.assertEqual(response.status_code, 207, response.data)
+        results = response.data['data']['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'invalid', 'created', 'invalid', 'invalid', 'invalid'])
+        self.assertIn('username', results[1]['errors'])
+        self.assertEqual(results[3]['errors'], {'username': ["Duplicate username in this batch."]})
+        self.assertIn('password', results[4]['errors'])
+        self.assertEqual(response.data['data']['message'], "2 of 6 member accounts created.")
+
+        created = User.objects.get(username='bulk-a')
+        self.assertEqual(results[0]['member']['id'], created.pk)
+        self.assertNotIn('password', results[0]['member'])
+        self.assertTrue(created.check_password('bulk-password'))
+        self.assertFalse(User.objects.filter(username__in=['bulk-twice', 'bulk-nopassword']).exists())
+
+    def test_create_status_reflects_the_outcome(self):
+        self.assertEqual(self.create([self.member('bulk-a'), self.member('bulk-b')]).status_code, 201)
+        response = self.create([self.member('bulk-a')])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['data']['results'][0]['status'], 'invalid')
+
+        self.assertEqual(self.create({'username': 'not-a-list'}).status_code, 400)
+        self.assertEqual(self.create([]).status_code, 400)
+        too_many = [self.member('bulk-%d' % index) for index in range(settings.MEMBERS_BULK_CREATE_MAX_ITEMS + 1)]
+        self.assertEqual(self.create(too_many).status_code, 400)
+        self.assertEqual(self.create([self.member('bulk-c')], token=self.bench.member_token).status_code, 403)
+
+    def test_username_taken_during_the_request_fails_only_that_member(self):
+        from unittest import mock
+
+        from .serializers import BulkUserRegistrationListSerializer
+
+        validate = BulkUserRegistrationListSerializer.validate
+
+        def validate_then_race(serializer, attrs):
+            checked = validate(serializer, attrs)
+            User.objects.create(username='bulk-race')
+            return checked
+
+        with mock.patch.object(BulkUserRegistrationListSerializer, 'validate', validate_then_race):
+            response = self.create([self.member('bulk-a'), self.member('bulk-race')])
+        self.assertEqual(response.status_code, 207, response.data)
+        self.assertEqual([result['status'] for result in response.data['data']['results']], ['created', 'invalid'])
+        self.assertTrue(User.objects.filter(username='bulk-a').exists())
+
+    def test_update_and_delete(self):
+        first, second = self.bench.new_member(), self.bench.new_member()
+        response = self.bench.call('patch', reverse('bulk-members'), self.bench.admin_token, [
+            {'id': first.pk, 'bio': 'First'},
+            {'id': second.pk, 'profession': 'Designer'},
+        ])
+        self.assertEqual(response.status_code, 200, response.data)
+        first.refresh_from_db()
+        self.assertEqual(first.bio, 'First')
+
+        # Any invalid item rejects the whole update
+        response = self.bench.call('patch', reverse('bulk-members'), self.bench.admin_token, [
+            {'id': first.pk, 'bio': 'Again'},
+            {'id': 0, 'bio': 'Nobody'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['data'][1], {'id': ["Member not found."]})
+        first.refresh_from_db()
+        self.assertEqual(first.bio, 'First')
+
+        response = self.bench.call('post', reverse('bulk-delete-members'), self.bench.admin_token, {'ids': [first.pk, 0]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['results'], [{'id': first.pk, 'status': 'deleted'}, {'id': 0, 'status': 'not_found'}])
+        self.assertFalse(User.objects.filter(pk=first.pk).exists())
+
+
+@override_settings(MEMBERS_EXPORT={'CHUNK_SIZE': 4, 'WRITE_SIZE': 64}, **TEST_SETTINGS)
+class MemberExportTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        seed_members(9)
+
+    def export(self, query=''):
+        self.bench.client.credentials(HTTP_AUTHORIZATION='Token ' + self.bench.member_token)
+        response = self.bench.client.get(reverse('export-members') + query)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_lists_every_member_in_id_order(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="members.ndjson"')
+        members = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([member['id'] for member in members], list(User.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(list(members[0]), EXPORT_FIELDS)
+
+    def test_csv_with_selected_fields(self):
+        import csv
+
+        response, body = self.export('?output=csv&fields=username,id')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], ['id', 'username'])
+        self.assertEqual(rows[1:], [[str(pk), username] for pk, username in User.objects.order_by('id').values_list('id', 'username')])
+
+    def test_invalid_parameters_are_rejected(self):
+        for query in ('?output=xml', '?fields=password', '?fields=id,nope'):
+            with self.subTest(query):
+                self.assertEqual(self.bench.call('get', reverse('export-members') + query, self.bench.member_token).status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS)
+class MemberSearchTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        seed_members(5)
+
+    def search(self, q, **params):
+        query = '&'.join(f'{key}={value}' for key, value in dict(q=q, **params).items())
+        response = self.bench.call('get', reverse('search-members') + '?' + query, self.bench.member_token)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def ids(self, q):
+        return [member['id'] for member in self.search(q)['members']]
+
+    def test_index_follows_inserts_updates_and_deletes(self):
+        ada = User.objects.create(username='ada', first_name='Ada', last_name='Lovelace', bio='Analytical engine')
+        User.objects.bulk_create([User(username='grace', first_name='Grace', last_name='Hopper')])
+        grace = User.objects.get(username='grace')
+        self.assertEqual(self.ids('lovelace'), [ada.pk])
+        self.assertEqual(self.ids('hopper'), [grace.pk])
+
+        User.objects.filter(pk=ada.pk).update(last_name='Byron')
+        self.assertEqual(self.ids('lovelace'), [])
+        self.assertEqual(self.ids('byron'), [ada.pk])
+
+        ada.delete()
+        self.assertEqual(self.ids('byron'), [])
+        self.assertEqual(self.ids('analytical'), [])
+
+    def test_results_are_ranked_and_prefix_matched(self):
+        in_bio = User.objects.create(username='someone', bio='Plays the vivaldi concertos')
+        in_username = User.objects.create(username='vivaldi', bio='Composer')
+        User.objects.create(username='other', bio='Plays Bach')
+
+        self.assertEqual(self.ids('vivaldi'), [in_username.pk, in_bio.pk])
+        self.assertEqual(self.ids('viv'), [in_username.pk, in_bio.pk])
+        # Every word must match
+        self.assertEqual(self.ids('plays viv'), [in_bio.pk])
+        self.assertEqual(self.ids('!!!'), [])
+
+    def test_pages(self):
+        found = self.search('seeded', page_size=2)
+        self.assertEqual(len(found['members']), 2)
+        self.assertTrue(found['has_next'])
+        last = self.search('seeded', page_size=2, page=3)
+        self.assertEqual(len(last['members']), 1)
+        self.assertFalse(last['has_next'])
+
+
+@override_settings(**TEST_SETTINGS)
+class MemberListFilterTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        seed_members(10)
+
+    def ids(self, query):
+        response = self.bench.call('get', reverse('list-members') + '?page_size=200&' + query, self.bench.member_token)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [member['id'] for member in response.data['data']['members']]
+
+    def test_filters(self):
+        designers = User.objects.filter(profession='Designer').order_by('id')
+        self.assertEqual(self.ids('profession=Designer'), list(designers.values_list('id', flat=True)))
+
+        User.objects.filter(pk=self.bench.member.pk).update(is_active=False)
+        self.assertEqual(self.ids('is_active=false'), [self.bench.member.pk])
+
+        cutoff = timezone.now() - timedelta(days=1)
+        User.objects.filter(pk=self.bench.admin.pk).update(date_joined=cutoff - timedelta(days=1))
+        self.assertEqual(self.ids('date_joined_before=' + cutoff.isoformat().replace('+', '%2B')), [self.bench.admin.pk])
+        self.assertNotIn(self.bench.admin.pk, self.ids('date_joined_after=' + cutoff.isoformat().replace('+', '%2B')))
+
+    def test_orderings(self):
+        users = User.objects.all()
+        self.assertEqual(self.ids('ordering=-id'), list(users.order_by('-id').values_list('id', flat=True)))
+        self.assertEqual(self.ids('ordering=username'), list(users.order_by('username').values_list('id', flat=True)))
+        self.assertEqual(self.ids('ordering=-date_joined'), list(users.order_by('-date_joined', '-id').values_list('id', flat=True)))
+
+    def test_ordering_pages_are_stable(self):
+        # Ties on date_joined are broken by id across pages
+        User.objects.update(date_joined=timezone.now())
+        url, seen = reverse('list-members') + '?ordering=date_joined&page_size=3', []
+        while url:
+            data = self.bench.call('get', url, self.bench.member_token).data['data']
+            seen += [member['id'] for member in data['members']]
+            url = data['next']
+        self.assertEqual(seen, list(User.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_invalid_filters_are_rejected(self):
+        for query in ('ordering=password', 'is_active=maybe', 'date_joined_after=yesterday'):
+            with self.subTest(query):
+                response = self.bench.call('get', reverse('list-members') + '?' + query, self.bench.member_token)
+                self.assertEqual(response.status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS)
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.detail = reverse('member-detail', args=[self.bench.member.pk])
+
+    def get(self, path):
+        response = self.bench.call('get', path, self.bench.member_token)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['data']
+
+    def test_fields_limit_the_output(self):
+        self.assertEqual(self.get(self.detail + '?fields=username,id'), {'id': self.bench.member.pk, 'username': self.bench.member.username})
+        members = self.get(reverse('list-members') + '?fields=id')['members']
+        self.assertTrue(members and all(list(member) == ['id'] for member in members))
+
+    def test_default_output_matches_the_model_serializer(self):
+        from .serializers import UserSerializer
+
+        self.assertEqual(self.get(self.detail), UserSerializer(self.bench.member).data)
+
+    def test_fields_limit_the_columns_read(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get(self.detail + '?fields=id,first_name')
+        member_query = next(query['sql'] for query in queries if 'FROM "vivaldi20_user"' in query['sql'] and '"auth' not in query['sql'])
+        self.assertNotIn('"bio"', member_query)
+        self.assertIn('"first_name"', member_query)
+
+    def test_unknown_fields_are_rejected(self):
+        for query in ('?fields=password', '?fields=id,nope'):
+            with self.subTest(query):
+                self.assertEqual(self.bench.call('get', self.detail + query, self.bench.member_token).status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS)
+class SchemaDocsTests(SimpleTestCase):
+    def test_ui_pages_link_the_prebuilt_document(self):
+        from unittest import mock
+
+        from . import schema
+
+        with mock.patch.object(schema, 'get_schema_document') as get_document, mock.patch.object(schema, 'build_schema_document') as build:
+            for name in ('schema-swagger-ui', 'schema-redoc'):
+                with self.subTest(name):
+                    response = self.client.get(reverse(name))
+                    self.assertEqual(response.status_code, 200)
+                    self.assertIn(json.dumps(reverse('openapi-schema')), response.content.decode())
+                    self.assertIn('max-age=%d' % settings.OPENAPI_SCHEMA_MAX_AGE, response['Cache-Control'])
+        get_document.assert_not_called()
+        build.assert_not_called()
+
+    def test_document_is_served_and_revalidated(self):
+        response = self.client.get(reverse('openapi-schema'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/members/', json.loads(response.content)['paths'])
+        response = self.client.get(reverse('openapi-schema'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class StartupTests(SimpleTestCase):
+    # A fresh interpreter: this test process has long imported everything
+    PROBE = (
+        'import json, sys, config.wsgi\n'
+        'from django.conf import settings\n'
+        'from django.urls import get_resolver\n'
+        'get_resolver().url_patterns\n'
+        '%s\n'
+        'print(json.dumps({"storage": settings.STORAGES["default"]["BACKEND"], '
+        '"loaded": [name for name in ("drf_yasg", "boto3", "botocore", "storages.backends.s3", "PIL.Image") if name in sys.modules]}))'
+    )
+
+    def probe(self, code='pass', **environ):
+        import os
+        import subprocess
+        import sys
+
+        env = {key: value for key, value in os.environ.items() if not key.startswith('AWS_')}
+        env.update(DJANGO_SETTINGS_MODULE='config.settings', **environ)
+        result = subprocess.run([sys.executable, '-c', self.PROBE % code], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout)
+
+    def test_docs_and_storage_are_not_imported_at_startup(self):
+        self.assertEqual(self.probe(AWS_STORAGE_BUCKET_NAME='vivaldi20-tests')['loaded'], [])
+
+    def test_local_storage_without_aws_settings(self):
+        # Using the local storage does not load the S3 backend either
+        used = self.probe('from django.core.files.storage import default_storage; default_storage.exists("x")')
+        self.assertEqual(used, {'storage': 'vivaldi20.storage.LocalStorage', 'loaded': []})
+        self.assertEqual(self.probe(AWS_STORAGE_BUCKET_NAME='vivaldi20-tests')['storage'], 'vivaldi20.s3storage.S3Storage')
+
+    def test_startup_budget(self):
+        from django.core.management.base import CommandError
+
+        out = io.StringIO()
+        with override_settings(STARTUP_BUDGET_MS={'wsgi': 60_000, 'manage': 60_000}):
+            call_command('startup_budget', repeat=1, stdout=out)
+        self.assertIn('wsgi:', out.getvalue())
+        self.assertIn('manage:', out.getvalue())
+        with override_settings(STARTUP_BUDGET_MS={'wsgi': 0, 'manage': 60_000}):
+            with self.assertRaisesMessage(CommandError, 'Startup over budget: wsgi'):
+                call_command('startup_budget', repeat=1, stdout=io.StringIO())
+
+
+@override_settings(ROOT_URLCONF='vivaldi20.tests', **S3_TEST_SETTINGS)
+class AsyncViewsTests(TestCase):
+    # The async views as ASGI deployments route them, driven through AsyncClient
+
+    def setUp(self):
+        from moto import mock_aws
+
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        default_storage.connection.meta.client.create_bucket(Bucket=default_storage.bucket_name)
+        clear_caches()
+        self.bench = ApiBench()
+        self.member = self.bench.member
+        self.auth = {'Authorization': 'Token ' + self.bench.member_token}
+
+    def test_routes_use_the_async_views(self):
+        from . import async_views
+
+        for name, view in async_views.ASYNC_ROUTES.items():
+            with self.subTest(name):
+                pattern = next(pattern for pattern in build_urlpatterns(async_views=True) if pattern.name == name)
+                self.assertIs(pattern.callback, view)
+
+    async def test_login_and_authentication(self):
+        response = await self.async_client.get(reverse('list-members'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(json.loads(response.content), {'message': 'Unauthenticated.'})
+
+        response = await self.async_client.post(reverse('login'), {'username': self.member.username, 'password': 'wrong'})
+        self.assertEqual(response.status_code, 422)
+        response = await self.async_client.post(reverse('login'), {'username': self.member.username, 'password': SEED_PASSWORD})
+        self.assertEqual(response.status_code, 200)
+        token = json.loads(response.content)['data']['token']
+
+        response = await self.async_client.post(reverse('logout'), headers={'Authorization': 'Token ' + token})
+        self.assertEqual(response.status_code, 200)
+        response = await self.async_client.get(reverse('list-members'), headers={'Authorization': 'Token ' + token})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_detail_matches_the_drf_view(self):
+        from .views import member_detail_view
+
+        path = reverse('member-detail', args=[self.member.pk]) + '?fields=id,username'
+        response = await self.async_client.get(path, headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'data': {'id': self.member.pk, 'username': self.member.username}})
+
+        request = RequestFactory().get(path, HTTP_AUTHORIZATION=self.auth['Authorization'])
+        sync_response = await sync_to_async(lambda: member_detail_view(request, pk=self.member.pk).render())()
+        self.assertEqual(response.content, sync_response.content)
+
+        response = await self.async_client.get(reverse('member-detail', args=[0]), headers=self.auth)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_cached_reads_answer_304(self):
+        for path in (reverse('list-members'), reverse('member-detail', args=[self.member.pk])):
+            with self.subTest(path):
+                response = await self.async_client.get(path, headers=self.auth)
+                self.assertEqual(response.status_code, 200)
+                response = await self.async_client.get(path, headers={**self.auth, 'If-None-Match': response['ETag']})
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.content, b'')
+
+    async def test_content_negotiation(self):
+        path = reverse('member-detail', args=[self.member.pk])
+        # The browsable API and unacceptable types are answered by the DRF view
+        response = await self.async_client.get(path, headers={**self.auth, 'Accept': 'text/html'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        response = await self.async_client.get(path, headers={**self.auth, 'Accept': 'application/xml'})
+        self.assertEqual(response.status_code, 406)
+        response = await self.async_client.get(path + '?format=json', headers={**self.auth, 'Accept': 'text/html'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    async def test_writes_go_to_the_drf_view(self):
+        path = reverse('member-detail', args=[self.member.pk])
+        response = await self.async_client.patch(path, {'first_name': 'Async'}, content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['data']['member']['first_name'], 'Async')
+
+    async def test_photo_upload(self):
+        from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+        path = reverse('update-profile-photo', args=[self.member.pk])
+        body = encode_multipart(BOUNDARY, {'profile_photo': photo_bytes()})
+        response = await self.async_client.patch(path, body, content_type=MULTIPART_CONTENT, headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        await self.member.arefresh_from_db()
+        self.assertEqual(await sync_to_async(default_storage.size)(self.member.profile_photo.name), len(photo_bytes().read()))
+
+    async def test_photo_upload_url_and_confirm(self):
+        upload_url = reverse('profile-photo-upload-url', args=[self.member.pk])
+        response = await self.async_client.post(upload_url, {'content_type': 'image/jpeg'}, content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        key = json.loads(response.content)['data']['key']
+
+        confirm_url = reverse('profile-photo-confirm', args=[self.member.pk])
+        response = await self.async_client.post(confirm_url, {'key': key}, content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content)['data']['message'], "Uploaded photo not found.")
+
+        await sync_to_async(default_storage.save)(key, photo_bytes())
+        response = await self.async_client.post(confirm_url, {'key': key}, content_type='application/json', headers=self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['data']['member']['id'], self.member.pk)
+        await self.member.arefresh_from_db()
+        self.assertEqual(self.member.profile_photo.name, key)
+
+
+@override_settings(**TEST_SETTINGS)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        self.bench = ApiBench()
+        self.detail = reverse('member-detail', args=[self.bench.member.pk])
+
+    def metrics(self, **headers):
+        return self.client.get(reverse('metrics'), headers=headers)
+
+    def test_metrics_need_a_token(self):
+        with override_settings(REQUEST_METRICS=dict(settings.REQUEST_METRICS, METRICS_TOKEN=None)):
+            self.assertEqual(self.metrics().status_code, 404)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.metrics().status_code, 200)
+
+        with override_settings(REQUEST_METRICS=dict(settings.REQUEST_METRICS, METRICS_TOKEN='scrape')):
+            self.assertEqual(self.metrics().status_code, 401)
+            self.assertEqual(self.metrics(Authorization='Bearer wrong').status_code, 401)
+            self.bench.call('get', self.detail, self.bench.member_token)
+            response = self.metrics(Authorization='Bearer scrape')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_requests_total{view="member-detail",method="GET",status="200"}', response.content.decode())
+        self.assertIn('http_request_db_queries_bucket{view="member-detail",method="GET"', response.content.decode())
+
+    def test_server_timing_is_opt_in(self):
+        self.assertNotIn('Server-Timing', self.bench.call('get', self.detail, self.bench.member_token))
+
+        with override_settings(REQUEST_METRICS=dict(settings.REQUEST_METRICS, SERVER_TIMING=True)):
+            from .middleware import RequestMetricsMiddleware
+
+            # The middleware reads its options when it is built
+            response = RequestMetricsMiddleware(lambda request: HttpResponse())(RequestFactory().get('/'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="0 queries", storage;dur=[\d.]+;desc="0 calls", render;dur=[\d.]+, total;dur=[\d.]+$')
+
+    @override_settings(REQUEST_METRICS=dict(settings.REQUEST_METRICS, SERVER_TIMING=True))
+    def test_render_time_ends_with_rendering(self):
+        import re
+        import time
+
+        from rest_framework.response import Response
+
+        from .middleware import RequestMetricsMiddleware
+
+        def handler(request):
+            response = Response({'data': 1})
+            response.accepted_renderer, response.accepted_media_type, response.renderer_context = JSONRenderer(), 'application/json', {}
+            response = middleware.process_template_response(request, response)
+            response.render()
+            # Inner middleware such as compression is not rendering
+            time.sleep(0.05)
+            return response
+
+        middleware = RequestMetricsMiddleware(handler)
+        response = middleware(RequestFactory().get('/'))
+        render, total = (float(value) for value in re.findall(r'(?:render|total);dur=([\d.]+)', response['Server-Timing']))
+        self.assertLess(render, 50)
+        self.assertGreaterEqual(total, 50)
+
+    def test_storage_calls_and_queries_are_counted(self):
+        from . import metrics
+
+        stats = metrics.RequestStats(10)
+        token = metrics.current_stats.set(stats)
+        try:
+            default_storage.exists('missing.jpg')
+            User.objects.count()
+        finally:
+            metrics.current_stats.reset(token)
+        self.assertEqual((stats.storage_count, stats.query_count), (1, 1))
+
+    def test_slow_requests_are_logged_with_their_queries(self):
+        from .middleware import RequestMetricsMiddleware
+
+        def view(request):
+            User.objects.count()
+            return HttpResponse()
+
+        with override_settings(REQUEST_METRICS=dict(settings.REQUEST_METRICS, SLOW_REQUEST_MS=0)):
+            middleware = RequestMetricsMiddleware(view)
+        with self.assertLogs('vivaldi20.requests', 'WARNING') as logs:
+            middleware(RequestFactory().get('/slow/'))
+        self.assertIn('Slow request GET /slow/', logs.output[0])
+        self.assertIn('1 queries', logs.output[0])
+        self.assertIn('COUNT(*)', logs.output[0])
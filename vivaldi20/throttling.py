@@ -0,0 +1,67 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class LoginThrottle(SimpleRateThrottle):
+    """
+    Sliding-window limit on login attempts, checked before any password is
+    hashed. The history lives in the LOGIN_THROTTLE cache: in-process by
+    default, shared by all workers when that alias points at e.g. Redis.
+    """
+
+    rate_setting = None
+
+    @property
+    def cache(self):
+        return caches[settings.LOGIN_THROTTLE['CACHE_ALIAS']]
+
+    def get_rate(self):
+        # Read per request rather than from DEFAULT_THROTTLE_RATES, which DRF binds at import
+        return settings.LOGIN_THROTTLE[self.rate_setting]
+
+
+class LoginIPThrottle(LoginThrottle):
+    scope = 'login_ip'
+    rate_setting = 'IP_RATE'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class LoginUsernameThrottle(LoginThrottle):
+    # Caps failed guesses against one account, from however many addresses.
+    # Only failures are recorded (see record_failure), so the owner's own
+    # logins never use up the window
+    scope = 'login_username'
+    rate_setting = 'USERNAME_RATE'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username')
+        if not isinstance(username, str) or not username:
+            return None
+        ident = hashlib.sha256(username.casefold().encode()).hexdigest()
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def throttle_success(self):
+        return True
+
+    def record_failure(self, request):
+        if self.rate is None:
+            return
+        key = self.get_cache_key(request, None)
+        if key is None:
+            return
+        now = self.timer()
+        history = [when for when in self.cache.get(key, []) if when > now - self.duration]
+        history.insert(0, now)
+        self.cache.set(key, history, self.duration)
+
+
+def record_failed_login(request):
+    LoginUsernameThrottle().record_failure(request)
+
+
+LOGIN_THROTTLES = [LoginIPThrottle, LoginUsernameThrottle]
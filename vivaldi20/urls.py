@@ -1,43 +1,67 @@
+from django.conf import settings
 from django.urls import path
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 
+from .schema import schema_ui_view
 from .views import (
+    openapi_schema_view,
+    metrics_view,
     login_view,
     logout_view,
     user_registration_view,
     list_members_view,
     member_detail_view,
-    update_profile_photo_view
+    update_profile_photo_view,
+    profile_photo_upload_url_view,
+    confirm_profile_photo_upload_view,
+    bulk_members_view,
+    bulk_delete_members_view,
+    export_members_view,
+    member_changes_view,
+    search_members_view,
 )
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Vivaldi Channel API",
-        default_version='v1',
-        description="API documentation for Vivaldi Channel App",
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
 
-)
 
+def build_urlpatterns(async_views=False):
+    """
+    The API routes. With `async_views` (ASGI deployments) the native async
+    versions serve the auth, member read and photo endpoints.
+    """
+    async_routes = {}
+    if async_views:
+        from .async_views import ASYNC_ROUTES as async_routes
+
+    def route(pattern, view, name):
+        return path(pattern, async_routes.get(name, view), name=name)
+
+    return [
+        # Swagger
+        # The UI pages only embed a link to the precomputed schema, see openapi_schema_view
+        route('swagger.json', openapi_schema_view, 'openapi-schema'),
+        route('swagger/', schema_ui_view('swagger'), 'schema-swagger-ui'),
+        route('redoc/', schema_ui_view('redoc'), 'schema-redoc'),
+
+        # Prometheus metrics
+        route('metrics/', metrics_view, 'metrics'),
 
-urlpatterns = [
-    # Swagger
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+        # User authentication endpoints
+        route('login/', login_view, 'login'),
+        route('logout/', logout_view, 'logout'),
 
-    # User authentication endpoints
-    path('login/', login_view, name='login'),
-    path('logout/', logout_view, name='logout'),
+        # User registration
+        route('register/', user_registration_view, 'register'),
 
-    # User registration
-    path('register/', user_registration_view, name='register'),
+        # Member management
+        route('members/', list_members_view, 'list-members'),
+        route('members/<int:pk>/', member_detail_view, 'member-detail'),
+        route('members/bulk/', bulk_members_view, 'bulk-members'),
+        route('members/bulk/delete/', bulk_delete_members_view, 'bulk-delete-members'),
+        route('members/export/', export_members_view, 'export-members'),
+        route('members/search/', search_members_view, 'search-members'),
+        route('members/changes/', member_changes_view, 'member-changes'),
+        route('members/<int:id>/update-profile-photo/', update_profile_photo_view, 'update-profile-photo'),
+        route('members/<int:id>/profile-photo/upload-url/', profile_photo_upload_url_view, 'profile-photo-upload-url'),
+        route('members/<int:id>/profile-photo/confirm/', confirm_profile_photo_upload_view, 'profile-photo-confirm'),
+    ]
 
-    # Member management
-    path('members/', list_members_view, name='list-members'),
-    path('members/<int:pk>/', member_detail_view, name='member-detail'),
-    path('members/<int:id>/update-profile-photo/', update_profile_photo_view, name='update-profile-photo'),
 
-]
+urlpatterns = build_urlpatterns(settings.ASYNC_VIEWS)
@@ -1,21 +1,88 @@
-import os
-from django.utils import timezone
-from django.core.files.storage import default_storage
-from django.contrib.auth import authenticate
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.authtoken.views import ObtainAuthToken
 
 from rest_framework.authtoken.models import Token
 from rest_framework.exceptions import AuthenticationFailed
-from drf_yasg.utils import swagger_auto_schema
 from django.utils.translation import gettext as _
-from .serializers import UserRegistrationSerializer, UserSerializer
+from .serializers import (
+    UserRegistrationSerializer,
+    UserSerializer,
+    ProfilePhotoUploadSerializer,
+    ProfilePhotoConfirmSerializer,
+    BulkMemberDeleteSerializer,
+    MemberExportSerializer,
+    MemberSearchSerializer,
+    MemberListFilterSerializer,
+    MemberFieldsSerializer,
+    MemberChangesSerializer,
+    InvalidItem,
+    member_columns,
+    serialize_member_rows,
+)
 from .models import User
+from .changes import ExpiredCursor, encode_cursor, member_changes
+from .pagination import MEMBER_ORDERINGS, MemberCursorPagination
+from .exports import EXPORT_FIELDS, export_members_response
+from .search import search_member_ids
+from .docs import swagger_auto_schema
+from .schema import get_schema_document
+from .metrics import render_metrics
+from .authentication import check_login, issue_token
+from .throttling import LOGIN_THROTTLES, record_failed_login
+from .caching import MEMBERS_SCOPE, member_scope, cached_member_response, bump_member_versions
+from .photos import (
+    ALLOWED_PHOTO_CONTENT_TYPES,
+    ContentHashUploadHandler,
+    DirectUploadNotSupported,
+    attach_photo,
+    new_upload_key,
+    presigned_photo_upload,
+    release_photo,
+    store_uploaded_photo,
+    uploaded_photo_metadata,
+)
 
 
+# OpenAPI Schema View (Function Based)
+@swagger_auto_schema(method='get', auto_schema=None)
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def openapi_schema_view(request):
+    # Precomputed document: one build per process, revalidated by ETag afterwards
+    document, fingerprint = get_schema_document()
+    etag = quote_etag(fingerprint)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(document, content_type='application/json')
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.OPENAPI_SCHEMA_MAX_AGE)
+    return response
+
+# Metrics View (Function Based)
+# Prometheus scrape target for the request metrics of this process
+@swagger_auto_schema(method='get', auto_schema=None)
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def metrics_view(request):
+    token = settings.REQUEST_METRICS['METRICS_TOKEN']
+    if not token and not settings.DEBUG:
+        # Not published until a scrape token is configured
+        return Response({"message": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+    if token and not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return Response({"message": "Unauthenticated."}, status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # User Registration View (Function Based)
 @swagger_auto_schema(method='post', request_body=UserRegistrationSerializer)
 @api_view(['POST'])
@@ -30,71 +97,29 @@ def user_registration_view(request):
 # Login View (Function Based)
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes(LOGIN_THROTTLES)
 def login_view(request):
     # Extract username and password from request data
     username = request.data.get('username')
     password = request.data.get('password')
 
     # Validate that username and password are provided
-    if not username:
-        return Response({
-            "data": {
-                "message": "Username is required.",
-                "errors": {
-                    "username": ["This field is required."]
-                }
-            }
-        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-
-    if not password:
-        return Response({
-            "data": {
-                "message": "Password is required.",
-                "errors": {
-                    "password": ["This field is required."]
-                }
-            }
-        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    missing = _missing_credentials_response(username, password)
+    if missing is not None:
+        return missing
 
-    # Authenticate the user
-    user = authenticate(username=username, password=password)
+    # Authenticate the user (the throttles above have already run)
+    user, user_exists = check_login(request, username, password)
 
     if user is None:
         # If user is not found or password is incorrect
-        if User.objects.filter(username=username).exists():
-            return Response({
-                "data": {
-                    "message": "The password entered is invalid.",
-                    "errors": {
-                        "password": ["The password entered is invalid."]
-                    }
-                }
-            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
-        else:
-            return Response({
-                "data": {
-                    "message": "User with that username does not exist.",
-                    "errors": {
-                        "username": ["User with that username does not exist."]
-                    }
-                }
-            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        record_failed_login(request)
+        return _invalid_credentials_response(user_exists)
 
-    # If the user is authenticated, get or create the token
-    token, created = Token.objects.get_or_create(user=user)
+    # If the user is authenticated, get the token (a new one once it has expired)
+    token = issue_token(user)
 
-    return Response({
-        "data": {
-            "user": {
-                "id": user.id,
-                "name": user.first_name,
-                "username": user.username,
-                "profession": user.profession,
-                "profile_photo_url": user.profile_photo.url if user.profile_photo else None
-            },
-            "token": token.key
-        }
-    }, status=status.HTTP_200_OK)
+    return _login_response(user, token)
 
 # Logout View (Function Based)
 @api_view(['POST'])
@@ -107,31 +132,92 @@ def logout_view(request):
         return Response({"data": {"message": "Token not found."}}, status=status.HTTP_400_BAD_REQUEST)
 
 # List Members View (Function Based)
+@swagger_auto_schema(method='get', query_serializer=MemberListFilterSerializer)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_members_view(request):
-    users = User.objects.all()
-    serializer = UserSerializer(users, many=True)
+    return cached_member_response(request, MEMBERS_SCOPE, lambda: _member_list_response(request))
+
+# Search Members View (Function Based)
+# Ranked full-text search over username, names, profession and bio
+@swagger_auto_schema(method='get', query_serializer=MemberSearchSerializer)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_members_view(request):
+    serializer = MemberSearchSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    page = serializer.validated_data['page']
+    page_size = serializer.validated_data['page_size']
+    # One extra id tells whether another page follows
+    ids = search_member_ids(serializer.validated_data['q'], page_size + 1, (page - 1) * page_size)
+    users = User.objects.in_bulk(ids[:page_size])
+    serializer = UserSerializer([users[pk] for pk in ids[:page_size] if pk in users], many=True)
     return Response({
         "data": {
-            "members": serializer.data
+            "members": serializer.data,
+            "page": page,
+            "page_size": page_size,
+            "has_next": len(ids) > page_size,
         }
     }, status=status.HTTP_200_OK)
 
+# Member Changes View (Function Based)
+# Delta sync: members created, updated or deleted since the cursor of the previous sync
+@swagger_auto_schema(method='get', query_serializer=MemberChangesSerializer)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def member_changes_view(request):
+    params = MemberChangesSerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response({"data": params.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    fields = params.member_fields
+    try:
+        rows, deleted, position, has_more = member_changes(
+            params.validated_data.get('since'), member_columns(fields), params.validated_data['page_size'],
+        )
+    except ExpiredCursor:
+        return Response({"data": {"message": "Cursor expired, sync again without since."}}, status=status.HTTP_410_GONE)
+
+    return Response({
+        "data": {
+            "members": serialize_member_rows(rows, fields),
+            "deleted": deleted,
+            "cursor": encode_cursor(position),
+            "has_more": has_more,
+        }
+    })
+
+# Export Members View (Function Based)
+# Streams the whole directory as NDJSON or CSV with constant memory
+@swagger_auto_schema(method='get', query_serializer=MemberExportSerializer)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_members_view(request):
+    serializer = MemberExportSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    fields = serializer.validated_data.get('fields', EXPORT_FIELDS)
+    return export_members_response(serializer.validated_data['output'], fields)
+
 # Member Detail View with CRUD operations (Function Based)
+@swagger_auto_schema(method='get', query_serializer=MemberFieldsSerializer)
 @api_view(['GET', 'PUT', 'PATCH', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def member_detail_view(request, pk):
+    if request.method == 'GET':
+        # Reads go through the versioned response cache before touching the database
+        return cached_member_response(request, member_scope(pk), lambda: _member_detail_response(request, pk))
+
     try:
         user = User.objects.get(pk=pk)
     except User.DoesNotExist:
         return Response({"message": "Member not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    if request.method == 'GET':
-        serializer = UserSerializer(user)
-        return Response({"data": serializer.data})
-
-    elif request.method in ['PUT', 'PATCH']:
+    if request.method in ['PUT', 'PATCH']:
         partial = request.method == 'PATCH'
         serializer = UserSerializer(user, data=request.data, partial=partial)
         if serializer.is_valid():
@@ -145,58 +231,292 @@ def member_detail_view(request, pk):
         return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
     elif request.method == 'DELETE':
-        # Delete the existing profile photo if it exists before deleting the user
-        if user.profile_photo:
-            try:
-                default_storage.delete(user.profile_photo.name)
-            except Exception as e:
-                return Response({"data": {"message": "Error deleting profile photo"}}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        # Now delete the user
-        user.delete()
+        with transaction.atomic():
+            # The profile photo is removed from storage in the background once the delete
+            # commits and no other member shares it
+            if user.profile_photo:
+                release_photo(user.profile_photo.name)
+
+            # Leaves a tombstone for delta sync (see signals.py)
+            user.delete()
         return Response({"data": {"message": "User deleted successfully."}})
 
+# Bulk Members View (Function Based)
+# POST creates each valid member of a list and reports the others; PATCH updates a
+# list of members in one transaction
+@swagger_auto_schema(method='post', request_body=UserRegistrationSerializer(many=True))
+@swagger_auto_schema(method='patch', request_body=UserSerializer(many=True))
+@api_view(['POST', 'PATCH'])
+@permission_classes([IsAdminUser])
+def bulk_members_view(request):
+    max_items = settings.MEMBERS_BULK_MAX_ITEMS
+
+    if request.method == 'POST':
+        serializer = UserRegistrationSerializer(data=request.data, many=True, allow_empty=False, max_length=settings.MEMBERS_BULK_CREATE_MAX_ITEMS)
+        if not serializer.is_valid():
+            return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = []
+        for index, item in enumerate(serializer.save()):
+            if isinstance(item, InvalidItem):
+                results.append({"index": index, "status": "invalid", "errors": item.errors})
+            else:
+                results.append({"index": index, "status": "created", "member": UserRegistrationSerializer(item).data})
+        created = sum(result["status"] == "created" for result in results)
+        if created:
+            # bulk_create sends no post_save, so move the cached list on explicitly
+            bump_member_versions()
+
+        if created == len(results):
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            "data": {
+                "message": f"{created} of {len(results)} member accounts created.",
+                "results": results,
+            }
+        }, status=response_status)
+
+    items = request.data if isinstance(request.data, list) else []
+    ids = [item.get('id') for item in items if isinstance(item, dict)]
+    users = User.objects.in_bulk([pk for pk in ids if isinstance(pk, int)])
+    serializer = UserSerializer(users, data=request.data, many=True, partial=True, max_length=max_items)
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    users = serializer.save()
+    bump_member_versions(*(user.pk for user in users))
+    return Response({
+        "data": {
+            "message": f"{len(users)} members updated successfully.",
+            "results": [{"index": index, "status": "updated", "member": member} for index, member in enumerate(serializer.data)]
+        }
+    })
+
+# Bulk Delete Members View (Function Based)
+@swagger_auto_schema(method='post', request_body=BulkMemberDeleteSerializer)
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def bulk_delete_members_view(request):
+    serializer = BulkMemberDeleteSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    ids = serializer.validated_data['ids']
+    if len(ids) > settings.MEMBERS_BULK_MAX_ITEMS:
+        return Response({"data": {"ids": [f"Ensure this field has no more than {settings.MEMBERS_BULK_MAX_ITEMS} elements."]}}, status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        members = User.objects.filter(id__in=ids)
+        found = dict(members.values_list('id', 'profile_photo'))
+        for photo in found.values():
+            if photo:
+                release_photo(photo)
+        members.delete()
+
+    return Response({
+        "data": {
+            "message": f"{len(found)} members deleted successfully.",
+            "results": [{"id": pk, "status": "deleted" if pk in found else "not_found"} for pk in ids]
+        }
+    })
+
+def _member_list_response(request):
+    filters = MemberListFilterSerializer(data=request.query_params)
+    if not filters.is_valid():
+        return Response({"data": filters.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    fields = filters.member_fields
+    paginator = MemberCursorPagination()
+    paginator.ordering = MEMBER_ORDERINGS[filters.validated_data['ordering']]
+
+    # Read only the columns the fields and the cursor need, as plain dicts
+    columns = dict.fromkeys(member_columns(fields) + [field.lstrip('-') for field in paginator.ordering])
+    rows = paginator.paginate_queryset(filters.filter_queryset(User.objects.values(*columns)), request)
+    return paginator.get_paginated_response(serialize_member_rows(rows, fields))
+
+def _member_detail_response(request, pk):
+    params = MemberFieldsSerializer(data=request.query_params)
+    if not params.is_valid():
+        return Response({"data": params.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    fields = params.member_fields
+    row = User.objects.filter(pk=pk).values(*member_columns(fields)).first()
+    if row is None:
+        return Response({"message": "Member not found."}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response({"data": serialize_member_rows([row], fields)[0]})
+
 # Update Profile Photo View (Function Based)
 @api_view(['PATCH'])
 @permission_classes([IsAuthenticated])
 def update_profile_photo_view(request, id):
+    # Hash the photo while it is being received, before anything parses the body
+    hasher = ContentHashUploadHandler(request)
+    request.upload_handlers.insert(0, hasher)
+
     try:
         user = User.objects.get(id=id)
     except User.DoesNotExist:
         return Response({"data": {"message": "User not found."}}, status=status.HTTP_404_NOT_FOUND)
 
     if 'profile_photo' in request.FILES:
-        # Delete the existing profile photo if it exists using the storage backend
-        if user.profile_photo:
-            try:
-                # Check if the file exists and delete it using the storage backend's name
-                default_storage.delete(user.profile_photo.name)
-            except Exception as e:
-                return Response({"data": {"message": "Error updating profile photo"}}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
         # Get the uploaded file
         uploaded_file = request.FILES['profile_photo']
 
-        # Generate the new file name using user's name and current time
-        current_time = timezone.now().strftime("%Y%m%d%H%M%S")
-        user_name = user.username.replace(" ", "_")  # or use another unique field like email
-        file_extension = os.path.splitext(uploaded_file.name)[1]
-        new_file_name = f"{user_name}_profile_{current_time}{file_extension}"
+        with transaction.atomic():
+            # Stored under its content hash; the previous photo is released and
+            # removed in the background once nobody references it
+            store_uploaded_photo(user, uploaded_file, hasher.digests['profile_photo'])
+
+        return _photo_updated_response(user)
+
+    return Response({"data": {"message": "No photo provided."}}, status=status.HTTP_400_BAD_REQUEST)
+
+# Profile Photo Upload URL View (Function Based)
+# Step one of the direct upload flow: hand out a presigned POST for a fresh key
+@swagger_auto_schema(method='post', request_body=ProfilePhotoUploadSerializer)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def profile_photo_upload_url_view(request, id):
+    try:
+        user = User.objects.get(id=id)
+    except User.DoesNotExist:
+        return Response({"data": {"message": "User not found."}}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = ProfilePhotoUploadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    content_type = serializer.validated_data['content_type']
+    key = new_upload_key(user, content_type)
+    try:
+        upload = presigned_photo_upload(key, content_type)
+    except DirectUploadNotSupported:
+        return _direct_upload_not_supported_response()
+
+    return _photo_upload_url_response(key, upload)
 
-        # Save the new file with the generated name
-        user.profile_photo.save(new_file_name, uploaded_file)
+# Confirm Profile Photo Upload View (Function Based)
+# Step two: check the object landed in the bucket and attach it to the member
+@swagger_auto_schema(method='post', request_body=ProfilePhotoConfirmSerializer)
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def confirm_profile_photo_upload_view(request, id):
+    try:
+        user = User.objects.get(id=id)
+    except User.DoesNotExist:
+        return Response({"data": {"message": "User not found."}}, status=status.HTTP_404_NOT_FOUND)
+
+    serializer = ProfilePhotoConfirmSerializer(data=request.data, context={'user': user})
+    if not serializer.is_valid():
+        return Response({"data": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+    key = serializer.validated_data['key']
+    try:
+        metadata = uploaded_photo_metadata(key)
+    except DirectUploadNotSupported:
+        return _direct_upload_not_supported_response()
+
+    invalid = _invalid_uploaded_photo_response(metadata)
+    if invalid is not None:
+        return invalid
+
+    with transaction.atomic():
+        # The bytes are already in storage: only the row needs updating
+        attach_photo(user, key)
 
-        # Save the user object with the new profile photo
-        user.save()
+    return _photo_updated_response(user)
 
-        # Serialize the user data and return the response
-        serializer = UserSerializer(user)
-        response_data = {
+def _direct_upload_not_supported_response():
+    return Response({"data": {"message": "Direct uploads are not supported by the configured storage."}}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+def _photo_upload_url_response(key, upload):
+    return Response({
+        "data": {
+            "key": key,
+            "url": upload['url'],
+            "fields": upload['fields'],
+            "expires_in": settings.PROFILE_PHOTO_DIRECT_UPLOAD['EXPIRES_IN'],
+        }
+    }, status=status.HTTP_200_OK)
+
+def _invalid_uploaded_photo_response(metadata):
+    # `metadata` is what uploaded_photo_metadata found in the bucket
+    if metadata is None:
+        return Response({"data": {"message": "Uploaded photo not found."}}, status=status.HTTP_400_BAD_REQUEST)
+
+    size, content_type = metadata
+    if content_type not in ALLOWED_PHOTO_CONTENT_TYPES or size > settings.PROFILE_PHOTO_DIRECT_UPLOAD['MAX_BYTES']:
+        return Response({"data": {"message": "Uploaded file is not a valid profile photo."}}, status=status.HTTP_400_BAD_REQUEST)
+
+    return None
+
+def _photo_updated_response(user):
+    serializer = UserSerializer(user)
+    return Response({
+        "data": {
+            "message": "Profile photo updated successfully.",
+            "member": serializer.data  # This contains the updated member details
+        }
+    }, status=status.HTTP_200_OK)
+
+def _missing_credentials_response(username, password):
+    if not username:
+        return Response({
             "data": {
-                "message": "Profile photo updated successfully.",
-                "member": serializer.data  # This contains the updated member details
+                "message": "Username is required.",
+                "errors": {
+                    "username": ["This field is required."]
+                }
+            }
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    if not password:
+        return Response({
+            "data": {
+                "message": "Password is required.",
+                "errors": {
+                    "password": ["This field is required."]
+                }
+            }
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    return None
+
+def _invalid_credentials_response(user_exists):
+    if user_exists:
+        return Response({
+            "data": {
+                "message": "The password entered is invalid.",
+                "errors": {
+                    "password": ["The password entered is invalid."]
+                }
+            }
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    return Response({
+        "data": {
+            "message": "User with that username does not exist.",
+            "errors": {
+                "username": ["User with that username does not exist."]
             }
         }
-        return Response(response_data, status=status.HTTP_200_OK)
+    }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
-    return Response({"data": {"message": "No photo provided."}}, status=status.HTTP_400_BAD_REQUEST)
+def _login_response(user, token):
+    return Response({
+        "data": {
+            "user": {
+                "id": user.id,
+                "name": user.first_name,
+                "username": user.username,
+                "profession": user.profession,
+                "profile_photo_url": user.profile_photo.url if user.profile_photo else None
+            },
+            "token": token.key
+        }
+    }, status=status.HTTP_200_OK)